@@ -7,16 +7,18 @@ import zipfile
 import tempfile
 import json
 
-from tools.corpus import corpify, clean
-from tools.content import add, delete, listContents
-from tools.arag_ops import create, create_spec, create_from_spec, package, unpackage
-from tools.index import index
-from tools.retrieval import query
+# Subcommands import the tools they run, so the CLI starts without loading numpy, apsw or the
+# embedding and document libraries it does not need. Check with benchmarks/startup.py.
 from tools.helpers import is_packaged
 
 import globals
 
 def main():
+    # Options shared by every command
+    instrument_parser = argparse.ArgumentParser(add_help=False)
+    instrument_parser.add_argument('--metrics-json', metavar='PATH', help="Write per-stage wall/CPU times, rows, bytes, API calls and cache hits to PATH as JSON ('-' for stderr)")
+    instrument_parser.add_argument('--profile', metavar='PATH', help="Write a cProfile dump of the command to PATH")
+
     # Set up the main argument parser
     parser = argparse.ArgumentParser(description="CLI tool 'arag' for managing .arag files")
     subparsers = parser.add_subparsers(dest='subcommand', required=True, help="Available commands")
@@ -26,16 +28,16 @@ def main():
     create_subparsers = create_parser.add_subparsers(dest='create_type', required=True, help="Create commands")
 
     # 'create dir'
-    dir_parser = create_subparsers.add_parser('dir', help="Create a new .arag directory")
+    dir_parser = create_subparsers.add_parser('dir', parents=[instrument_parser], help="Create a new .arag directory")
     dir_parser.add_argument('arag_name', help="Name of the .arag file to create")
     dir_parser.add_argument('path', help="Directory path where the .arag file will be created")
 
     # 'create spec'
-    spec_parser = create_subparsers.add_parser('spec', help="Create a template .arag.json file")
+    spec_parser = create_subparsers.add_parser('spec', parents=[instrument_parser], help="Create a template .arag.json file")
     spec_parser.add_argument('destination_path', help="Path to save the .arag.json file")
 
     # 'create from-spec'
-    from_spec_parser = create_subparsers.add_parser('from-spec', help="Create a packaged .arag from a .arag.json file")
+    from_spec_parser = create_subparsers.add_parser('from-spec', parents=[instrument_parser], help="Create a packaged .arag from a .arag.json file")
     from_spec_parser.add_argument('spec_file', help="Path to the .arag.json file")
 
     # 'content' subcommand
@@ -43,30 +45,36 @@ def main():
     content_subparsers = content_parser.add_subparsers(dest='content_subcommand', required=True, help="Content commands")
 
     # 'content add'
-    add_parser = content_subparsers.add_parser('add', help="Add a file or directory to the .arag file")
+    add_parser = content_subparsers.add_parser('add', parents=[instrument_parser], help="Add a file or directory to the .arag file")
     add_parser.add_argument('path', help="Path to a file or directory to add")
     add_parser.add_argument('--arag', help="Path to the .arag file")
+    add_parser.add_argument('--dedup', action='store_true', help="Store files once by content hash, linking duplicates instead of copying them (not kept by package: an unpackaged arag holds plain copies)")
 
     # 'content del'
-    del_parser = content_subparsers.add_parser('del', help="Delete a file or directory from the .arag file")
+    del_parser = content_subparsers.add_parser('del', parents=[instrument_parser], help="Delete a file or directory from the .arag file")
     del_parser.add_argument('target', help="File or directory to delete, relative to .arag/content/")
     del_parser.add_argument('--arag', help="Path to the .arag file")
 
     # 'content ls'
-    ls_parser = content_subparsers.add_parser('ls', help="List contents of the .arag file")
+    ls_parser = content_subparsers.add_parser('ls', parents=[instrument_parser], help="List contents of the .arag file")
     ls_parser.add_argument('--arag', help="Path to the .arag file")
 
     # 'content clean'
-    clean_parser = content_subparsers.add_parser('clean', help="Clean the content folder by removing files not in corpus.db")
+    clean_parser = content_subparsers.add_parser('clean', parents=[instrument_parser], help="Clean the content folder by removing files not in corpus.db")
     clean_parser.add_argument('--arag', help="Path to the .arag file")
 
     # 'content corpify'
-    corpify_parser = content_subparsers.add_parser('corpify', help="Corpify the content in the .arag file")
+    corpify_parser = content_subparsers.add_parser('corpify', parents=[instrument_parser], help="Corpify the content in the .arag file")
     corpify_parser.add_argument('--arag', help="Path to the .arag file")
-    corpify_parser.add_argument('--chunk-size', type=int, default=8192, help="Chunk size in bytes")
-    corpify_parser.add_argument('--force', action='store_true', help="Force removal of existing corpus folder")
+    corpify_parser.add_argument('--chunk-size', type=int, help="Chunk size in bytes (default: 8192, or the corpus's with --incremental)")
+    corpify_parser.add_argument('--overlap', type=int, help="Bytes repeated from the end of each chunk at the start of the next (default: 0, or the corpus's with --incremental)")
+    corpify_parser.add_argument('--boundary', choices=['paragraph', 'sentence', 'line'], help="End chunks on a paragraph, sentence or line break when possible (default: the corpus's with --incremental)")
+    corpify_parser.add_argument('--force', action='store_true', help="Force removal of existing corpus folder (with --incremental, re-chunk every file if the chunking options changed)")
     corpify_parser.add_argument('-y', '--yes', action='store_true', help="Assume yes to all prompts")
     corpify_parser.add_argument('--clean', action='store_true', help="Automatically clean content folder after successful corpification")
+    corpify_parser.add_argument('--incremental', action='store_true', help="Update an existing corpus, re-extracting only added or changed files")
+    corpify_parser.add_argument('--jobs', type=int, default=1, help="Number of processes extracting and chunking files (-1 for one per CPU core)")
+    corpify_parser.add_argument('--fts', action='store_true', help="Also build a full-text index for 'query --mode bm25|hybrid'")
 
 
 
@@ -75,31 +83,74 @@ def main():
     open_parser.add_argument('arag_path', help="Path to the .arag file to open")
 
     # 'index' subcommand
-    index_parser = subparsers.add_parser('index', help="Generate the index in the .arag file")
+    index_parser = subparsers.add_parser('index', parents=[instrument_parser], help="Generate the index in the .arag file")
     index_parser.add_argument('--arag', help="Path to the .arag file")
-    index_parser.add_argument('--method', choices=['openai', 'local'], default='local', help="Embedding generation method")
-    index_parser.add_argument('--model', help="Embedding model name")
+    index_parser.add_argument('--method', choices=['openai', 'local', 'hash'], default='local', help="Embedding generation method ('hash' is offline feature hashing, no model needed)")
+    index_parser.add_argument('--model', help="Embedding model name ('hash-<dimensions>' for --method hash, default hash-1024)")
     index_parser.add_argument('--api-key', help="OpenAI API key")
     index_parser.add_argument('--force', action='store_true', help="Force reindexing by removing existing embeddings")
     index_parser.add_argument('--endpoint', help="OpenAI API endpoint")  # Added endpoint argument
+    index_parser.add_argument('--batch-size', type=int, default=globals.DEFAULT_INDEX_BATCH_SIZE, help="Number of chunks embedded and committed per batch")
+    index_parser.add_argument('--concurrency', type=int, default=globals.DEFAULT_OPENAI_CONCURRENCY, help="OpenAI embedding requests in flight at once")
+    index_parser.add_argument('--rpm', type=int, help="OpenAI requests per minute allowed (default: no limit, only back off on 429)")
+    index_parser.add_argument('--tpm', type=int, help="OpenAI tokens per minute allowed (default: no limit, only back off on 429)")
+    index_parser.add_argument('--max-retries', type=int, default=globals.DEFAULT_OPENAI_MAX_RETRIES, help="Retries of an OpenAI request failing with 429 or 5xx")
+    index_parser.add_argument('--max-request-inputs', type=int, help="Chunks per OpenAI request at most (default: 2048, the API's limit), for compatible servers with a lower limit")
+    index_parser.add_argument('--no-reuse', action='store_true', help="Embed every chunk instead of reusing stored embeddings for unchanged text")
+    index_parser.add_argument('--migrate', action='store_true', help="Convert JSON embeddings to float32 BLOBs without re-embedding")
+    index_parser.add_argument('--ann', choices=['ivf', 'hnsw'], help="Also build an approximate nearest neighbour index")
+    index_parser.add_argument('--nlist', type=int, help="Number of IVF lists (default: sqrt of the number of embeddings)")
+    index_parser.add_argument('--nprobe', type=int, help="Default number of IVF lists scanned per query (default: twice the square root of the number of lists, at least 8; higher is slower with better recall)")
+    index_parser.add_argument('--hnsw-m', type=int, help="HNSW graph degree (default: 16)")
+    index_parser.add_argument('--ef-construction', type=int, help="HNSW build-time candidate list size (default: 200)")
+    index_parser.add_argument('--ef', type=int, help="Default HNSW query-time candidate list size")
+    index_parser.add_argument('--quantize', choices=['int8', 'binary'], help="Also store quantized embeddings for a faster first-stage scan")
+    index_parser.add_argument('--quantize-only', action='store_true', help="Keep the float embeddings only in the matrix file used for rescoring: 'arag package' leaves them out of corpus.db")
+    index_parser.add_argument('--rescore-dtype', choices=['float32', 'float16'], default='float32', help="Precision of the matrix kept with --quantize-only (float16 halves it; not with --ann)")
 
     # 'query' subcommand
-    query_parser = subparsers.add_parser('query', help="Vector query the corpus with a string")
+    query_parser = subparsers.add_parser('query', parents=[instrument_parser], help="Vector query the corpus with a string")
     query_parser.add_argument('--arag', help="Path to the .arag file")
     query_parser.add_argument('--topk', type=int, default=1, help="Number of top results to return")
     query_parser.add_argument('--api-key', help="OpenAI API key")
     query_parser.add_argument('--get-file', action='store_true', help="Return the relative file path instead of content")
-    query_parser.add_argument('query_string', help="The query string")
+    query_parser.add_argument('query_string', nargs='?', help="The query string")
+    query_parser.add_argument('--batch', metavar='PATH', help="Answer every query in a text or JSONL file ('-' for stdin), printing JSONL results")
     query_parser.add_argument('--endpoint', help="OpenAI API endpoint")  # Added endpoint argument
+    query_parser.add_argument('--mode', choices=['dense', 'bm25', 'hybrid'], default='dense', help="Rank chunks by embedding similarity, BM25 over the full-text index, or both fused")
+    query_parser.add_argument('--exact', action='store_true', help="Scan every embedding instead of using the ANN index")
+    query_parser.add_argument('--nprobe', type=int, help="IVF lists scanned per query (higher is slower with better recall)")
+    query_parser.add_argument('--ef', type=int, help="HNSW candidate list size (higher is slower with better recall)")
+    query_parser.add_argument('--no-cache', action='store_true', help="Do not use the on-disk query embedding cache")
+    query_parser.add_argument('--cache-size', type=int, help="Maximum query embedding cache size in MB (default: 64)")
+    query_parser.add_argument('--page-cache', type=int, help="Page cache size in MB for packaged arags (default: 32)")
+    query_parser.add_argument('--rescore', type=int, help=f"Candidates rescored per result with quantized embeddings (default: {globals.DEFAULT_RESCORE_FACTOR})")
+
 
+    # 'serve' subcommand
+    serve_parser = subparsers.add_parser('serve', parents=[instrument_parser], help="Keep one or more arags loaded and answer queries over HTTP")
+    serve_parser.add_argument('arag_paths', nargs='*', help="Paths to the .arag files to serve")
+    serve_parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    serve_parser.add_argument('--port', type=int, default=8765, help="TCP port to listen on")
+    serve_parser.add_argument('--socket', help="Listen on this Unix socket path instead of TCP")
+    serve_parser.add_argument('--api-key', help="OpenAI API key")
+    serve_parser.add_argument('--endpoint', help="OpenAI API endpoint")
+    serve_parser.add_argument('--mode', choices=['dense', 'bm25', 'hybrid'], default='dense', help="Default query mode, requests may override it")
+    serve_parser.add_argument('--no-cache', action='store_true', help="Do not use the on-disk query embedding cache")
+    serve_parser.add_argument('--cache-size', type=int, help="Maximum query embedding cache size in MB (default: 64)")
+    serve_parser.add_argument('--page-cache', type=int, help="Page cache size in MB for each packaged arag (default: 32)")
+    serve_parser.add_argument('--verbose', action='store_true', help="Log every request")
 
     # 'package' subcommand
-    package_parser = subparsers.add_parser('package', help="Package an .arag directory into a .arag file")
+    package_parser = subparsers.add_parser('package', parents=[instrument_parser], help="Package an .arag directory into a .arag file")
     package_parser.add_argument('arag_path', nargs='?', help="Path to the .arag directory to package")
     package_parser.add_argument('--remove-original', action='store_true', help="Remove the original arag directory after packaging")
+    package_parser.add_argument('--compress-level', type=int, default=globals.DEFAULT_COMPRESS_LEVEL, help="Deflate level 0-9 of content files (0 stores them uncompressed)")
+    package_parser.add_argument('--jobs', type=int, default=-1, help="Number of compression threads (-1 for one per CPU core)")
+    package_parser.add_argument('--update', action='store_true', help="Update an existing .arag file, recompressing only new or modified content files")
 
     # 'unpackage' subcommand
-    unpackage_parser = subparsers.add_parser('unpackage', help="Unpackage a .arag file into a .arag directory")
+    unpackage_parser = subparsers.add_parser('unpackage', parents=[instrument_parser], help="Unpackage a .arag file into a .arag directory")
     unpackage_parser.add_argument('arag_path', nargs='?', help="Path to the .arag file to unpackage")
     unpackage_parser.add_argument('--remove-original', action='store_true', help="Remove the original .arag file after unpackaging")
 
@@ -132,7 +183,7 @@ def main():
                         continue
                     try:
                         cmd_args = parser.parse_args(command_args)
-                        exit_interactive = execute_command(cmd_args, active_arag)
+                        exit_interactive = run_command(cmd_args, active_arag)
                         if exit_interactive:
                             break
                     except SystemExit:
@@ -144,7 +195,18 @@ def main():
             print(f"Arag {arag_path} does not exist")
     else:
         # Handle standalone commands
-        execute_command(args, active_arag=None)
+        run_command(args, active_arag=None)
+
+def run_command(args, active_arag=None):
+    """Execute the parsed command, collecting metrics or a profile if it asks for them."""
+    metrics_path = getattr(args, 'metrics_json', None)
+    profile_path = getattr(args, 'profile', None)
+    if not metrics_path and not profile_path:
+        return execute_command(args, active_arag)
+    from tools import metrics
+    label = ' '.join(str(part) for part in (args.subcommand, getattr(args, 'content_subcommand', None),
+                                            getattr(args, 'create_type', None)) if part)
+    return metrics.run(label, execute_command, args, active_arag, metrics_path=metrics_path, profile_path=profile_path)
 
 def execute_command(args, active_arag=None):
     """Execute the parsed command, using the active .arag file if applicable."""
@@ -162,23 +224,34 @@ def execute_command(args, active_arag=None):
                 print("Error: Modification is not supported for packaged .arag files")
                 return
         if content_subcommand == 'add':
-            add(arag_path, args.path)
+            from tools.content import add
+            add(arag_path, args.path, dedup=args.dedup)
         elif content_subcommand == 'del':
+            from tools.content import delete
             delete(arag_path, args.target)
         elif content_subcommand == 'ls':
+            from tools.content import listContents
             listContents(arag_path)
         elif content_subcommand == 'clean':
+            from tools.corpus import clean
             clean(arag_path)
         elif content_subcommand == 'corpify':
             options = {
                 'chunk_size': args.chunk_size,
+                'overlap': args.overlap,
+                'boundary': args.boundary,
                 'force': args.force,
                 'yes': args.yes,
-                'clean': args.clean
+                'clean': args.clean,
+                'incremental': args.incremental,
+                'jobs': args.jobs,
+                'fts': args.fts
             }
+            from tools.corpus import corpify
             corpify(arag_path, options)
         return False
     elif args.subcommand == 'create':
+        from tools.arag_ops import create, create_spec, create_from_spec
         if args.create_type == 'dir':
             if not os.path.isdir(args.path):
                 print(f"Path {args.path} does not exist or is not a directory")
@@ -200,12 +273,32 @@ def execute_command(args, active_arag=None):
         if is_packaged(arag_path):
             print("Error: Modification is not supported for packaged .arag files")
             return
+        from tools.index import index, migrate
+        if args.migrate:
+            migrate(arag_path, {'batch_size': args.batch_size})
+            return False
         options = {
             'method': args.method,
             'model': args.model,
             'api_key': args.api_key,
             'force': args.force,
-            'endpoint': args.endpoint  # Pass endpoint
+            'endpoint': args.endpoint,  # Pass endpoint
+            'batch_size': args.batch_size,
+            'concurrency': args.concurrency,
+            'rpm': args.rpm,
+            'tpm': args.tpm,
+            'max_retries': args.max_retries,
+            'max_request_inputs': args.max_request_inputs,
+            'no_reuse': args.no_reuse,
+            'ann': args.ann,
+            'nlist': args.nlist,
+            'nprobe': args.nprobe,
+            'hnsw_m': args.hnsw_m,
+            'ef_construction': args.ef_construction,
+            'ef': args.ef,
+            'quantize': args.quantize,
+            'quantize_only': args.quantize_only,
+            'rescore_dtype': args.rescore_dtype
         }
         index(arag_path, options)
         return False
@@ -217,8 +310,50 @@ def execute_command(args, active_arag=None):
         if not (os.path.isdir(arag_path) or os.path.isfile(arag_path)):
             print(f"Arag {arag_path} does not exist")
             return
+        search_options = {
+            'mode': args.mode,
+            'exact': args.exact,
+            'nprobe': args.nprobe,
+            'ef': args.ef,
+            'rescore': args.rescore,
+            'no_cache': args.no_cache,
+            'cache_size': args.cache_size * 1024 * 1024 if args.cache_size else None,
+            'page_cache_size': args.page_cache * 1024 * 1024 if args.page_cache else None
+        }
+        from tools.retrieval import query, queryBatch
+        if args.batch:
+            queryBatch(arag_path, args.batch, args.topk, api_key=args.api_key,
+                       get_file=args.get_file, endpoint=args.endpoint, options=search_options)
+            return False
+        if args.query_string is None:
+            print("Error: a query string or --batch is required")
+            return False
         query(arag_path, args.query_string, args.topk, api_key=args.api_key, 
-              get_file=args.get_file, endpoint=args.endpoint)  # Pass endpoint
+              get_file=args.get_file, endpoint=args.endpoint, options=search_options)  # Pass endpoint
+        return False
+    elif args.subcommand == 'serve':
+        arag_paths = args.arag_paths or ([active_arag] if active_arag else [])
+        if not arag_paths:
+            print("Error: at least one arag path is required, either pass it or open an arag first")
+            return False
+        for arag_path in arag_paths:
+            if not (os.path.isdir(arag_path) or os.path.isfile(arag_path)):
+                print(f"Arag {arag_path} does not exist")
+                return False
+        options = {
+            'host': args.host,
+            'port': args.port,
+            'socket': args.socket,
+            'api_key': args.api_key,
+            'endpoint': args.endpoint,
+            'mode': args.mode,
+            'no_cache': args.no_cache,
+            'cache_size': args.cache_size * 1024 * 1024 if args.cache_size else None,
+            'page_cache_size': args.page_cache * 1024 * 1024 if args.page_cache else None,
+            'verbose': args.verbose
+        }
+        from tools.serve import serve
+        serve(arag_paths, options)
         return False
     elif args.subcommand == 'package':
         arag_path = args.arag_path if args.arag_path is not None else active_arag
@@ -228,7 +363,13 @@ def execute_command(args, active_arag=None):
         if not os.path.isdir(arag_path):
             print(f"{arag_path} is not a directory")
             return False
-        success = package(arag_path)
+        options = {
+            'compress_level': args.compress_level,
+            'jobs': args.jobs,
+            'update': args.update
+        }
+        from tools.arag_ops import package
+        success = package(arag_path, options=options)
         if success and args.remove_original:
             shutil.rmtree(arag_path)
             if active_arag == arag_path:
@@ -243,6 +384,7 @@ def execute_command(args, active_arag=None):
         if not os.path.isfile(arag_path):
             print(f"{arag_path} is not a file")
             return False
+        from tools.arag_ops import unpackage
         success = unpackage(arag_path)
         if success and args.remove_original:
             os.remove(arag_path)
@@ -1,12 +1,76 @@
 # Version
 VERSION = '0.1.0'
+# corpus.db schema, stored in PRAGMA user_version and index.json
+CORPUS_SCHEMA_VERSION = 2
 
 # Directory and file names
 CONTENT_SUBDIR = 'content'
 CONTENT_LIST = 'content_list.txt'
 CORPUS_DB = 'corpus.db'
 INDEX_JSON = 'index.json'
+BLOBS_SUBDIR = 'blobs'
+BLOB_MANIFEST = 'manifest.json'
+EMBEDDINGS_MATRIX = 'embeddings.f32'
+EMBEDDINGS_MATRIX_F16 = 'embeddings.f16'  # float16 rescoring store of quantize-only indexes
+EMBEDDING_IDS = 'embedding_ids.i64'
+IVF_CENTROIDS = 'ivf_centroids.f32'
+IVF_OFFSETS = 'ivf_offsets.i64'
+IVF_ROWS = 'ivf_rows.i64'
+HNSW_GRAPH = 'hnsw.bin'
+EMBEDDINGS_INT8 = 'embeddings.i8'
+EMBEDDINGS_BINARY = 'embeddings.b1'
 
 # DEFAULTS
 DEFAULT_LOCAL_EMBEDDING_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
-DEFAULT_OPENAI_EMBEDDING_MODEL = 'text-embedding-3-small'
\ No newline at end of file
+DEFAULT_OPENAI_EMBEDDING_MODEL = 'text-embedding-3-small'
+DEFAULT_OPENAI_ENDPOINT = 'https://api.openai.com/v1'
+DEFAULT_HASH_EMBEDDING_MODEL = 'hash-1024'  # 'hash-<dimensions>'
+DEFAULT_CHUNK_SIZE = 8192  # bytes
+DEFAULT_INDEX_BATCH_SIZE = 64
+DEFAULT_QUERY_BATCH_SIZE = 256
+
+# OpenAI indexing: requests in flight, retries of rate limited (429) or failed (5xx) requests with
+# exponential backoff, and the provider's limits on the inputs packed into one embeddings request
+DEFAULT_OPENAI_CONCURRENCY = 8
+DEFAULT_OPENAI_MAX_RETRIES = 6
+OPENAI_BACKOFF_BASE = 1.0  # seconds before the first retry, doubled for each further one
+OPENAI_BACKOFF_MAX = 60.0  # seconds
+OPENAI_MAX_REQUEST_INPUTS = 2048
+OPENAI_MAX_REQUEST_TOKENS = 300000
+
+# Query embedding cache, stored under the user cache directory
+QUERY_CACHE_DB = 'query_embeddings.db'
+DEFAULT_QUERY_CACHE_SIZE = 64 * 1024 * 1024  # bytes of stored vectors
+
+# Embedding storage: little-endian float32 BLOBs in chunks.embedding
+EMBEDDING_DTYPE = '<f4'
+
+# Data alignment (bytes) of uncompressed members in packaged .arag files, so they can be memory-mapped
+ZIP_ALIGNMENT = 4096
+
+# Compression of content/ members in packaged .arag files
+DEFAULT_COMPRESS_LEVEL = 6
+PACKAGE_SPOOL_SIZE = 16 * 1024 * 1024  # bytes of compressed data per member held in memory before spilling to disk
+PACKAGE_INFLIGHT_BYTES = 128 * 1024 * 1024  # bytes of compressed members held in memory ahead of the archive writer
+# Formats that are already compressed, stored as they are
+STORED_EXTENSIONS = {
+    '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.epub',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.heic',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.arag',
+    '.mp3', '.mp4', '.m4a', '.ogg', '.webm', '.mov',
+}
+
+# Full-text (BM25) index over chunk content, built by 'corpify --fts'
+FTS_TABLE = 'chunks_fts'
+# Reciprocal rank fusion constant, and candidates taken from each ranking, for hybrid queries
+RRF_K = 60
+DEFAULT_HYBRID_DEPTH = 50
+
+# Candidates rescored per requested result when searching quantized embeddings
+DEFAULT_RESCORE_FACTOR = 10
+# Page cache shared by connections to the same packaged .arag, and read-ahead on sequential scans
+DEFAULT_PAGE_CACHE_SIZE = 32 * 1024 * 1024  # bytes
+DEFAULT_READAHEAD_SIZE = 256 * 1024  # bytes
+
+# SQLite page cache used while bulk loading corpus.db
+DEFAULT_BULK_CACHE_SIZE = 256 * 1024 * 1024  # bytes
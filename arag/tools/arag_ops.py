@@ -1,12 +1,13 @@
 import json
 import os
 import shutil
-from .corpus import corpify
-from .index import index
-from .content import add
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .helpers import ArchiveWriter, compress_member, member_unchanged, reuse_member, member_data_offset, compact_corpus_db
 import zipfile
 
 import globals
+from . import metrics
 
 def create(arag_path, arag_name):
     """
@@ -67,6 +68,11 @@ def create_spec(destination_path):
     print(f"Created template .arag-json spec file at {destination_path}")
 
 def create_from_spec(spec_file):
+    # Building from a spec runs the whole pipeline, import it here so package/unpackage stay light
+    from .corpus import corpify
+    from .index import index
+    from .content import add
+
     with open(spec_file, 'r') as f:
         spec = json.load(f)
     # Validate spec
@@ -86,11 +92,15 @@ def create_from_spec(spec_file):
         return
     create(dest_dir, arag_name)  # Creates arag_dir
     for path in spec['content_include']:
-        add(arag_dir, path)
+        add(arag_dir, path, dedup=spec.get('content_dedup', False))
     options = {
         'chunk_size': spec['chunk_size'],
+        'overlap': spec.get('chunk_overlap'),  # Optional, defaults in corpify()
+        'boundary': spec.get('chunk_boundary'),  # Optional
         'clean': spec['clean_content'],
         'force': True,
+        'jobs': spec.get('corpify_jobs'),  # Optional, defaults in corpify()
+        'fts': spec.get('fts', False),  # Optional full-text index
     }
     corpify(arag_dir, options)
     index_options = {
@@ -98,6 +108,7 @@ def create_from_spec(spec_file):
         'model': spec['index_model'] if spec['index_model'] != '<default>' else None,
         'api_key': spec['api_key'],
         'endpoint': spec['openai_endpoint'],
+        'batch_size': spec.get('index_batch_size'),  # Optional, defaults in index()
         'force': True,
     }
     index(arag_dir, index_options)
@@ -111,13 +122,108 @@ def create_from_spec(spec_file):
 
 
 
-def package(arag_path, dest_path=None):
+def list_members(arag_path):
+    """
+    List the files of an .arag directory as (file_path, arcname) pairs, sorted by arcname so
+    packaging is deterministic.
+    """
+    members = []
+    for root, dirs, files in os.walk(arag_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            members.append((file_path, os.path.relpath(file_path, arag_path).replace(os.sep, '/')))
+    # content/ already holds the bytes of every blob
+    members = [member for member in members if not member[1].startswith(globals.BLOBS_SUBDIR + '/')]
+    return sorted(members, key=lambda member: member[1])
+
+def prepare_member(file_path, arcname, level, previous=None):
+    """
+    Compress a content file, see compress_member(), unless it is unchanged from previous, its
+    member in the archive being updated: then return (zinfo, None) to copy that member raw.
+    """
+    if previous is not None and member_unchanged(file_path, previous):
+        return reuse_member(file_path, arcname, previous), None
+    return compress_member(file_path, arcname, level)
+
+def compress_members(members, level, jobs, previous=None):
+    """
+    Compress the content/ members in a thread pool, yielding (file_path, arcname, compressed)
+    in the order of members; compressed is a prepare_member() result, or None for members
+    stored aligned. Members are compressed ahead of the archive writer while the data they may
+    hold in memory stays within globals.PACKAGE_INFLIGHT_BYTES, whatever the number of jobs.
+
+    Args:
+        previous (dict, optional): ZipInfo of the members of the archive being updated, by name.
+    """
+    previous = previous or {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        in_flight = 0
+        members = iter(members)
+        member = next(members, None)
+        while True:
+            # Each compressed member is spooled in memory up to PACKAGE_SPOOL_SIZE bytes; one is
+            # always admitted when none is pending, so a member larger than the budget still goes
+            while member is not None and len(pending) < jobs * 4:
+                file_path, arcname = member
+                if not arcname.startswith('content/'):
+                    pending.append((file_path, arcname, None, 0))
+                else:
+                    size = min(os.path.getsize(file_path), globals.PACKAGE_SPOOL_SIZE)
+                    if pending and in_flight + size > globals.PACKAGE_INFLIGHT_BYTES:
+                        break
+                    future = executor.submit(prepare_member, file_path, arcname, level, previous.get(arcname))
+                    pending.append((file_path, arcname, future, size))
+                    in_flight += size
+                member = next(members, None)
+            if not pending:
+                break
+            file_path, arcname, future, size = pending.popleft()
+            # Counted until the writer has consumed it
+            yield file_path, arcname, future.result() if future is not None else None
+            in_flight -= size
+
+def has_float_store(arag_path):
+    """
+    Check whether the arag's index keeps its float embeddings in a matrix file of its own, used
+    for rescoring quantized candidates ('index --quantize-only'), instead of in corpus.db.
+    """
+    index_json_path = os.path.join(arag_path, globals.INDEX_JSON)
+    if not os.path.exists(index_json_path):
+        return False
+    with open(index_json_path, 'r') as f:
+        metadata = json.load(f)
+    matrix_file = (metadata.get('matrix') or {}).get('file')
+    return bool((metadata.get('quantization') or {}).get('only') and matrix_file
+                and os.path.exists(os.path.join(arag_path, matrix_file)))
+
+def package(arag_path, dest_path=None, options=None):
     """
     Package the .arag directory into a .arag file, compressing only the 'content' folder.
-    
+    Everything else is stored uncompressed at aligned offsets so it can be memory-mapped.
+
+    Content files are deflated in parallel and written in sorted order, so the archive does not
+    depend on the number of jobs. Already-compressed formats are stored as they are.
+
+    With options['update'] an existing .arag file is rewritten in place: content members whose
+    file is unchanged (same size, and same timestamp or CRC) are copied across without being
+    recompressed, and only new or modified content files are compressed. The other members,
+    corpus.db included, are always written from the directory.
+
+    corpus.db is packaged without the embeddings cached for re-indexing and without free pages,
+    and for an index built with --quantize-only without its embeddings, which the matrix file
+    holds, see compact_corpus_db().
+
     Args:
         arag_path (str): Path to the .arag directory.
+        dest_path (str, optional): Path of the .arag file (default: next to the directory).
+        options (dict, optional): Supports:
+            - 'compress_level' (int): Deflate level 0-9 of content files (default: 6, 0 stores them).
+            - 'jobs' (int): Number of compression threads (default: one per CPU core).
+            - 'update' (bool): Update an existing .arag file instead of refusing to overwrite it.
     """
+    if options is None:
+        options = {}
     if not os.path.isdir(arag_path):
         print(f"{arag_path} is not a directory")
         return False
@@ -128,24 +234,74 @@ def package(arag_path, dest_path=None):
             output_path = arag_path + '.arag'
     else:
         output_path = dest_path
-    if os.path.exists(output_path):
-        print(f"Output path {output_path} already exists")
+    update = options.get('update', False) and os.path.isfile(output_path)
+    if os.path.exists(output_path) and not update:
+        print(f"Output path {output_path} already exists, run --update to update it")
         return False
+    level = options.get('compress_level')
+    if level is None:
+        level = globals.DEFAULT_COMPRESS_LEVEL
+    if not 0 <= level <= 9:
+        print("Error: the compression level must be between 0 and 9")
+        return False
+    jobs = options.get('jobs') or -1
+    if jobs < 0:
+        jobs = os.cpu_count() or 1
+    # An update is written next to the archive it reads from, and replaces it once complete
+    write_path = output_path + '.tmp' if update else output_path
+    # Reused members are copied raw from the previous archive through this handle
+    previous_file = open(output_path, 'rb') if update else None
+    reused = compressed_count = 0
+    corpus_copy = None
     try:
-        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(arag_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arcname = os.path.relpath(file_path, arag_path)
-                    if arcname.startswith('content/'):
-                        zipf.write(file_path, arcname)
-                    else:
-                        zipf.write(file_path, arcname, compress_type=zipfile.ZIP_STORED)
-        print(f"Packaged {arag_path} to {output_path}")
+        corpus_db_path = os.path.join(arag_path, globals.CORPUS_DB)
+        if os.path.exists(corpus_db_path):
+            with metrics.Stage('package.compact'):
+                corpus_copy = compact_corpus_db(corpus_db_path, drop_embeddings=has_float_store(arag_path))
+        previous = None
+        if update:
+            with zipfile.ZipFile(previous_file) as previous_zipf:
+                previous = {info.filename: info for info in previous_zipf.infolist()}
+        with ArchiveWriter(write_path) as archive:
+            members = compress_members(list_members(arag_path), level, jobs, previous)
+            # Time spent waiting for the compression threads, then writing each member
+            for file_path, arcname, compressed in metrics.timedIter('package.compress', members, lambda item: {'rows': 1}):
+                if compressed is None:
+                    # Stored and aligned so corpus.db and the embedding matrix can be read in place
+                    if arcname == globals.CORPUS_DB and corpus_copy is not None:
+                        file_path = corpus_copy
+                    with metrics.Stage('package.store', rows=1, bytes=os.path.getsize(file_path)):
+                        archive.write_aligned(file_path, arcname)
+                    continue
+                zinfo, data = compressed
+                if data is None:
+                    # Unchanged, copy the compressed data from the previous archive
+                    info = previous[arcname]
+                    with metrics.Stage('package.reuse', rows=1, bytes=info.compress_size, cache_hits=1):
+                        previous_file.seek(member_data_offset(previous_file, info))
+                        archive.write_raw(zinfo, previous_file, info.compress_size)
+                    reused += 1
+                    continue
+                with data, metrics.Stage('package.write', rows=1, bytes=zinfo.compress_size):
+                    archive.write_raw(zinfo, data)
+                compressed_count += 1
+        if update:
+            previous_file.close()
+            os.replace(write_path, output_path)
+            print(f"Updated {output_path} from {arag_path}: {compressed_count} content files compressed, {reused} reused")
+        else:
+            print(f"Packaged {arag_path} to {output_path}")
         return True
     except Exception as e:
         print(f"Error packaging: {e}")
+        if previous_file is not None:
+            previous_file.close()
+        if os.path.exists(write_path):
+            os.remove(write_path)
         return False
+    finally:
+        if corpus_copy is not None:
+            os.remove(corpus_copy)
 
 def unpackage(packaged_arag_path):
     """
@@ -165,8 +321,9 @@ def unpackage(packaged_arag_path):
         print(f"Output directory {output_dir} already exists")
         return False
     try:
-        with zipfile.ZipFile(packaged_arag_path, 'r') as zipf:
+        with zipfile.ZipFile(packaged_arag_path, 'r') as zipf, metrics.Stage('unpackage.extract') as stage:
             zipf.extractall(output_dir)
+            stage.add(rows=len(zipf.infolist()), bytes=sum(info.file_size for info in zipf.infolist()))
         print(f"Unpackaged {packaged_arag_path} to {output_dir}")
         return True
     except Exception as e:
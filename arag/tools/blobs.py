@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import shutil
+import stat
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Not available on Windows
+
+import globals
+
+# Linux ioctl sharing the extents of one file with another (btrfs, XFS, bcachefs, ...)
+FICLONE = 0x40049409
+
+def hashFile(file_path, block_size=1 << 20):
+    """Return the SHA-256 hex digest of a file, read in blocks of block_size bytes."""
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as infile:
+        for block in iter(lambda: infile.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+def blobPath(arag_path, digest):
+    """Path of the blob holding the bytes with the given SHA-256 hex digest."""
+    return os.path.join(arag_path, globals.BLOBS_SUBDIR, digest[:2], digest[2:])
+
+def loadManifest(arag_path):
+    """
+    Read the blob manifest: 'paths' maps content paths (relative to content/, with '/'
+    separators) to the digest of their blob, 'blobs' maps digests to the [size, mtime_ns] of the
+    blob when it was stored. Empty if no content was added with --dedup.
+    """
+    manifest_path = os.path.join(arag_path, globals.BLOBS_SUBDIR, globals.BLOB_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return {'paths': {}, 'blobs': {}}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def saveManifest(arag_path, manifest):
+    manifest_path = os.path.join(arag_path, globals.BLOBS_SUBDIR, globals.BLOB_MANIFEST)
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def reflink(src, dst):
+    """
+    Create dst as a copy-on-write clone of src.
+
+    Raises:
+        OSError: If the platform or filesystem does not support it, or src and dst are on
+        different filesystems.
+    """
+    if fcntl is None:
+        raise OSError("Reflinks are not supported on this platform")
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        try:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        except OSError:
+            target.close()
+            os.remove(dst)
+            raise
+
+def linkOrCopy(src, dst, hardlink=True):
+    """
+    Make dst hold the bytes of src with as little copying as possible: a reflink, else a
+    hardlink (if allowed), else a copy. dst keeps the modification time of src.
+
+    Returns:
+        str: 'reflink', 'hardlink' or 'copy'.
+    """
+    try:
+        reflink(src, dst)
+        method = 'reflink'
+    except OSError:
+        if hardlink:
+            try:
+                os.link(src, dst)
+                return 'hardlink'  # Same inode, same modification time
+            except OSError:
+                pass
+        shutil.copyfile(src, dst)
+        method = 'copy'
+    src_stat = os.stat(src)
+    os.utime(dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+    return method
+
+def storeFile(arag_path, manifest, src, dest_path):
+    """
+    Store a file as a blob, if its bytes are not stored yet, and make dest_path a link to or
+    copy of the blob, recording both in manifest. Blobs are read-only, so a hardlinked content
+    file cannot be edited in place; the source file is never hardlinked.
+
+    Returns:
+        tuple: (digest, method linking dest_path, whether a new blob was stored).
+    """
+    digest = hashFile(src)
+    blob = blobPath(arag_path, digest)
+    # A blob no longer matching its record was modified through a hardlink, store it again
+    new = not isBlobCopy(manifest, blob, digest)
+    if new:
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        partial = f"{blob}.{os.getpid()}.tmp"
+        linkOrCopy(src, partial, hardlink=False)
+        os.chmod(partial, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(partial, blob)
+        blob_stat = os.stat(blob)
+        manifest['blobs'][digest] = [blob_stat.st_size, blob_stat.st_mtime_ns]
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+    method = linkOrCopy(blob, dest_path)
+    manifest['paths'][os.path.relpath(dest_path, os.path.join(arag_path, globals.CONTENT_SUBDIR)).replace(os.sep, '/')] = digest
+    return digest, method, new
+
+def isBlobCopy(manifest, file_path, digest):
+    """
+    Check that a blob, or a content file linked to or copied from it, still holds the blob's
+    bytes, by comparing its size and modification time (which storeFile() preserves and an edit
+    changes) with those recorded for the blob.
+    """
+    record = manifest['blobs'].get(digest)
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        return False
+    return record is not None and [file_stat.st_size, file_stat.st_mtime_ns] == record
+
+def findDuplicates(arag_path, files):
+    """
+    Find content files holding the same bytes as an earlier file in the list, according to the
+    blob manifest.
+
+    Args:
+        files (list): (file_path, rel_path) pairs, see corpus.walkContent().
+
+    Returns:
+        tuple: (unique, duplicates) where unique is the list of files to extract and duplicates
+        maps each other rel_path to (rel_path of its first copy, digest).
+    """
+    manifest = loadManifest(arag_path)
+    if not manifest['paths']:
+        return files, {}
+    first = {}
+    unique = []
+    duplicates = {}
+    for file_path, rel_path in files:
+        digest = manifest['paths'].get(rel_path.replace(os.sep, '/'))
+        if digest is not None and isBlobCopy(manifest, file_path, digest):
+            if digest in first:
+                duplicates[rel_path] = (first[digest], digest)
+                continue
+            first[digest] = rel_path
+        unique.append((file_path, rel_path))
+    return unique, duplicates
+
+def collectGarbage(arag_path):
+    """
+    Drop manifest entries of content files that were deleted or modified, and remove the blobs
+    no content file refers to any more.
+
+    Returns:
+        int: Number of blobs removed.
+    """
+    blobs_path = os.path.join(arag_path, globals.BLOBS_SUBDIR)
+    if not os.path.isdir(blobs_path):
+        return 0
+    content_path = os.path.join(arag_path, globals.CONTENT_SUBDIR)
+    manifest = loadManifest(arag_path)
+    paths = {rel_path: digest for rel_path, digest in manifest['paths'].items()
+             if isBlobCopy(manifest, os.path.join(content_path, rel_path), digest)}
+    referenced = {digest for digest in set(paths.values()) if isBlobCopy(manifest, blobPath(arag_path, digest), digest)}
+    removed = 0
+    for root, _, files in os.walk(blobs_path):
+        for file in files:
+            digest = os.path.basename(root) + file
+            if root == blobs_path or digest in referenced:
+                continue
+            os.remove(os.path.join(root, file))
+            removed += 1
+    saveManifest(arag_path, {'paths': {rel_path: digest for rel_path, digest in paths.items() if digest in referenced},
+                             'blobs': {digest: manifest['blobs'][digest] for digest in referenced}})
+    return removed
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+import globals
+
+def userCacheDir():
+    """
+    Return arag's per-user cache directory: $ARAG_CACHE_DIR if set, otherwise the platform's
+    user cache location (%LOCALAPPDATA% on Windows, ~/Library/Caches on macOS,
+    $XDG_CACHE_HOME or ~/.cache elsewhere).
+    """
+    if os.getenv('ARAG_CACHE_DIR'):
+        return os.getenv('ARAG_CACHE_DIR')
+    if sys.platform == 'win32':
+        base = os.getenv('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'arag')
+
+class QueryEmbeddingCache:
+    """
+    On-disk LRU cache of query embeddings, keyed by (method, model, endpoint, text hash) and
+    stored as float32 BLOBs in a SQLite file. Least recently used entries are evicted once the
+    stored vectors exceed max_bytes.
+    """
+    def __init__(self, path=None, max_bytes=globals.DEFAULT_QUERY_CACHE_SIZE):
+        if path is None:
+            path = os.path.join(userCacheDir(), globals.QUERY_CACHE_DB)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS query_embeddings
+                             (method TEXT NOT NULL,
+                              model TEXT NOT NULL,
+                              endpoint TEXT NOT NULL,
+                              text_hash TEXT NOT NULL,
+                              embedding BLOB NOT NULL,
+                              last_used REAL NOT NULL,
+                              PRIMARY KEY (method, model, endpoint, text_hash))''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used ON query_embeddings (last_used)")
+        self.conn.commit()
+
+    @staticmethod
+    def _key(embed_options, text):
+        text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return (embed_options.get('method', 'local'), embed_options.get('model') or '',
+                embed_options.get('endpoint') or '', text_hash)
+
+    def get(self, embed_options, texts):
+        """
+        Look up cached embeddings for texts.
+
+        Returns:
+            dict: Maps each cached text to its float32 embedding.
+        """
+        found = {}
+        now = time.time()
+        for text in set(texts):
+            key = self._key(embed_options, text)
+            row = self.conn.execute("SELECT embedding FROM query_embeddings WHERE method = ? AND model = ? "
+                                    "AND endpoint = ? AND text_hash = ?", key).fetchone()
+            if row is not None:
+                found[text] = np.frombuffer(row[0], dtype=globals.EMBEDDING_DTYPE)
+                self.conn.execute("UPDATE query_embeddings SET last_used = ? WHERE method = ? AND model = ? "
+                                  "AND endpoint = ? AND text_hash = ?", (now,) + key)
+        self.conn.commit()
+        return found
+
+    def put(self, embed_options, texts, embeddings):
+        """
+        Store embeddings for texts, then evict least recently used entries beyond max_bytes.
+        """
+        now = time.time()
+        self.conn.executemany("INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?, ?, ?)",
+                              [self._key(embed_options, text) + (np.asarray(embedding, dtype=globals.EMBEDDING_DTYPE).tobytes(), now)
+                               for text, embedding in zip(texts, embeddings)])
+        self.evict()
+        self.conn.commit()
+
+    def evict(self):
+        """Delete least recently used entries until the stored vectors fit in max_bytes."""
+        total = self.conn.execute("SELECT COALESCE(SUM(length(embedding)), 0) FROM query_embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        removed = 0
+        count = 0
+        # Entries stored together share last_used, so they are told apart by rowid
+        rows = self.conn.execute("SELECT length(embedding) FROM query_embeddings ORDER BY last_used, rowid")
+        for size, in rows:
+            removed += size
+            count += 1
+            if removed >= excess:
+                break
+        self.conn.execute("DELETE FROM query_embeddings WHERE rowid IN "
+                          "(SELECT rowid FROM query_embeddings ORDER BY last_used, rowid LIMIT ?)", (count,))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,114 @@
+import io
+
+# Separators a chunk may end after, tried in order until one falls in the second half of the chunk
+SENTENCE_SEPARATORS = (b'. ', b'! ', b'? ', b'.\n', b'!\n', b'?\n')
+BOUNDARIES = {
+    'paragraph': ((b'\n\n',), SENTENCE_SEPARATORS, (b'\n',)),
+    'sentence': (SENTENCE_SEPARATORS, (b'\n',)),
+    'line': ((b'\n',),),
+}
+
+# Bytes read from the stream at a time (at least one chunk)
+READ_SIZE = 1 << 20
+
+def _isContinuation(byte):
+    # UTF-8 continuation bytes are 0b10xxxxxx
+    return byte & 0xC0 == 0x80
+
+class NewlineReader:
+    """
+    Wrap a binary stream, translating '\\r\\n' and '\\r' to '\\n' as text mode reads do.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read(self, size):
+        data = self.stream.read(size)
+        while data.endswith(b'\r'):
+            # The '\n' of a '\r\n' pair may be in the next read
+            more = self.stream.read(1)
+            if not more:
+                break
+            data += more
+        return data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+
+def iterChunks(stream, chunk_size, overlap=0, boundary=None, translate_newlines=True):
+    """
+    Split a UTF-8 byte stream into text chunks of at most chunk_size encoded bytes, in a single
+    pass and without holding more than a read block and one chunk in memory.
+
+    Chunks never split a UTF-8 character. With boundary set, a chunk ends after the last
+    paragraph, sentence or line break in its second half when there is one.
+
+    Args:
+        stream: Binary file-like object with a read(size) method.
+        chunk_size (int): Maximum size of each chunk in bytes.
+        overlap (int): Bytes of the end of each chunk repeated at the start of the next.
+        boundary (str, optional): 'paragraph', 'sentence' or 'line'.
+        translate_newlines (bool): Read '\\r\\n' and '\\r' as '\\n'.
+
+    Yields:
+        str: The chunks, in order.
+
+    Raises:
+        UnicodeDecodeError: If the stream is not valid UTF-8.
+        ValueError: If overlap is not smaller than chunk_size or boundary is unknown.
+    """
+    if overlap >= chunk_size:
+        raise ValueError(f"Chunk overlap ({overlap}) must be smaller than the chunk size ({chunk_size})")
+    if boundary is not None and boundary not in BOUNDARIES:
+        raise ValueError(f"Unsupported chunk boundary: {boundary}. Use 'paragraph', 'sentence' or 'line'.")
+    if translate_newlines:
+        stream = NewlineReader(stream)
+    separators = BOUNDARIES.get(boundary, ())
+    read_size = max(READ_SIZE, chunk_size + 1)
+
+    buf = bytearray()
+    start = 0  # Start of the next chunk in buf
+    eof = False
+    while True:
+        # Keep at least one chunk and the byte after it buffered, to see where characters end
+        while not eof and len(buf) - start <= chunk_size:
+            data = stream.read(read_size)
+            if not data:
+                eof = True
+            else:
+                if start > len(buf) // 2:
+                    # Drop consumed bytes; amortized linear since at most a chunk is left over
+                    del buf[:start]
+                    start = 0
+                buf += data
+        if start >= len(buf):
+            return
+        if len(buf) - start <= chunk_size:
+            # Final chunk
+            yield buf[start:].decode('utf-8')
+            return
+
+        end = start + chunk_size
+        # Back off to the start of the character at end
+        while end > start and _isContinuation(buf[end]):
+            end -= 1
+        if end == start:
+            # A single character is larger than chunk_size
+            return
+        for group in separators:
+            found = [buf.rfind(separator, start, end) for separator in group]
+            cut = max((position + len(separator) for position, separator in zip(found, group) if position >= 0), default=start)
+            if cut - start > chunk_size // 2:
+                end = cut
+                break
+        yield buf[start:end].decode('utf-8')
+
+        next_start = end - overlap
+        if next_start <= start:
+            next_start = end
+        while next_start < end and _isContinuation(buf[next_start]):
+            next_start += 1
+        start = next_start
+
+def chunkText(text, chunk_size, overlap=0, boundary=None):
+    """
+    Split a string into chunks of at most chunk_size UTF-8 encoded bytes, see iterChunks().
+    """
+    return list(iterChunks(io.BytesIO(text.encode('utf-8')), chunk_size, overlap, boundary, translate_newlines=False))
@@ -4,6 +4,8 @@ import zipfile
 
 import globals
 from .helpers import get_files, get_file_from_arag
+from .blobs import storeFile, loadManifest, saveManifest, collectGarbage
+from . import metrics
 
 CONTENT_LIST = globals.CONTENT_LIST
 
@@ -29,28 +31,33 @@ def updateContentList(arag_path):
             
     print(f"Updated content list in arag {arag_path}")     
 
-def add(arag_path, input_path):
+def add(arag_path, input_path, dedup=False):
     """
     Add a file or directory to the .arag/content/ directory.
     
     Args:
         arag_path (str): Path to the .arag directory.
         input_path (str): Path to the file or directory to add.
+        dedup (bool): Store the bytes in the content-addressed blob store, see addDeduplicated().
     """
     
     # Define paths
     content_path = os.path.join(arag_path, 'content')
     
     # Determine if input is a file or directory
-    if os.path.isfile(input_path):
-        shutil.copy(input_path, content_path)
+    if dedup and (os.path.isfile(input_path) or os.path.isdir(input_path)):
+        addDeduplicated(arag_path, input_path)
+    elif os.path.isfile(input_path):
+        with metrics.Stage('content.copy', rows=1):
+            shutil.copy(input_path, content_path)
         print(f"Copied file {input_path} into arag {arag_path}")
     elif os.path.isdir(input_path):
         dest_dir = os.path.join(content_path, os.path.basename(input_path))
         if os.path.exists(dest_dir):
             print(f"Directory {os.path.basename(input_path)} already exists in arag {arag_path}")
         else:
-            shutil.copytree(input_path, dest_dir)
+            with metrics.Stage('content.copy'):
+                shutil.copytree(input_path, dest_dir)
             print(f"Copied directory {input_path} into arag {arag_path}")
     else:
         print(f"Error: {input_path} does not exist or is neither a file nor a directory")
@@ -58,6 +65,43 @@ def add(arag_path, input_path):
     # Update the content list
     updateContentList(arag_path)  
 
+def addDeduplicated(arag_path, input_path):
+    """
+    Add a file or directory to content/ through the blob store in .arag/blobs/: each distinct
+    file is stored once under its SHA-256, and content paths are reflinks or hardlinks to the
+    blobs where the filesystem supports them (copies otherwise). Corpify extracts and chunks
+    files with the same bytes only once.
+    """
+    content_path = os.path.join(arag_path, 'content')
+    if os.path.isfile(input_path):
+        files = [(input_path, os.path.basename(input_path))]
+    else:
+        name = os.path.basename(os.path.normpath(input_path))
+        if os.path.exists(os.path.join(content_path, name)):
+            print(f"Directory {name} already exists in arag {arag_path}")
+            return
+        files = []
+        for root, _, names in os.walk(input_path):
+            for file in names:
+                file_path = os.path.join(root, file)
+                files.append((file_path, os.path.join(name, os.path.relpath(file_path, input_path))))
+
+    manifest = loadManifest(arag_path)
+    new_blobs = 0
+    methods = {}
+    for file_path, rel_path in files:
+        dest_path = os.path.join(content_path, rel_path)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        with metrics.Stage('content.store', rows=1) as stage:
+            digest, method, new = storeFile(arag_path, manifest, file_path, dest_path)
+            stage.add(cache_hits=int(not new))
+        new_blobs += new
+        methods[method] = methods.get(method, 0) + 1
+    saveManifest(arag_path, manifest)
+    linked = ', '.join(f"{count} by {method}" for method, count in sorted(methods.items()))
+    print(f"Added {len(files)} file(s) from {input_path} into arag {arag_path}: "
+          f"{new_blobs} new blob(s), {len(files) - new_blobs} duplicate(s), linked {linked or 'none'}")
+
 def delete(arag_path, target):
     """
     Delete a file or directory from the .arag/content/ directory.
@@ -82,10 +126,12 @@ def delete(arag_path, target):
     elif os.path.isfile(target_path):
         os.remove(target_path)
         print(f"Deleted file {target} from arag {arag_path}")
+        collectGarbage(arag_path)
         updateContentList(arag_path)
     elif os.path.isdir(target_path):
         shutil.rmtree(target_path)
         print(f"Deleted directory {target} from arag {arag_path}")
+        collectGarbage(arag_path)
         updateContentList(arag_path)
     else:
         print(f"Target {target} is not a file or directory")
@@ -1,24 +1,178 @@
+import hashlib
+import itertools
 import os
 import shutil
 import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
+import globals
 from .content import updateContentList
 from .helpers import processFileToText
+from .index import (removeIndexArtifacts, invalidateIndexArtifacts, readIndexMetadata, ensureEmbeddingCache,
+                    stashEmbeddings, carryEmbeddings)
+from .embeddings import contentHash
+from .chunker import iterChunks, chunkText
+from .db import BulkLoad, createIndexes, createCorpusTables, schemaVersion, upgradeCorpus, readMeta, writeMeta
+from .fts import createFTS
+from .blobs import hashFile, findDuplicates, collectGarbage
+from . import metrics
+
+class HashingReader:
+    """Binary stream wrapper computing the SHA-256 of everything read through it."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.hash = hashlib.sha256()
+
+    def read(self, size):
+        data = self.stream.read(size)
+        self.hash.update(data)
+        return data
+
+def extractChunks(file_path, rel_path, chunking):
+    """
+    Read one content file as text, converting PDF and DOCX files, and split it into chunks.
+    Runs in worker processes when corpifying with several jobs.
+
+    Args:
+        chunking (dict): 'chunk_size', 'overlap' and 'boundary' arguments for chunker.iterChunks().
 
-def find_split(s, max_bytes):
+    Returns:
+        tuple: (rel_path, file_hash, chunks, error). file_hash is the SHA-256 of the file's bytes;
+        chunks is None if the file is not UTF-8 and cannot be converted; error is the exception
+        message if reading the file failed.
+    """
+    try:
+        try:
+            with open(file_path, 'rb') as infile:
+                reader = HashingReader(infile)
+                chunks = list(iterChunks(reader, chunking['chunk_size'], chunking.get('overlap', 0), chunking.get('boundary')))
+            return rel_path, reader.hash.hexdigest(), chunks, None
+        except UnicodeDecodeError:
+            # Only recorded when extracting in this process, worker processes keep their own metrics
+            with metrics.Stage('corpify.convert', rows=1):
+                content = processFileToText(file_path)
+            file_hash = hashFile(file_path)
+            if content is None:
+                return rel_path, file_hash, None, None
+            with metrics.Stage('corpify.chunk', rows=1, bytes=len(content)):
+                chunks = chunkText(content, chunking['chunk_size'], chunking.get('overlap', 0), chunking.get('boundary'))
+            return rel_path, file_hash, chunks, None
+    except Exception as e:
+        return rel_path, None, None, f"{type(e).__name__}: {e}"
+
+def extractAll(files, chunking, jobs=1):
     """
-    Find the largest prefix of string s whose UTF-8 encoded length is <= max_bytes.
-    Uses binary search for efficiency.
+    Extract and chunk content files, yielding (file_path, rel_path, file_hash, chunks, error) in the order
+    of files. With jobs > 1 files are extracted in a process pool, keeping a bounded number of
+    files in flight so results do not pile up ahead of the database writer.
     """
-    low = 0
-    high = len(s)
-    while low < high:
-        mid = (low + high + 1) // 2
-        if len(s[:mid].encode('utf-8')) <= max_bytes:
-            low = mid
-        else:
-            high = mid - 1
-    return low
+    if jobs <= 1:
+        for file_path, rel_path in files:
+            yield (file_path,) + extractChunks(file_path, rel_path, chunking)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        files = iter(files)
+        for file_path, rel_path in files:
+            pending.append((file_path, rel_path, executor.submit(extractChunks, file_path, rel_path, chunking)))
+            if len(pending) >= jobs * 4:
+                break
+        while pending:
+            file_path, rel_path, future = pending.popleft()
+            for next_path, next_rel_path in itertools.islice(files, 1):
+                pending.append((next_path, next_rel_path, executor.submit(extractChunks, next_path, next_rel_path, chunking)))
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker died (e.g. a converter crashed) rather than raising in extractChunks
+                result = (rel_path, None, None, f"{type(e).__name__}: {e}")
+            yield (file_path,) + result
+
+def extractedFiles(files, chunking, jobs, stats):
+    """
+    extractAll() recorded as the 'corpify.extract' stage: the time spent waiting for each file's
+    chunks, which with jobs > 1 overlaps the database writes, and the bytes of the files read.
+    """
+    return metrics.timedIter('corpify.extract', extractAll(files, chunking, jobs),
+                             lambda item: {'rows': 1, 'bytes': stats[item[1]].st_size})
+
+def walkContent(content_path):
+    """
+    List (file_path, rel_path) for every file under content_path, in sorted path order so chunk
+    ids do not depend on directory listing order or the number of jobs.
+    """
+    files = []
+    for root, dirs, names in os.walk(content_path):
+        dirs.sort()
+        for file in sorted(names):
+            file_path = os.path.join(root, file)
+            files.append((file_path, os.path.relpath(file_path, content_path)))
+    return files
+
+def insertFile(cursor, rel_path, stat, file_hash, chunks):
+    """
+    Record a corpified file and its chunks (None for a skipped file) and return its files.id.
+    """
+    chunks = chunks or []
+    cursor.execute("INSERT INTO files (path, size, mtime, hash, chunk_count) VALUES (?, ?, ?, ?, ?)",
+                   (rel_path, stat.st_size, stat.st_mtime, file_hash, len(chunks)))
+    file_id = cursor.lastrowid
+    insertChunks(cursor, file_id, chunks)
+    return file_id
+
+def copyFile(cursor, rel_path, stat, source_path, file_hash, file_id=None):
+    """
+    Record a content file holding the same bytes as the already corpified source_path, copying
+    its chunks and their embeddings instead of extracting it again. With file_id, the existing
+    files row of rel_path is updated instead.
+
+    Returns:
+        bool: False if source_path is not in the corpus, e.g. because it failed to process.
+    """
+    cursor.execute("SELECT id, chunk_count FROM files WHERE path = ?", (source_path,))
+    source = cursor.fetchone()
+    if source is None:
+        return False
+    if file_id is None:
+        cursor.execute("INSERT INTO files (path, size, mtime, hash, chunk_count) VALUES (?, ?, ?, ?, ?)",
+                       (rel_path, stat.st_size, stat.st_mtime, file_hash, source[1]))
+        file_id = cursor.lastrowid
+    else:
+        cursor.execute("UPDATE files SET size = ?, mtime = ?, hash = ?, chunk_count = ? WHERE id = ?",
+                       (stat.st_size, stat.st_mtime, file_hash, source[1], file_id))
+    cursor.execute("INSERT INTO chunks (file_id, chunk_order, content, content_hash, embedding) "
+                   "SELECT ?, chunk_order, content, content_hash, embedding FROM chunks WHERE file_id = ? ORDER BY chunk_order",
+                   (file_id, source[0]))
+    return True
+
+def insertChunks(cursor, file_id, chunks):
+    cursor.executemany('INSERT INTO chunks (file_id, chunk_order, content, content_hash) VALUES (?, ?, ?, ?)',
+                       [(file_id, chunk_order, chunk, contentHash(chunk)) for chunk_order, chunk in enumerate(chunks)])
+
+def chunkingOptions(options, saved=None):
+    """
+    Return the chunker arguments from corpify options, or None after printing an error if
+    they are invalid.
+
+    Args:
+        options (dict): corpify options; 'chunk_size', 'overlap' and 'boundary' set to None are not given.
+        saved (dict, optional): Chunking options the corpus was built with, used for those not given.
+    """
+    chunking = {'chunk_size': globals.DEFAULT_CHUNK_SIZE, 'overlap': 0, 'boundary': None}
+    chunking.update(saved or {})
+    chunking.update({key: options[key] for key in chunking if options.get(key) is not None})
+    if chunking['chunk_size'] <= 0 or not 0 <= chunking['overlap'] < chunking['chunk_size']:
+        print("Error: the chunk size must be positive and the overlap smaller than the chunk size")
+        return None
+    return chunking
+
+def describeChunking(chunking):
+    """Return the chunking options as corpify flags, for messages."""
+    flags = f"--chunk-size {chunking['chunk_size']} --overlap {chunking['overlap']}"
+    if chunking['boundary']:
+        flags += f" --boundary {chunking['boundary']}"
+    return flags
 
 def isCorpified(arag_path):
     """
@@ -40,84 +194,289 @@ def corpify(arag_path, options=None):
     Args:
         arag_path (str): Path to the .arag directory.
         options (dict, optional): Configuration options. Supports:
-            - 'chunk_size' (int): Max size in bytes for each chunk (default: 1MB).
+            - 'chunk_size' (int): Max size in bytes for each chunk (default: DEFAULT_CHUNK_SIZE).
             - 'force' (bool): If True, overwrite existing corpus.db (default: False).
+            - 'overlap' (int): Bytes repeated from the end of each chunk at the start of the next (default: 0).
+            - 'boundary' (str, optional): End chunks on a 'paragraph', 'sentence' or 'line' break when possible.
+            - 'jobs' (int): Number of processes extracting and chunking files (default: 1,
+              negative for one per CPU core).
+            - 'incremental' (bool): Update an existing corpus.db in place, see updateCorpus().
+              The chunking options the corpus was built with are recorded in corpus.db and
+              reused, see updateCorpus().
+            - 'fts' (bool): Also build a full-text index for 'query --mode bm25|hybrid'.
     """
     if options is None:
             options = {}
 
+    chunking = chunkingOptions(options)
+    if chunking is None:
+        return
+
     corpus_db_path = os.path.join(arag_path, 'corpus.db')
+    replaced = False
 
     if os.path.exists(corpus_db_path):
+        if options.get('incremental', False):
+            updateCorpus(arag_path, options)
+            if options.get('clean', False):
+                clean(arag_path)
+            return
         if not options.get('force', False):
-            print("Cannot corpify as existing corpus.db exists, run --force to remove it")
+            print("Cannot corpify as existing corpus.db exists, run --force to remove it or --incremental to update it")
             return
         else:
-            # Check if 'embedding' column exists
+            # Check if any chunk has an embedding
             conn = sqlite3.connect(corpus_db_path)
             cursor = conn.cursor()
             cursor.execute("PRAGMA table_info(chunks)")
             columns = [col[1] for col in cursor.fetchall()]
-            conn.close()
+            embedded = False
             if 'embedding' in columns:
+                cursor.execute("SELECT 1 FROM chunks WHERE embedding IS NOT NULL LIMIT 1")
+                embedded = cursor.fetchone() is not None
+            conn.close()
+            if embedded:
                 if not options.get('yes', False):
                     response = input("The existing corpus has embeddings stored, recorpifying will remove these. Are you sure you want to continue? (y/n): ")
                     if response.lower() != 'y':
                         print("Aborted")
                         return
-            os.remove(corpus_db_path)
+            replaced = True
+
+    # Build the corpus in a separate file and move it into place once complete, so an interrupted
+    # build never leaves a partial corpus.db or touches the existing one
+    build_path = corpus_db_path + '.tmp'
+    removeBuild(build_path)
+    conn = sqlite3.connect(build_path)
+    try:
+        buildCorpus(arag_path, conn, chunking, options, corpus_db_path if replaced else None)
+    except BaseException:
+        conn.close()
+        removeBuild(build_path)
+        raise
+    conn.close()
+    if replaced:
+        removeIndexArtifacts(arag_path)
+    os.replace(build_path, corpus_db_path)
+    print(f"Corpified arag {arag_path}")
+    if options.get('clean', False):
+        clean(arag_path)
 
-    # Connect to SQLite database (creates the file if it doesn’t exist)
-    conn = sqlite3.connect(corpus_db_path)
+def removeBuild(build_path):
+    """Remove a corpus.db build file and its rollback journal, left over by an interrupted corpify."""
+    for path in (build_path, build_path + '-journal'):
+        if os.path.exists(path):
+            os.remove(path)
+
+def buildCorpus(arag_path, conn, chunking, options, previous_db_path=None):
+    """
+    Extract, chunk and insert every content file into the new corpus database open on conn.
+
+    Args:
+        previous_db_path (str, optional): corpus.db being replaced; its embeddings are stashed
+            in the new database's embedding_cache for reuse by 'arag index'.
+    """
     cursor = conn.cursor()
 
-    # Create the chunks table
-    cursor.execute('''CREATE TABLE chunks
-                      (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                       file_path TEXT,
-                       chunk_order INTEGER,
-                       content TEXT)''')
+    # Create the files and chunks tables
+    createCorpusTables(cursor)
+    ensureEmbeddingCache(cursor)
+    writeMeta(cursor, 'chunking', chunking)
 
-    # Define content directory and chunk size
     content_path = os.path.join(arag_path, 'content')
-    chunk_size = options.get('chunk_size', 8192)  # Default in bytes, overridden by argparse if specified
 
-    # Process each file recursively
-    for root, _, files in os.walk(content_path):
-        for file in files:
-            file_path = os.path.join(root, file)
-            try:
-                with open(file_path, 'r', encoding='utf-8') as infile:
-                    content = infile.read()
-            except UnicodeDecodeError:
-                content = processFileToText(file_path)
-                if content is None:
-                    print(f"Skipping non-UTF-8 or non-convertable file: {file_path}")
-                    continue
+    jobs = options.get('jobs') or 1
+    if jobs < 0:
+        jobs = os.cpu_count() or 1
+
+    with metrics.Stage('corpify.walk') as stage:
+        files = walkContent(content_path)
+        stats = {rel_path: os.stat(file_path) for file_path, rel_path in files}
+        stage.add(rows=len(files))
+    # Files added with --dedup that hold the same bytes as an earlier file are extracted once
+    unique, duplicates = findDuplicates(arag_path, files)
+
+    # Extraction may run in worker processes, this process is the only database writer. The build
+    # file is discarded if anything fails, so it is written without a rollback journal and
+    # indexed once loaded
+    failed = []
+    with BulkLoad(conn, "Inserted chunks", journal_mode='OFF') as load:
+        for file_path, rel_path, file_hash, chunks, error in extractedFiles(unique, chunking, jobs, stats):
+            if error is not None:
+                print(f"Error processing file {file_path}: {error}")
+                failed.append(rel_path)
+                continue
+            if chunks is None:
+                print(f"Skipping non-UTF-8 or non-convertable file: {file_path}")
+            else:
+                load.add(len(chunks))
+            with metrics.Stage('corpify.insert', rows=len(chunks or [])):
+                insertFile(cursor, rel_path, stats[rel_path], file_hash, chunks)
+        for rel_path, (source_path, digest) in duplicates.items():
+            with metrics.Stage('corpify.copy', rows=1):
+                if not copyFile(cursor, rel_path, stats[rel_path], source_path, digest):
+                    failed.append(rel_path)
+        with metrics.Stage('corpify.indexes'):
+            createIndexes(cursor)
+        if options.get('fts', False):
+            with metrics.Stage('corpify.fts'):
+                createFTS(cursor)
+
+    if previous_db_path is not None:
+        conn.commit()
+        carryEmbeddings(cursor, previous_db_path, readIndexMetadata(arag_path))
 
-            # Compute relative path
-            rel_path = os.path.relpath(file_path, content_path)
-            chunk_order = 0
-
-            # Split content into chunks and insert into database
-            while content:
-                k = find_split(content, chunk_size)
-                if k == 0:
-                    # Handle edge case where a character exceeds chunk_size
-                    break
-                chunk = content[:k]
-                cursor.execute('INSERT INTO chunks (file_path, chunk_order, content) VALUES (?, ?, ?)',
-                               (rel_path, chunk_order, chunk))
-                chunk_order += 1
-                content = content[k:]
-
-    # Commit changes and close connection
     conn.commit()
+    if failed:
+        print(f"Failed to process {len(failed)} file(s), they are not in the corpus")
+    if duplicates:
+        print(f"Reused the chunks of {len(duplicates)} duplicate file(s)")
+
+
+def updateCorpus(arag_path, options):
+    """
+    Bring an existing corpus.db up to date with the content folder without rebuilding it.
+
+    Files whose size and mtime match the files table are skipped without being read. Changed
+    files are re-extracted, and their chunks replaced only if the content hash differs, so
+    unchanged chunks keep their embeddings. Chunks of deleted files are removed. New chunks are
+    left without embeddings for 'arag index' to fill in.
+
+    Files are chunked with the options recorded in corpus.db when it was built, so every chunk
+    of the corpus is cut the same way. Chunking options given that differ from them are refused,
+    unless 'force' is set: then every file is re-chunked with the new options (unchanged chunk
+    text still reuses its embeddings when indexing).
+
+    Args:
+        arag_path (str): Path to the .arag directory.
+        options (dict): Supports the chunking options, 'force', 'jobs' and 'fts', as for corpify().
+            An existing full-text index is always kept up to date.
+    """
+    upgradeCorpus(arag_path)
+    corpus_db_path = os.path.join(arag_path, 'corpus.db')
+    conn = sqlite3.connect(corpus_db_path)
+    saved = readMeta(conn, 'chunking')
     conn.close()
-    print(f"Corpified arag {arag_path}")
-    if options.get('clean', False):
-        clean(arag_path)
+    chunking = chunkingOptions(options, saved)
+    if chunking is None:
+        return
+    rechunk = saved is not None and chunking != saved
+    if rechunk and not options.get('force', False):
+        print(f"Error: the corpus was chunked with {describeChunking(saved)}, not {describeChunking(chunking)}. "
+              f"Omit the chunking options to keep them, or add --force to re-chunk every file.")
+        return
+    if options.get('fts', False):
+        conn = sqlite3.connect(os.path.join(arag_path, 'corpus.db'))
+        if createFTS(conn.cursor()):
+            print(f"Built full-text index of arag {arag_path}")
+        conn.commit()
+        conn.close()
+    if not rechunk and isCorpusUpdated(arag_path):
+        print(f"Corpus of arag {arag_path} is up to date")
+        return
+    if saved is None:
+        print(f"The corpus does not record the chunking options it was built with; new and changed files "
+              f"are chunked with {describeChunking(chunking)}, which are recorded for later updates.")
+
+    content_path = os.path.join(arag_path, 'content')
+    jobs = options.get('jobs') or 1
+    if jobs < 0:
+        jobs = os.cpu_count() or 1
 
+    conn = sqlite3.connect(corpus_db_path)
+    cursor = conn.cursor()
+    with metrics.Stage('corpify.walk') as stage:
+        files = walkContent(content_path)
+        stats = {rel_path: os.stat(file_path) for file_path, rel_path in files}
+        stage.add(rows=len(files))
+
+    with BulkLoad(conn, "Updated chunks") as load:
+        # Files of a corpus upgraded from one without a manifest have no hash until they change
+        cursor.execute("SELECT path, size, mtime, hash, id FROM files")
+        manifest = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        # Embeddings of replaced chunks are stashed so identical text is not embedded again
+        ensureEmbeddingCache(cursor)
+        createIndexes(cursor)
+        metadata = readIndexMetadata(arag_path)
+        writeMeta(cursor, 'chunking', chunking)
+        if rechunk:
+            print(f"Re-chunking every file with {describeChunking(chunking)}")
+
+        removed = [rel_path for rel_path in manifest if rel_path not in stats]
+        for rel_path in removed:
+            file_id = manifest[rel_path][3]
+            stashEmbeddings(cursor, metadata, condition="file_id = ?", params=(file_id,))
+            cursor.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
+            cursor.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+        changed = [(file_path, rel_path) for file_path, rel_path in files
+                   if rechunk or manifest.get(rel_path, (None, None))[:2] != (stats[rel_path].st_size, stats[rel_path].st_mtime)]
+        duplicates = findDuplicates(arag_path, files)[1]
+        added = updated = 0
+        failed = []
+        extract = [(file_path, rel_path) for file_path, rel_path in changed if rel_path not in duplicates]
+        for file_path, rel_path, file_hash, chunks, error in extractedFiles(extract, chunking, jobs, stats):
+            if error is not None:
+                print(f"Error processing file {file_path}: {error}")
+                failed.append(rel_path)
+                continue
+            stat = stats[rel_path]
+            if chunks is None:
+                print(f"Skipping non-UTF-8 or non-convertable file: {file_path}")
+            else:
+                load.add(len(chunks))
+            if rel_path not in manifest:
+                with metrics.Stage('corpify.insert', rows=len(chunks or [])):
+                    insertFile(cursor, rel_path, stat, file_hash, chunks)
+                added += 1
+                continue
+            file_id = manifest[rel_path][3]
+            if manifest[rel_path][2] == file_hash and not rechunk:
+                # Touched but not modified, keep the chunks and their embeddings
+                cursor.execute("UPDATE files SET size = ?, mtime = ? WHERE id = ?", (stat.st_size, stat.st_mtime, file_id))
+                continue
+            with metrics.Stage('corpify.insert', rows=len(chunks or [])):
+                stashEmbeddings(cursor, metadata, condition="file_id = ?", params=(file_id,))
+                cursor.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
+                insertChunks(cursor, file_id, chunks or [])
+                cursor.execute("UPDATE files SET size = ?, mtime = ?, hash = ?, chunk_count = ? WHERE id = ?",
+                               (stat.st_size, stat.st_mtime, file_hash, len(chunks or []), file_id))
+            updated += 1
+
+        # Changed files holding the same bytes as another content file copy its chunks, which are
+        # up to date now that the extracted files are in
+        for file_path, rel_path in changed:
+            if rel_path not in duplicates:
+                continue
+            source_path, digest = duplicates[rel_path]
+            stat = stats[rel_path]
+            file_id = manifest[rel_path][3] if rel_path in manifest else None
+            if file_id is not None and manifest[rel_path][2] == digest and not rechunk:
+                cursor.execute("UPDATE files SET size = ?, mtime = ? WHERE id = ?", (stat.st_size, stat.st_mtime, file_id))
+                continue
+            if file_id is not None:
+                stashEmbeddings(cursor, metadata, condition="file_id = ?", params=(file_id,))
+                cursor.execute("DELETE FROM chunks WHERE file_id = ?", (file_id,))
+            if not copyFile(cursor, rel_path, stat, source_path, digest, file_id):
+                failed.append(rel_path)
+                if file_id is not None:
+                    cursor.execute("DELETE FROM files WHERE id = ?", (file_id,))
+            elif file_id is None:
+                added += 1
+            else:
+                updated += 1
+
+    conn.close()
+    if removed or added or updated:
+        # The matrix, ANN index and quantized codes no longer match corpus.db
+        invalidateIndexArtifacts(arag_path)
+    if failed:
+        print(f"Failed to process {len(failed)} file(s), they are not in the corpus")
+    print(f"Updated corpus of arag {arag_path}: {added} added, {updated} changed, {len(removed)} removed, "
+          f"{len(files) - len(changed)} unchanged")
+    if added or updated:
+        print("Run 'arag index' to embed the new chunks.")
 
 def clean(arag_path):
     corpus_db_path = os.path.join(arag_path, 'corpus.db')
@@ -127,10 +486,11 @@ def clean(arag_path):
 
     content_path = os.path.join(arag_path, 'content')
 
-    # Get unique file_paths from database
+    # Get the paths of the files that have chunks
+    upgradeCorpus(arag_path)
     conn = sqlite3.connect(corpus_db_path)
     cursor = conn.cursor()
-    cursor.execute("SELECT DISTINCT file_path FROM chunks")
+    cursor.execute("SELECT path FROM files WHERE chunk_count > 0")
     db_file_paths = set(row[0] for row in cursor.fetchall())
     conn.close()
 
@@ -153,6 +513,9 @@ def clean(arag_path):
     updateContentList(arag_path)
 
     print(f"Removed {len(files_to_remove)} files from content folder")
+    removed_blobs = collectGarbage(arag_path)
+    if removed_blobs:
+        print(f"Removed {removed_blobs} unreferenced blob(s)")
 
 
 def isCorpusUpdated(arag_path):
@@ -180,22 +543,29 @@ def isCorpusUpdated(arag_path):
             rel_path = os.path.relpath(file_path, content_path)
             all_files.append(rel_path)
 
-    # Get unique file_paths from database
+    # Get corpified file paths from the manifest, or from the chunks of corpora built without one
     conn = sqlite3.connect(corpus_db_path)
     cursor = conn.cursor()
-    cursor.execute("SELECT DISTINCT file_path FROM chunks")
-    db_file_paths = set(row[0] for row in cursor.fetchall())
+    if schemaVersion(conn) > 0:
+        cursor.execute("SELECT path, size, mtime FROM files")
+        manifest = {row[0]: row[1:] for row in cursor.fetchall()}
+    else:
+        cursor.execute("SELECT DISTINCT file_path FROM chunks")
+        manifest = {row[0]: None for row in cursor.fetchall()}
     conn.close()
 
     # Check if sets match
-    if set(all_files) != db_file_paths:
+    if set(all_files) != set(manifest):
         return False
 
-    # Check modification times
+    # Check sizes and modification times against the manifest, as an incremental corpify does,
+    # since corpus.db itself is also written by indexing. Without one, against corpus.db
     for rel_path in all_files:
-        abs_path = os.path.join(content_path, rel_path)
-        file_mtime = os.path.getmtime(abs_path)
-        if file_mtime > corpus_mtime:
+        stat = os.stat(os.path.join(content_path, rel_path))
+        if manifest[rel_path] is None:
+            if stat.st_mtime > corpus_mtime:
+                return False
+        elif manifest[rel_path] != (stat.st_size, stat.st_mtime):
             return False
 
-    return True
\ No newline at end of file
+    return True
@@ -0,0 +1,203 @@
+import json
+import os
+import sqlite3
+import time
+
+import globals
+
+# Secondary indexes on corpus.db, created once the bulk of the rows are loaded
+CORPUS_INDEXES = {
+    'idx_chunks_file': 'chunks (file_id, chunk_order)',
+    'idx_chunks_content_hash': 'chunks (content_hash)',
+}
+
+FILES_TABLE = '''CREATE TABLE files
+                  (id INTEGER PRIMARY KEY,
+                   path TEXT NOT NULL UNIQUE,
+                   size INTEGER,
+                   mtime REAL,
+                   hash TEXT,
+                   chunk_count INTEGER NOT NULL DEFAULT 0)'''
+
+CHUNKS_TABLE = '''CREATE TABLE {name}
+                   (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    file_id INTEGER NOT NULL REFERENCES files (id),
+                    chunk_order INTEGER,
+                    content TEXT,
+                    content_hash TEXT,
+                    embedding BLOB)'''
+
+# Settings of the corpus stored as JSON values, such as the chunking options it was built with
+META_TABLE = '''CREATE TABLE IF NOT EXISTS meta
+                 (key TEXT PRIMARY KEY,
+                  value TEXT NOT NULL)'''
+
+def schemaVersion(conn):
+    """
+    Return the corpus.db schema version: 0 for chunks carrying their file path, 1 when a files
+    manifest keyed by path was added, globals.CORPUS_SCHEMA_VERSION for the normalized schema.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version:
+        return version
+    tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'files'").fetchall()
+    return 1 if tables else 0
+
+def createCorpusTables(cursor):
+    """
+    Create the files and chunks tables of a new corpus.db.
+    """
+    cursor.execute(FILES_TABLE)
+    cursor.execute(CHUNKS_TABLE.format(name='chunks'))
+    cursor.execute(META_TABLE)
+    cursor.execute(f"PRAGMA user_version = {globals.CORPUS_SCHEMA_VERSION}")
+
+def readMeta(conn, key):
+    """
+    Return the value stored under key in the meta table of corpus.db, or None if it was never
+    set (or the corpus predates the table).
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meta'").fetchone() is None:
+        return None
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row is not None else None
+
+def writeMeta(cursor, key, value):
+    """
+    Store a JSON-serializable value under key in the meta table of corpus.db, creating the table
+    if needed.
+    """
+    cursor.execute(META_TABLE)
+    cursor.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+def upgradeCorpus(arag_path):
+    """
+    Upgrade corpus.db in place to the current schema, moving file paths from every chunk row
+    into the files table. Chunk ids are kept, so the embedding matrix and ANN index stay valid.
+
+    Files of a corpus without a manifest are recorded with the size and mtime of the content
+    file when it was not modified since corpus.db was written, as isCorpusUpdated() assumes.
+
+    Returns:
+        bool: True if corpus.db was upgraded.
+    """
+    corpus_db_path = os.path.join(arag_path, globals.CORPUS_DB)
+    corpus_mtime = os.path.getmtime(corpus_db_path)
+    conn = sqlite3.connect(corpus_db_path, isolation_level=None)
+    version = schemaVersion(conn)
+    if version >= globals.CORPUS_SCHEMA_VERSION:
+        conn.close()
+        return False
+
+    print(f"Upgrading corpus.db of arag {arag_path} from schema version {version} to {globals.CORPUS_SCHEMA_VERSION}")
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    try:
+        if version == 1:
+            cursor.execute("ALTER TABLE files RENAME TO files_v1")
+        cursor.execute(FILES_TABLE)
+        cursor.execute("INSERT INTO files (path, chunk_count) SELECT file_path, COUNT(*) FROM chunks "
+                       "GROUP BY file_path ORDER BY MIN(id)")
+        if version == 1:
+            # Files the manifest lists without chunks (skipped or empty) are kept too
+            cursor.execute("INSERT OR IGNORE INTO files (path) SELECT path FROM files_v1")
+            cursor.execute("UPDATE files SET (size, mtime, hash) = (SELECT size, mtime, hash FROM files_v1 "
+                           "WHERE files_v1.path = files.path)")
+            cursor.execute("DROP TABLE files_v1")
+        else:
+            content_path = os.path.join(arag_path, globals.CONTENT_SUBDIR)
+            cursor.execute("SELECT id, path FROM files")
+            seeded = []
+            for file_id, rel_path in cursor.fetchall():
+                try:
+                    stat = os.stat(os.path.join(content_path, rel_path))
+                except OSError:
+                    continue
+                if stat.st_mtime <= corpus_mtime:
+                    seeded.append((stat.st_size, stat.st_mtime, file_id))
+            cursor.executemany("UPDATE files SET size = ?, mtime = ? WHERE id = ?", seeded)
+
+        columns = [col[1] for col in cursor.execute("PRAGMA table_info(chunks)").fetchall()]
+        optional = [column for column in ('content_hash', 'embedding') if column in columns]
+        cursor.execute(CHUNKS_TABLE.format(name='chunks_v2'))
+        copied = ', '.join(['chunk_order', 'content'] + optional)
+        cursor.execute(f"INSERT INTO chunks_v2 (id, file_id, {copied}) "
+                       f"SELECT chunks.id, files.id, {copied} FROM chunks JOIN files ON files.path = chunks.file_path "
+                       f"ORDER BY chunks.id")
+        cursor.execute("DROP TABLE chunks")
+        cursor.execute("ALTER TABLE chunks_v2 RENAME TO chunks")
+        createIndexes(cursor)
+        cursor.execute(f"PRAGMA user_version = {globals.CORPUS_SCHEMA_VERSION}")
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        conn.close()
+        raise
+    # Reclaim the space of the dropped file path column
+    cursor.execute("VACUUM")
+    conn.close()
+
+    index_json_path = os.path.join(arag_path, globals.INDEX_JSON)
+    if os.path.exists(index_json_path):
+        with open(index_json_path, 'r') as f:
+            metadata = json.load(f)
+        metadata['schema_version'] = globals.CORPUS_SCHEMA_VERSION
+        with open(index_json_path, 'w') as f:
+            json.dump(metadata, f, indent=4)
+    return True
+
+def createIndexes(cursor, indexes=CORPUS_INDEXES):
+    """
+    Create the secondary indexes on corpus.db that do not exist yet.
+    """
+    for name, target in indexes.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+class BulkLoad:
+    """
+    Context manager tuning a sqlite3 connection for a large write and reporting its throughput.
+
+    On entry the journal mode, synchronous and cache_size PRAGMAs are switched to bulk settings;
+    on exit the transaction is committed, the previous settings are restored (so corpus.db is
+    left in rollback journal mode, without -wal files, ready to be packaged) and the number of
+    rows written per second is printed.
+
+    Use journal_mode='OFF' only while building a new corpus.db that is discarded if the build
+    fails, and 'WAL' when updating an existing one.
+    """
+    def __init__(self, conn, label, journal_mode='WAL', cache_size=globals.DEFAULT_BULK_CACHE_SIZE):
+        self.conn = conn
+        self.label = label
+        self.journal_mode = journal_mode
+        self.cache_size = cache_size
+        self.rows = 0
+        self.started = None
+        self.saved = None
+
+    def __enter__(self):
+        self.conn.commit()  # Journal mode cannot change inside a transaction
+        self.saved = {pragma: self.conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+                      for pragma in ('journal_mode', 'synchronous', 'cache_size', 'temp_store')}
+        self.conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        # Negative cache_size is in KiB
+        self.conn.execute(f"PRAGMA cache_size = {-(self.cache_size // 1024)}")
+        self.conn.execute("PRAGMA temp_store = MEMORY")
+        self.started = time.perf_counter()
+        return self
+
+    def add(self, rows):
+        """Count rows written, for the throughput report."""
+        self.rows += rows
+
+    def __exit__(self, exc_type, exc, traceback):
+        elapsed = time.perf_counter() - self.started
+        if exc_type is None:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+        for pragma, value in self.saved.items():
+            self.conn.execute(f"PRAGMA {pragma} = {value}")
+        if exc_type is None and self.rows:
+            print(f"{self.label}: {self.rows} rows in {elapsed:.1f}s ({self.rows / max(elapsed, 1e-9):.0f} rows/s)")
+        return False
@@ -0,0 +1,296 @@
+import asyncio
+import base64
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from collections import deque
+
+import numpy as np
+
+import globals
+from . import metrics
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors
+RETRY_STATUSES = {408, 409, 429}
+
+def estimateTokens(text):
+    """
+    Estimate the tokens of a text for packing requests and rate limiting without a tokenizer.
+    English text averages about four bytes per token; three keeps the estimate on the high
+    side, and rate limiters are corrected with the usage the API reports.
+    """
+    return len(text.encode('utf-8')) // 3 + 1
+
+class RateLimiter:
+    """
+    Token bucket allowing per_minute units (requests or tokens) a minute, refilled continuously.
+    It holds one second's worth, as providers enforce per-minute limits over shorter periods,
+    so requests are spread over the minute instead of sent in a burst. Only used from the
+    client's event loop.
+    """
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount):
+        # An amount larger than the bucket waits for a full bucket and leaves it in deficit,
+        # so the units are still paid for before the next acquire
+        while True:
+            self.refill()
+            if self.level >= min(amount, self.capacity):
+                self.level -= amount
+                return
+            await asyncio.sleep((min(amount, self.capacity) - self.level) / self.rate)
+
+    def adjust(self, amount):
+        """Charge (or refund, if negative) units used beyond those acquired."""
+        self.refill()
+        self.level = min(self.capacity, self.level - amount)
+
+class _Batch:
+    """Texts submitted together, and their embeddings as they arrive from any request."""
+    __slots__ = ('future', 'embeddings', 'remaining')
+
+    def __init__(self, size):
+        self.future = Future()
+        self.embeddings = [None] * size
+        self.remaining = size
+
+class EmbeddingClient:
+    """
+    Concurrent client of the OpenAI (or an OpenAI-compatible) embeddings API, for indexing.
+
+    It runs an asyncio event loop in a background thread for its lifetime. Texts submitted from
+    any thread are queued and packed into multi-input requests of up to
+    OPENAI_MAX_REQUEST_INPUTS inputs and OPENAI_MAX_REQUEST_TOKENS estimated tokens, with at most
+    'concurrency' requests in flight, so throughput is bounded by the rate limits rather than
+    by the round-trip time of each request. Requests wait while more would exceed the requests
+    or tokens per minute allowed, and the ones answered with 429 or 5xx are retried with
+    exponential backoff (honouring Retry-After); a 429 also holds back new requests.
+
+        client = EmbeddingClient(model_name, options)
+        try:
+            embeddings = client.submit(texts).result()
+        finally:
+            client.close()
+    """
+    def __init__(self, model_name, options):
+        """
+        Args:
+            model_name (str): Embedding model.
+            options (dict): Supports:
+                - 'api_key' (str, optional): OpenAI API key, else OPENAI_API_KEY is used.
+                - 'endpoint' (str, optional): API base URL, e.g. of a local mock server.
+                - 'concurrency' (int): Requests in flight (default: DEFAULT_OPENAI_CONCURRENCY).
+                - 'rpm' (int, optional): Requests per minute allowed.
+                - 'tpm' (int, optional): Tokens per minute allowed.
+                - 'max_retries' (int): Retries of a failed request (default: DEFAULT_OPENAI_MAX_RETRIES).
+                - 'max_request_inputs' (int, optional): Fewer inputs per request than
+                  OPENAI_MAX_REQUEST_INPUTS, for OpenAI-compatible servers with a lower limit.
+
+        Raises:
+            ImportError: If the openai library is not installed.
+            ValueError: If no API key is given.
+        """
+        try:
+            import openai
+        except ImportError:
+            raise ImportError("openai library is not installed. Install it with 'pip install openai'")
+        api_key = options.get('api_key') or os.getenv('OPENAI_API_KEY')
+        if not api_key:
+            raise ValueError("OpenAI API key is required. Provide it in options['api_key'] or set OPENAI_API_KEY environment variable.")
+        self.openai = openai
+        self.api_key = api_key
+        self.base_url = options.get('endpoint') or globals.DEFAULT_OPENAI_ENDPOINT
+        self.model = model_name
+        self.concurrency = max(1, options.get('concurrency') or globals.DEFAULT_OPENAI_CONCURRENCY)
+        self.max_retries = options.get('max_retries')
+        if self.max_retries is None:
+            self.max_retries = globals.DEFAULT_OPENAI_MAX_RETRIES
+        self.max_inputs = min(options.get('max_request_inputs') or globals.OPENAI_MAX_REQUEST_INPUTS, globals.OPENAI_MAX_REQUEST_INPUTS)
+        self.max_tokens = globals.OPENAI_MAX_REQUEST_TOKENS
+        self.rpm = RateLimiter(options['rpm']) if options.get('rpm') else None
+        self.tpm = RateLimiter(options['tpm']) if options.get('tpm') else None
+        if self.tpm is not None:
+            self.max_tokens = min(self.max_tokens, options['tpm'])
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='arag-embed', daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    def saturated(self, tokens, inputs):
+        """
+        Whether tokens and inputs submitted but not yet collected are enough to keep every
+        request slot busy with full requests twice over, so submitting more only uses memory.
+        """
+        return tokens >= 2 * self.concurrency * self.max_tokens or inputs >= 2 * self.concurrency * self.max_inputs
+
+    def submit(self, texts):
+        """
+        Queue texts for embedding.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the float32 embeddings of texts, in order, or to
+            the error of a request that failed after its retries.
+        """
+        batch = _Batch(len(texts))
+        if not texts:
+            batch.future.set_result([])
+        else:
+            self.loop.call_soon_threadsafe(self._enqueue, batch, list(texts))
+        return batch.future
+
+    def close(self):
+        """Cancel queued and in-flight requests, and stop the event loop."""
+        if self.loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self._stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def _start(self):
+        self.client = self.openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.paused_until = 0.0
+        self.requests = set()
+        self.dispatcher = self.loop.create_task(self._dispatch())
+
+    async def _stop(self):
+        tasks = [self.dispatcher] + list(self.requests)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for batch, _, _, _ in self.queue:
+            self._fail(batch, RuntimeError("Embedding client closed"))
+        self.queue.clear()
+        await self.client.close()
+
+    def _enqueue(self, batch, texts):
+        for position, text in enumerate(texts):
+            self.queue.append((batch, position, text, estimateTokens(text)))
+        self.ready.set()
+
+    def _fail(self, batch, error):
+        if not batch.future.done():
+            batch.future.set_exception(error)
+
+    async def _dispatch(self):
+        """Pack queued texts into requests as slots and rate limits allow, and send them."""
+        while True:
+            await self.ready.wait()
+            await self.slots.acquire()
+            await self._wait()
+            # Texts queued while waiting join this request
+            items = []
+            tokens = 0
+            while self.queue and len(items) < self.max_inputs:
+                item = self.queue[0]
+                if item[0].future.done():
+                    self.queue.popleft()  # Its batch already failed
+                    continue
+                if items and tokens + item[3] > self.max_tokens:
+                    break
+                items.append(self.queue.popleft())
+                tokens += item[3]
+            if not self.queue:
+                self.ready.clear()
+            if not items:
+                self.slots.release()
+                continue
+            if self.tpm is not None:
+                await self.tpm.acquire(tokens)
+            request = self.loop.create_task(self._send(items, tokens))
+            self.requests.add(request)
+            request.add_done_callback(self.requests.discard)
+
+    async def _wait(self):
+        """Wait out a rate limit pause and the requests per minute limit."""
+        delay = self.paused_until - self.loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.rpm is not None:
+            await self.rpm.acquire(1)
+
+    async def _send(self, items, tokens):
+        """Send one request, retrying it as needed, and deliver its embeddings to their batches."""
+        try:
+            texts = [item[2] for item in items]
+            attempt = 0
+            while True:
+                started = time.perf_counter()
+                try:
+                    # base64 float32 is a quarter of the size of JSON floats and decodes straight into arrays
+                    response = await self.client.embeddings.create(input=texts, model=self.model, encoding_format='base64')
+                    metrics.record('embed.openai', time.perf_counter() - started, rows=len(items), api_calls=1)
+                    break
+                except Exception as e:
+                    metrics.record('embed.openai', time.perf_counter() - started, api_calls=1)
+                    delay = self._retryDelay(e, attempt)
+                    if delay is None:
+                        for item in items:
+                            self._fail(item[0], e)
+                        return
+                    if getattr(e, 'status_code', None) == 429:
+                        self.paused_until = max(self.paused_until, self.loop.time() + delay)
+                attempt += 1
+                await asyncio.sleep(delay)
+                await self._wait()
+                if self.tpm is not None:
+                    await self.tpm.acquire(tokens)
+
+            usage = getattr(response, 'usage', None)
+            if self.tpm is not None and usage is not None and usage.total_tokens:
+                self.tpm.adjust(usage.total_tokens - tokens)
+            if len(response.data) != len(items):
+                raise ValueError(f"Expected {len(items)} embeddings, got {len(response.data)}")
+            for data in response.data:
+                batch, position, _, _ = items[data.index]
+                embedding = data.embedding
+                if isinstance(embedding, str):
+                    embedding = np.frombuffer(base64.b64decode(embedding), dtype=globals.EMBEDDING_DTYPE)
+                batch.embeddings[position] = embedding
+                batch.remaining -= 1
+                if batch.remaining == 0 and not batch.future.done():
+                    batch.future.set_result(batch.embeddings)
+        except Exception as e:
+            for item in items:
+                self._fail(item[0], e)
+        finally:
+            self.slots.release()
+
+    def _retryDelay(self, error, attempt):
+        """
+        Seconds to wait before retrying a request that failed with error, or None if it should
+        not be retried.
+        """
+        status = getattr(error, 'status_code', None)
+        if status is None:
+            if not isinstance(error, self.openai.APIConnectionError):
+                return None
+        elif status not in RETRY_STATUSES and status < 500:
+            return None
+        if attempt >= self.max_retries:
+            return None
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), globals.OPENAI_BACKOFF_MAX)
+        except ValueError:
+            pass  # An HTTP date, use the backoff instead
+        # Exponential backoff with jitter, so concurrent requests do not retry in step
+        delay = min(globals.OPENAI_BACKOFF_BASE * 2 ** attempt, globals.OPENAI_BACKOFF_MAX)
+        return delay * random.uniform(0.5, 1.0)
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import zipfile
+
+import numpy as np
+
+import globals
+from .helpers import is_packaged, get_member_offset
+
+def contentHash(text):
+    """
+    Return the SHA-256 hex digest of a chunk's text, stored in chunks.content_hash.
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def encodeEmbedding(embedding):
+    """
+    Pack an embedding vector into the BLOB format stored in chunks.embedding.
+
+    Args:
+        embedding (list or np.ndarray): The embedding vector.
+
+    Returns:
+        bytes: The vector as contiguous little-endian float32 values.
+    """
+    return np.asarray(embedding, dtype=globals.EMBEDDING_DTYPE).tobytes()
+
+def decodeEmbedding(value, dtype=globals.EMBEDDING_DTYPE):
+    """
+    Decode a single chunks.embedding value, accepting both BLOBs and legacy JSON text.
+
+    Returns:
+        np.ndarray: The embedding as a float32 vector.
+    """
+    if isinstance(value, (bytes, memoryview)):
+        return np.frombuffer(value, dtype=dtype).astype(np.float32, copy=False)
+    return np.asarray(json.loads(value), dtype=np.float32)
+
+def decodeEmbeddings(values, vector_size, dtype=globals.EMBEDDING_DTYPE):
+    """
+    Decode a list of chunks.embedding values into a (len(values), vector_size) float32 matrix.
+
+    BLOBs are joined and decoded with a single np.frombuffer call; legacy JSON rows fall back to
+    decoding one row at a time.
+    """
+    if all(isinstance(value, bytes) for value in values):
+        matrix = np.frombuffer(b''.join(values), dtype=dtype).reshape(len(values), vector_size)
+        return matrix.astype(np.float32, copy=False)
+    return np.array([decodeEmbedding(value, dtype) for value in values], dtype=np.float32)
+
+def embeddingSize(value, dtype=globals.EMBEDDING_DTYPE):
+    """
+    Return the dimension of a stored chunks.embedding value.
+    """
+    if isinstance(value, (bytes, memoryview)):
+        return len(value) // np.dtype(dtype).itemsize
+    return len(json.loads(value))
+
+def writeEmbeddingMatrix(arag_path, cursor, vector_size, batch_size=4096):
+    """
+    Write every embedding in corpus.db, in id order, to a contiguous row-major matrix file
+    (globals.EMBEDDINGS_MATRIX) plus a matching int64 id array (globals.EMBEDDING_IDS).
+
+    Args:
+        arag_path (str): Path to the .arag directory.
+        cursor (sqlite3.Cursor): Cursor on the arag's corpus.db.
+        vector_size (int): Dimension of the stored embeddings.
+        batch_size (int): Number of rows read from corpus.db at a time.
+
+    Returns:
+        dict: The 'matrix' entry for index.json.
+    """
+    matrix_path = os.path.join(arag_path, globals.EMBEDDINGS_MATRIX)
+    ids_path = os.path.join(arag_path, globals.EMBEDDING_IDS)
+    rows = 0
+    last_id = -1
+    with open(matrix_path + '.tmp', 'wb') as matrix_file, open(ids_path + '.tmp', 'wb') as ids_file:
+        while True:
+            cursor.execute("SELECT id, embedding FROM chunks WHERE embedding IS NOT NULL AND embedding != '' AND id > ? "
+                           "ORDER BY id LIMIT ?", (last_id, batch_size))
+            batch = cursor.fetchall()
+            if not batch:
+                break
+            ids = [row[0] for row in batch]
+            matrix = decodeEmbeddings([row[1] for row in batch], vector_size)
+            matrix_file.write(matrix.astype(globals.EMBEDDING_DTYPE, copy=False).tobytes())
+            ids_file.write(np.asarray(ids, dtype='<i8').tobytes())
+            rows += len(batch)
+            last_id = ids[-1]
+    os.replace(matrix_path + '.tmp', matrix_path)
+    os.replace(ids_path + '.tmp', ids_path)
+    return {
+        'file': globals.EMBEDDINGS_MATRIX,
+        'ids_file': globals.EMBEDDING_IDS,
+        'rows': rows,
+    }
+
+def writeHalfMatrix(arag_path, matrix, matrix_info, batch_size=65536):
+    """
+    Write a float16 copy of the embedding matrix (globals.EMBEDDINGS_MATRIX_F16), half the size
+    of the float32 one, to serve as the only float store of a quantized index. The caller
+    removes the float32 matrix file.
+
+    Returns:
+        dict: The 'matrix' entry for index.json, pointing at the float16 file.
+    """
+    half_path = os.path.join(arag_path, globals.EMBEDDINGS_MATRIX_F16)
+    with open(half_path + '.tmp', 'wb') as half_file:
+        for start in range(0, len(matrix), batch_size):
+            half_file.write(np.asarray(matrix[start:start + batch_size]).astype('<f2').tobytes())
+    os.replace(half_path + '.tmp', half_path)
+    return dict(matrix_info, file=globals.EMBEDDINGS_MATRIX_F16, dtype='<f2')
+
+def mapArrayFromArag(arag_path, filename, dtype, shape):
+    """
+    Memory-map a raw array file from an .arag directory, or directly out of a packaged .arag
+    when the member is stored uncompressed. Falls back to reading the member into memory.
+
+    Returns:
+        np.ndarray: A read-only array, or None if the file does not exist.
+    """
+    if not is_packaged(arag_path):
+        file_path = os.path.join(arag_path, filename)
+        if not os.path.exists(file_path):
+            return None
+        return np.memmap(file_path, dtype=dtype, mode='r', shape=shape)
+    located = get_member_offset(arag_path, filename)
+    if located is not None:
+        offset, _ = located
+        return np.memmap(arag_path, dtype=dtype, mode='r', offset=offset, shape=shape)
+    try:
+        with zipfile.ZipFile(arag_path, 'r') as zipf:
+            data = zipf.read(filename)
+    except KeyError:
+        return None
+    return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+def loadEmbeddingMatrix(arag_path, metadata):
+    """
+    Load the contiguous embedding matrix described by index.json, without copying it.
+
+    Returns:
+        tuple: (ids, matrix) arrays, or None if the arag has no matrix files. matrix is float16
+        for a --quantize-only index with a float16 rescoring store, and None for one built before
+        quantize-only indexes kept a matrix, with only the id array.
+    """
+    matrix_info = metadata.get('matrix')
+    if not matrix_info or not matrix_info.get('rows'):
+        return None
+    rows = matrix_info['rows']
+    dtype = matrix_info.get('dtype') or metadata.get('embedding_dtype', globals.EMBEDDING_DTYPE)
+    ids = mapArrayFromArag(arag_path, matrix_info['ids_file'], '<i8', (rows,))
+    if ids is None:
+        return None
+    if matrix_info.get('file') is None:
+        return ids, None
+    matrix = mapArrayFromArag(arag_path, matrix_info['file'], dtype, (rows, metadata['vector_size']))
+    if matrix is None:
+        return None
+    return ids, matrix
+
+def removeEmbeddingMatrix(arag_path):
+    """
+    Remove the matrix and id files written by writeEmbeddingMatrix(), if present.
+    """
+    for filename in (globals.EMBEDDINGS_MATRIX, globals.EMBEDDINGS_MATRIX_F16, globals.EMBEDDING_IDS):
+        file_path = os.path.join(arag_path, filename)
+        if os.path.exists(file_path):
+            os.remove(file_path)
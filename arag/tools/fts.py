@@ -0,0 +1,94 @@
+import re
+
+import globals
+
+# Keep chunks_fts in sync with chunks. Only changes to content touch the full-text index, so
+# storing embeddings does not rewrite it.
+FTS_TRIGGERS = {
+    'chunks_fts_insert': f'''AFTER INSERT ON chunks BEGIN
+        INSERT INTO {globals.FTS_TABLE} (rowid, content) VALUES (new.id, new.content);
+    END''',
+    'chunks_fts_delete': f'''AFTER DELETE ON chunks BEGIN
+        INSERT INTO {globals.FTS_TABLE} ({globals.FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+    END''',
+    'chunks_fts_update': f'''AFTER UPDATE OF content ON chunks BEGIN
+        INSERT INTO {globals.FTS_TABLE} ({globals.FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {globals.FTS_TABLE} (rowid, content) VALUES (new.id, new.content);
+    END''',
+}
+
+# Runs of characters the default unicode61 tokenizer keeps together, plus the separators
+# inside identifiers, so 'foo_bar.baz()' is searched as the phrase "foo_bar.baz"
+QUERY_TERM = re.compile(r'[\w.:/-]*\w', re.UNICODE)
+
+def hasFTS(conn):
+    """
+    Check whether corpus.db has a full-text index. Works on sqlite3 and apsw connections.
+    """
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (globals.FTS_TABLE,)).fetchall()
+    return bool(rows)
+
+def createFTS(cursor):
+    """
+    Build the FTS5 index over chunks.content, and the triggers keeping it up to date, if
+    corpus.db does not have one yet.
+
+    chunks_fts is an external content table: it stores only the inverted index and reads chunk
+    text from chunks, so the content is not duplicated.
+
+    Returns:
+        bool: True if the index was built.
+    """
+    if hasFTS(cursor.connection):
+        return False
+    cursor.execute(f"CREATE VIRTUAL TABLE {globals.FTS_TABLE} USING fts5(content, content='chunks', content_rowid='id')")
+    cursor.execute(f"INSERT INTO {globals.FTS_TABLE} ({globals.FTS_TABLE}) VALUES ('rebuild')")
+    for name, body in FTS_TRIGGERS.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    return True
+
+def ftsQuery(text):
+    """
+    Turn free text into an FTS5 MATCH expression: each term quoted, so punctuation and FTS5
+    operators in the text are matched literally, and alternatives joined with OR for BM25 to rank.
+
+    Returns:
+        str: The expression, or None if the text has no searchable terms.
+    """
+    terms = list(dict.fromkeys(QUERY_TERM.findall(text)))
+    if not terms:
+        return None
+    return ' OR '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+def searchFTS(conn, text, topk):
+    """
+    Rank chunks against a query text with BM25.
+
+    Args:
+        conn: sqlite3 or apsw connection to corpus.db.
+
+    Returns:
+        tuple: (chunk ids, scores), best first. Scores are negated BM25 ranks, higher is better.
+    """
+    expression = ftsQuery(text)
+    if expression is None:
+        return [], []
+    rows = conn.execute(f"SELECT rowid, rank FROM {globals.FTS_TABLE} WHERE {globals.FTS_TABLE} MATCH ? "
+                        f"ORDER BY rank LIMIT ?", (expression, topk)).fetchall()
+    return [row[0] for row in rows], [-row[1] for row in rows]
+
+def fuseRankings(rankings, topk, k=globals.RRF_K):
+    """
+    Combine ranked lists of chunk ids with reciprocal rank fusion: each id scores the sum of
+    1 / (k + rank) over the lists it appears in, ranks starting at 1.
+
+    Returns:
+        tuple: (chunk ids, fused scores), best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            fused[id] = fused.get(id, 0.0) + 1.0 / (k + rank)
+    best = sorted(fused.items(), key=lambda item: -item[1])[:topk]
+    return [id for id, _ in best], [score for _, score in best]
@@ -0,0 +1,88 @@
+import re
+import zlib
+
+import numpy as np
+
+import globals
+
+# Words: runs of letters, digits and underscores
+TOKEN = re.compile(r'\w+', re.UNICODE)
+HASH_MODEL = re.compile(r'hash-(\d+)$')
+
+# crc32 of each feature seen so far; text vocabularies are small next to the number of tokens
+_feature_hashes = {}
+MAX_CACHED_FEATURES = 1 << 20
+
+def hashVectorSize(model):
+    """
+    Return the number of dimensions named by a 'hash' method model, 'hash-<dimensions>'.
+
+    Raises:
+        ValueError: If the model name is not of that form.
+    """
+    match = HASH_MODEL.match(model or '')
+    if match is None or int(match.group(1)) < 2:
+        raise ValueError(f"Unsupported hash model: {model}. Use 'hash-<dimensions>', e.g. '{globals.DEFAULT_HASH_EMBEDDING_MODEL}'.")
+    return int(match.group(1))
+
+def featureHashes(features):
+    """
+    Return the crc32 of each feature string. crc32 is stable across runs, platforms and Python
+    versions, unlike hash(), so an arag's embeddings can be reproduced at query time.
+    """
+    hashes = []
+    cache = _feature_hashes
+    if len(cache) > MAX_CACHED_FEATURES:
+        cache.clear()
+    for feature in features:
+        value = cache.get(feature)
+        if value is None:
+            value = cache[feature] = zlib.crc32(feature.encode('utf-8'))
+        hashes.append(value)
+    return hashes
+
+def pairHashes(first, second):
+    """
+    Hash word bigrams from the hashes of their words, with a 64-bit multiply-xorshift mix, so
+    bigram strings are never built.
+    """
+    mixed = first.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15) + second.astype(np.uint64)
+    mixed ^= mixed >> np.uint64(29)
+    mixed *= np.uint64(0xBF58476D1CE4E5B9)
+    mixed ^= mixed >> np.uint64(32)
+    return (mixed & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+def hashEmbed(texts, vector_size):
+    """
+    Embed texts by signed feature hashing of their lowercased words and word bigrams: each
+    feature adds +1 or -1 (from the top bit of its hash) to the dimension its hash selects,
+    counts are damped with sign(x) * log(1 + |x|), and vectors are scaled to unit length.
+
+    Texts sharing words get a positive cosine similarity, so the embeddings work like a
+    bag-of-words TF model without any model download or fitting.
+
+    Returns:
+        np.ndarray: float32 matrix of shape (len(texts), vector_size). Texts without words
+        embed to zero vectors.
+    """
+    tokens = []
+    lengths = []
+    for text in texts:
+        words = TOKEN.findall(text.lower())
+        tokens.extend(words)
+        lengths.append(len(words))
+    word_hashes = np.array(featureHashes(tokens), dtype=np.uint32)
+    word_rows = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+    # Bigrams of consecutive words of the same text
+    same_text = word_rows[1:] == word_rows[:-1]
+    hashes = np.concatenate([word_hashes, pairHashes(word_hashes[:-1][same_text], word_hashes[1:][same_text])])
+    row_ids = np.concatenate([word_rows, word_rows[1:][same_text]])
+
+    columns = (hashes % np.uint32(vector_size)).astype(np.int64)
+    signs = np.where(hashes >> np.uint32(31), 1.0, -1.0)
+    counts = np.bincount(row_ids * vector_size + columns, weights=signs,
+                         minlength=len(lengths) * vector_size).reshape(len(lengths), vector_size)
+    vectors = (np.sign(counts) * np.log1p(np.abs(counts))).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
@@ -1,11 +1,17 @@
 import os
 import shutil
+import sqlite3
+import struct
 import tempfile
 import zipfile
+import zlib
 
-from pypdf import PdfReader
-from spire.doc import *
-from spire.doc.common import *
+import globals
+
+# Extra field id used to pad local headers, same as Android's zipalign
+ZIP_ALIGNMENT_EXTRA_ID = 0xD935
+# Sizes and offsets beyond which members are written with zip64 extra fields, as zipfile does
+ZIP64_LIMIT = (1 << 31) - 1
 
 def get_files(path):
     # Initialize the list of files
@@ -60,6 +66,299 @@ def get_file_from_arag(arag_path, filename):
         else:
             return None  # File not found in directory .arag
 
+def get_member_offset(archive_path, member):
+    """
+    Locate the raw data of an uncompressed member inside a zip archive.
+
+    Args:
+        archive_path (str): Path to the packaged .arag file.
+        member (str): Name of the member inside the archive.
+
+    Returns:
+        tuple: (offset, size) of the member data in the archive, or None if the member
+        is missing or compressed.
+    """
+    with zipfile.ZipFile(archive_path, 'r') as zipf:
+        try:
+            info = zipf.getinfo(member)
+        except KeyError:
+            return None
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(archive_path, 'rb') as f:
+        return member_data_offset(f, info), info.file_size
+
+def member_data_offset(f, info):
+    """
+    Return the offset of a member's (possibly compressed) data in an open zip archive file.
+    """
+    # The central directory does not record the local header's extra field length, read it
+    f.seek(info.header_offset)
+    header = f.read(30)
+    if header[:4] != b'PK\x03\x04':
+        raise zipfile.BadZipFile(f"Bad local file header for {info.filename}")
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    return info.header_offset + 30 + name_len + extra_len
+
+class ArchiveWriter:
+    """
+    Write a zip archive for packaging: members are appended stored at an aligned offset from a
+    file, or from data already in their stored form (deflated or not, e.g. compressed by a worker
+    thread or copied from an existing archive), then the central directory is written on close.
+
+    zipfile.ZipFile cannot append pre-compressed data without changing its private state, so
+    headers are written here with struct from the documented ZipInfo attributes (filename,
+    date_time, compress_type, CRC, compress_size, file_size, create_system, external_attr).
+    The archives are read with zipfile.ZipFile.
+
+        with ArchiveWriter(path) as archive:
+            archive.write_aligned(file_path, arcname)
+            archive.write_raw(zinfo, data)
+    """
+    def __init__(self, path):
+        self.fp = open(path, 'wb')
+        self.members = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.fp.close()
+        return False
+
+    def write_aligned(self, file_path, arcname, alignment=globals.ZIP_ALIGNMENT):
+        """
+        Store a file uncompressed with its data starting on an `alignment` byte boundary of the
+        archive, padding the local header's extra field as needed.
+        """
+        zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+        zinfo.compress_type = zipfile.ZIP_STORED
+        zinfo.compress_size = zinfo.file_size
+        zinfo.CRC = 0  # Patched once the data is written
+        zip64 = zinfo.file_size > ZIP64_LIMIT
+        header_end = self.fp.tell() + 30 + len(zinfo.filename.encode('utf-8')) + (20 if zip64 else 0) + 6
+        padding = -header_end % alignment
+        self._writeHeader(zinfo, struct.pack('<HHH', ZIP_ALIGNMENT_EXTRA_ID, 2 + padding, alignment) + b'\0' * padding)
+        crc = 0
+        size = 0
+        with open(file_path, 'rb') as src:
+            while True:
+                block = src.read(1024 * 1024)
+                if not block:
+                    break
+                crc = zlib.crc32(block, crc)
+                size += len(block)
+                self.fp.write(block)
+        if size != zinfo.file_size:
+            raise OSError(f"{file_path} changed size while being packaged")
+        zinfo.CRC = crc
+        end = self.fp.tell()
+        self.fp.seek(zinfo.header_offset + 14)
+        self.fp.write(struct.pack('<L', crc))
+        self.fp.seek(end)
+
+    def write_raw(self, zinfo, data, size=None):
+        """
+        Append a member from data already in its stored form (compressed with
+        zinfo.compress_type), with zinfo's CRC, file_size and compress_size set. data is read to
+        its end, or for size bytes.
+        """
+        self._writeHeader(zinfo, b'')
+        if size is None:
+            shutil.copyfileobj(data, self.fp, 1024 * 1024)
+            return
+        while size > 0:
+            block = data.read(min(size, 1024 * 1024))
+            if not block:
+                raise zipfile.BadZipFile(f"Truncated data for {zinfo.filename}")
+            self.fp.write(block)
+            size -= len(block)
+
+    def close(self):
+        """Write the central directory and end records, and close the archive."""
+        directory_offset = self.fp.tell()
+        for zinfo in self.members:
+            zip64_fields = []
+            sizes = (zinfo.compress_size, zinfo.file_size)
+            if max(sizes) > ZIP64_LIMIT:
+                zip64_fields += [zinfo.file_size, zinfo.compress_size]
+                sizes = (0xFFFFFFFF, 0xFFFFFFFF)
+            header_offset = zinfo.header_offset
+            if header_offset > ZIP64_LIMIT:
+                zip64_fields.append(header_offset)
+                header_offset = 0xFFFFFFFF
+            extra = struct.pack(f'<HH{len(zip64_fields)}Q', 1, 8 * len(zip64_fields), *zip64_fields) if zip64_fields else b''
+            name = zinfo.filename.encode('utf-8')
+            version = self._version(zinfo, bool(zip64_fields))
+            self.fp.write(struct.pack('<4sHHHHHHLLLHHHHHLL', b'PK\x01\x02', zinfo.create_system << 8 | version, version,
+                                      self._flags(zinfo), zinfo.compress_type, *self._dosTime(zinfo), zinfo.CRC,
+                                      sizes[0], sizes[1], len(name), len(extra), 0, 0, 0, zinfo.external_attr,
+                                      header_offset))
+            self.fp.write(name)
+            self.fp.write(extra)
+        directory_end = self.fp.tell()
+        count = len(self.members)
+        directory_size = directory_end - directory_offset
+        if count > 0xFFFF or directory_offset > ZIP64_LIMIT or directory_size > ZIP64_LIMIT:
+            self.fp.write(struct.pack('<4sQHHLLQQQQ', b'PK\x06\x06', 44, 45, 45, 0, 0, count, count,
+                                      directory_size, directory_offset))
+            self.fp.write(struct.pack('<4sLQL', b'PK\x06\x07', 0, directory_end, 1))
+            count = min(count, 0xFFFF)
+            directory_offset = min(directory_offset, 0xFFFFFFFF)
+            directory_size = min(directory_size, 0xFFFFFFFF)
+        self.fp.write(struct.pack('<4sHHHHLLH', b'PK\x05\x06', 0, 0, count, count, directory_size, directory_offset, 0))
+        self.fp.close()
+
+    def _writeHeader(self, zinfo, extra):
+        zinfo.header_offset = self.fp.tell()
+        sizes = (zinfo.compress_size, zinfo.file_size)
+        zip64 = max(sizes) > ZIP64_LIMIT
+        if zip64:
+            extra = struct.pack('<HHQQ', 1, 16, zinfo.file_size, zinfo.compress_size) + extra
+            sizes = (0xFFFFFFFF, 0xFFFFFFFF)
+        name = zinfo.filename.encode('utf-8')
+        self.fp.write(struct.pack('<4sHHHHHLLLHH', b'PK\x03\x04', self._version(zinfo, zip64), self._flags(zinfo),
+                                  zinfo.compress_type, *self._dosTime(zinfo), zinfo.CRC, sizes[0], sizes[1],
+                                  len(name), len(extra)))
+        self.fp.write(name)
+        self.fp.write(extra)
+        self.members.append(zinfo)
+
+    @staticmethod
+    def _version(zinfo, zip64):
+        # Version needed to extract: 4.5 for zip64, 2.0 for deflate, 1.0 for stored
+        if zip64:
+            return 45
+        return 20 if zinfo.compress_type == zipfile.ZIP_DEFLATED else 10
+
+    @staticmethod
+    def _flags(zinfo):
+        # Bit 11: the file name is UTF-8
+        return 0x800 if not zinfo.filename.isascii() else 0
+
+    @staticmethod
+    def _dosTime(zinfo):
+        year, month, day, hour, minute, second = zinfo.date_time
+        return hour << 11 | minute << 5 | second // 2, (year - 1980) << 9 | month << 5 | day
+
+def compress_member(file_path, arcname, level=globals.DEFAULT_COMPRESS_LEVEL, spool_size=globals.PACKAGE_SPOOL_SIZE):
+    """
+    Compress a file into raw zip member data, ready for ArchiveWriter.write_raw(). Runs in packaging
+    worker threads: zlib releases the GIL while deflating.
+
+    Files with an extension in globals.STORED_EXTENSIONS, files that do not shrink and every
+    file at level 0 are stored uncompressed.
+
+    Returns:
+        tuple: (zinfo, data) where data is a file object positioned at the start of the member
+        data, spooled to disk beyond spool_size bytes.
+    """
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    stored = level == 0 or os.path.splitext(arcname)[1].lower() in globals.STORED_EXTENSIONS
+    data = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    crc = 0
+    with open(file_path, 'rb') as src:
+        if not stored:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)  # Raw deflate, as zip stores it
+            while True:
+                block = src.read(1024 * 1024)
+                if not block:
+                    break
+                crc = zlib.crc32(block, crc)
+                data.write(compressor.compress(block))
+            data.write(compressor.flush())
+            if data.tell() >= zinfo.file_size:
+                # Incompressible, store it instead
+                stored = True
+                data.seek(0)
+                data.truncate()
+                src.seek(0)
+                crc = 0
+        if stored:
+            while True:
+                block = src.read(1024 * 1024)
+                if not block:
+                    break
+                crc = zlib.crc32(block, crc)
+                data.write(block)
+    zinfo.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+    zinfo.CRC = crc
+    zinfo.compress_size = data.tell()
+    data.seek(0)
+    return zinfo, data
+
+def member_unchanged(file_path, info):
+    """
+    Check whether a file still matches a member of an existing archive: same size, and the same
+    zip timestamp (2 second resolution) or, failing that, the same CRC-32.
+    """
+    stat = os.stat(file_path)
+    if stat.st_size != info.file_size:
+        return False
+    if zipfile.ZipInfo.from_file(file_path).date_time == info.date_time:
+        return True
+    crc = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(1024 * 1024)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+    return crc == info.CRC
+
+def reuse_member(file_path, arcname, info):
+    """
+    Describe a new member whose data is copied raw from info, the matching member of an
+    existing archive, with the file's current timestamp and attributes.
+    """
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    zinfo.compress_type = info.compress_type
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    return zinfo
+
+def compact_corpus_db(db_path, drop_embeddings=False):
+    """
+    Copy corpus.db for packaging without its embedding_cache table and free pages, or return
+    None if it has neither. Cached vectors only serve re-indexing, which a packaged arag cannot
+    do. The caller removes the copy.
+
+    Args:
+        drop_embeddings (bool): Also leave chunks.embedding empty, for an index whose matrix
+            file is the only float store of the packaged arag ('index --quantize-only').
+
+    Returns:
+        str: Path of the temporary copy, or None to package db_path as it is.
+    """
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        cached = 0
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'embedding_cache'").fetchone():
+            cached = conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        if not drop_embeddings and not cached and not conn.execute("PRAGMA freelist_count").fetchone()[0]:
+            return None
+        fd, copy_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        copy = sqlite3.connect(copy_path)
+        conn.backup(copy)
+    finally:
+        conn.close()
+    try:
+        copy.execute("DROP TABLE IF EXISTS embedding_cache")
+        if drop_embeddings:
+            copy.execute("UPDATE chunks SET embedding = NULL")
+        copy.commit()
+        copy.execute("VACUUM")
+    except Exception:
+        copy.close()
+        os.remove(copy_path)
+        raise
+    copy.close()
+    return copy_path
+
 def get_corpus_db_temp(arag_path):
     if is_packaged(arag_path):
         with zipfile.ZipFile(arag_path, 'r') as zipf:
@@ -92,6 +391,8 @@ def processFileToText(file_path):
     
 
 def processPDF(file_path):
+    from pypdf import PdfReader  # Imported here so commands that read no PDFs start fast
+
     # read the PDF file
     reader = PdfReader(file_path)
     text = ''
@@ -100,6 +401,8 @@ def processPDF(file_path):
     return text
 
 def processDOCX(file_path):
+    from spire.doc import Document  # Imported here, loading spire takes most of a second
+
     # read the DOCX file
     doc = Document()
     doc.LoadFromFile(file_path)
@@ -1,139 +1,642 @@
 import sqlite3
 import json
 import os
-try:
-    from openai import OpenAI
-except ImportError:
-    OpenAI = None
-try:
-    from sentence_transformers import SentenceTransformer
-except ImportError:
-    SentenceTransformer = None
+from collections import deque
 
 import globals
+from .embeddings import (contentHash, encodeEmbedding, embeddingSize, writeEmbeddingMatrix, writeHalfMatrix,
+                         removeEmbeddingMatrix, loadEmbeddingMatrix)
+from .ann import buildANN, removeANN
+from .quantize import writeQuantized, removeQuantized
+from .db import BulkLoad, createIndexes, upgradeCorpus
+from .hashing import hashEmbed, hashVectorSize
+from . import metrics
 
-def generateEmbedding(content, options):
+def resolveModelName(options):
     """
-    Generate an embedding for the given content based on the specified method in options.
+    Return the embedding model name from options, falling back to the default for the method.
+    """
+    method = options.get('method', 'local')
+    model_name = options.get('model')
+    if not model_name:
+        if method == 'local':
+            model_name = globals.DEFAULT_LOCAL_EMBEDDING_MODEL
+        elif method == 'hash':
+            model_name = globals.DEFAULT_HASH_EMBEDDING_MODEL
+        else:
+            model_name = globals.DEFAULT_OPENAI_EMBEDDING_MODEL
+    return model_name
+
+def embeddingEndpoint(settings):
+    """
+    Return the endpoint embeddings are computed by under settings (index options or index.json
+    metadata): the OpenAI endpoint for the 'openai' method and '' for the others. Stored vectors
+    are only reused for the same endpoint, as servers exposing the same model name may not
+    return the same vectors.
+    """
+    if settings.get('method', 'local') != 'openai':
+        return ''
+    return (settings.get('endpoint') or globals.DEFAULT_OPENAI_ENDPOINT).rstrip('/')
+
+def loadEmbedder(options):
+    """
+    Load the embedding model or client once and return a function that embeds a batch of texts.
 
     Args:
-        content (str): The text content to embed.
         options (dict): Configuration options including:
-            - 'method' (str): 'openai' for OpenAI API or 'local' for local model (default: 'local').
-            - 'model' (str): Model name (default: 'sentence-transformers/all-MiniLM-L6-v2' for local, 'text-embedding-3-small' for OpenAI).
+            - 'method' (str): 'openai' for OpenAI API, 'local' for local model or 'hash' for
+              feature hashing, see hashing.hashEmbed() (default: 'local').
+            - 'model' (str): Model name (default: 'sentence-transformers/all-MiniLM-L6-v2' for local, 'text-embedding-3-small' for OpenAI,
+              'hash-1024' for hash, where the number is the vector size).
             - 'api_key' (str, optional): OpenAI API key if using 'openai' method.
+            - 'endpoint' (str, optional): OpenAI API endpoint.
 
     Returns:
-        list: The embedding vector as a list of floats.
+        callable: Takes a list of strings and returns their embedding vectors (lists of floats, or the rows of
+        a float32 array) in the same order.
 
     Raises:
         ImportError: If required libraries are not installed.
         ValueError: If method is unsupported or API key is missing for OpenAI.
     """
     method = options.get('method', 'local')
-    model_name = options.get('model')
-    if not model_name:
-        model_name = globals.DEFAULT_LOCAL_EMBEDDING_MODEL if method == 'local' else globals.DEFAULT_OPENAI_EMBEDDING_MODEL
+    model_name = resolveModelName(options)
 
     if method == 'openai':
-        if OpenAI is None:
+        # Embedding clients are imported on first use, they are slow to load and most commands need neither
+        try:
+            from openai import OpenAI
+        except ImportError:
             raise ImportError("openai library is not installed. Install it with 'pip install openai'")
         api_key = options.get('api_key') or os.getenv('OPENAI_API_KEY')
         if not api_key:
             raise ValueError("OpenAI API key is required. Provide it in options['api_key'] or set OPENAI_API_KEY environment variable.")
-        base_url = options.get('endpoint', 'https://api.openai.com/v1')  # Use provided endpoint or default
+        base_url = options.get('endpoint') or globals.DEFAULT_OPENAI_ENDPOINT
         client = OpenAI(api_key=api_key, base_url=base_url)
-        response = client.embeddings.create(input=content, model=model_name)
-        embedding = response.data[0].embedding
+
+        def embed(texts):
+            # One multi-input request per batch; results carry their input index
+            with metrics.Stage('embed.openai', rows=len(texts), api_calls=1):
+                response = client.embeddings.create(input=list(texts), model=model_name)
+            data = sorted(response.data, key=lambda item: item.index)
+            return [item.embedding for item in data]
     elif method == 'local':
-        if SentenceTransformer is None:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
             raise ImportError("sentence-transformers library is not installed. Install it with 'pip install sentence-transformers'")
         model = SentenceTransformer(model_name)
-        embedding = model.encode(content).tolist()
+
+        def embed(texts):
+            with metrics.Stage('embed.local', rows=len(texts)):
+                return model.encode(list(texts)).tolist()
+    elif method == 'hash':
+        vector_size = hashVectorSize(model_name)
+
+        def embed(texts):
+            with metrics.Stage('embed.hash', rows=len(texts)):
+                return hashEmbed(list(texts), vector_size)
     else:
-        raise ValueError(f"Unsupported method: {method}. Use 'openai' or 'local'.")
+        raise ValueError(f"Unsupported method: {method}. Use 'openai', 'local' or 'hash'.")
+
+    return embed
+
+def generateEmbedding(content, options):
+    """
+    Generate an embedding for the given content based on the specified method in options.
+
+    Loads the model or client for a single call; use loadEmbedder() when embedding many texts.
+
+    Args:
+        content (str): The text content to embed.
+        options (dict): Configuration options, see loadEmbedder().
+
+    Returns:
+        list: The embedding vector as a list of floats.
+    """
+    return loadEmbedder(options)([content])[0]
+
+def readIndexMetadata(arag_path):
+    """
+    Read index.json from an .arag directory, or return None if it does not exist.
+    """
+    index_json_path = os.path.join(arag_path, globals.INDEX_JSON)
+    if not os.path.exists(index_json_path):
+        return None
+    with open(index_json_path, 'r') as f:
+        return json.load(f)
+
+def collectIndexMetadata(cursor, options):
+    """
+    Build the index.json metadata describing the embeddings currently stored in corpus.db.
+    """
+    cursor.execute("SELECT COUNT(*) FROM chunks WHERE embedding IS NOT NULL AND embedding != ''")
+    total_embeddings = cursor.fetchone()[0]
+    cursor.execute("SELECT embedding FROM chunks WHERE embedding IS NOT NULL AND embedding != '' LIMIT 1")
+    sample_embedding = cursor.fetchone()
+    vector_size = embeddingSize(sample_embedding[0]) if sample_embedding else 0
+    method = options.get('method', 'local')
+    metadata = {
+        'method': method,
+        'model': resolveModelName(options),
+        'vector_size': vector_size,
+        'embedding_dtype': globals.EMBEDDING_DTYPE,
+        'total_embeddings': total_embeddings,
+        'version': globals.VERSION,
+        'schema_version': globals.CORPUS_SCHEMA_VERSION,
+    }
+    if method == 'openai':
+        metadata['endpoint'] = options.get('endpoint') or globals.DEFAULT_OPENAI_ENDPOINT
+    return metadata
+
+def saveIndexMetadata(arag_path, metadata):
+    """
+    Write index.json into an .arag directory.
+    """
+    index_json_path = os.path.join(arag_path, globals.INDEX_JSON)
+    with open(index_json_path, 'w') as f:
+        json.dump(metadata, f, indent=4)
+
+def buildIndexArtifacts(arag_path, cursor, metadata, options=None):
+    """
+    Write the files derived from the embeddings in corpus.db and record them in metadata:
+    the contiguous embedding matrix, an ANN index over it if options['ann'] is set and
+    quantized codes if options['quantize'] is set.
+
+    With options['quantize_only'] the matrix becomes the only float store of the packaged arag,
+    which leaves the embeddings in corpus.db out (see package()) and rescores candidates from
+    the matrix; options['rescore_dtype'] 'float16' halves it, unless an ANN index searches it.
+    """
+    if options is None:
+        options = {}
+    removeIndexArtifacts(arag_path)
+    metadata.pop('matrix', None)
+    metadata.pop('ann', None)
+    metadata.pop('quantization', None)
+    if metadata['total_embeddings'] == 0:
+        return
+    metadata['matrix'] = writeEmbeddingMatrix(arag_path, cursor, metadata['vector_size'])
+    _, matrix = loadEmbeddingMatrix(arag_path, metadata)
+    if options.get('quantize'):
+        print(f"Quantizing {len(matrix)} embeddings to {options['quantize']}")
+        metadata['quantization'] = writeQuantized(arag_path, matrix, options['quantize'])
+    if options.get('ann'):
+        print(f"Building {options['ann']} ANN index over {len(matrix)} embeddings")
+        try:
+            metadata['ann'] = buildANN(arag_path, matrix, options)
+        except Exception as e:
+            # Queries fall back to exact search
+            print(f"Error building {options['ann']} ANN index: {e}")
+            removeANN(arag_path)
+    if options.get('quantize_only') and options.get('quantize'):
+        metadata['quantization']['only'] = True
+        if options.get('rescore_dtype') == 'float16':
+            if 'ann' in metadata:
+                print("Keeping the float32 matrix, which the ANN index searches.")
+            else:
+                metadata['matrix'] = writeHalfMatrix(arag_path, matrix, metadata['matrix'])
+                del matrix
+                os.remove(os.path.join(arag_path, globals.EMBEDDINGS_MATRIX))
+
+def removeIndexArtifacts(arag_path):
+    """
+    Remove the files written by buildIndexArtifacts(), which are stale once corpus.db changes.
+    """
+    removeEmbeddingMatrix(arag_path)
+    removeANN(arag_path)
+    removeQuantized(arag_path)
+
+def ensureEmbeddingCache(cursor):
+    """
+    Add the chunks.content_hash column and the embedding_cache table if missing.
+
+    embedding_cache holds vectors that were dropped from chunks (by --force, an incremental
+    corpify or a full recorpify) keyed by (method, model, endpoint, content_hash), so
+    re-indexing identical text does not call the embedding provider again. It is emptied once
+    an index run completes, and left out of packaged arags. Caches written
+    before the endpoint was part of the key are converted, dropping their OpenAI vectors, whose
+    endpoint is unknown.
+    """
+    cursor.execute("PRAGMA table_info(chunks)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if 'content_hash' not in columns:
+        cursor.execute("ALTER TABLE chunks ADD COLUMN content_hash TEXT")
+    cursor.execute("PRAGMA table_info(embedding_cache)")
+    cache_columns = [col[1] for col in cursor.fetchall()]
+    if cache_columns and 'endpoint' not in cache_columns:
+        cursor.execute("ALTER TABLE embedding_cache RENAME TO embedding_cache_old")
+    cursor.execute('''CREATE TABLE IF NOT EXISTS embedding_cache
+                      (method TEXT NOT NULL,
+                       model TEXT NOT NULL,
+                       endpoint TEXT NOT NULL,
+                       content_hash TEXT NOT NULL,
+                       embedding BLOB NOT NULL,
+                       PRIMARY KEY (method, model, endpoint, content_hash))''')
+    if cache_columns and 'endpoint' not in cache_columns:
+        cursor.execute("INSERT INTO embedding_cache (method, model, endpoint, content_hash, embedding) "
+                       "SELECT method, model, '', content_hash, embedding FROM embedding_cache_old WHERE method != 'openai'")
+        cursor.execute("DROP TABLE embedding_cache_old")
 
-    return embedding
+def stashEmbeddings(cursor, metadata, schema='main', condition='1', params=()):
+    """
+    Copy the embeddings of chunks about to be discarded into embedding_cache, keyed by the
+    method, model and endpoint recorded in metadata (index.json).
+
+    Args:
+        cursor (sqlite3.Cursor): Cursor on the corpus.db receiving the cache entries.
+        metadata (dict): index.json of the embeddings being stashed; legacy JSON embeddings are skipped.
+        schema (str): Database holding the chunks, e.g. an attached previous corpus.db.
+        condition (str): SQL condition selecting the chunks to stash, with params.
+    """
+    if metadata is None or metadata.get('embedding_dtype') != globals.EMBEDDING_DTYPE:
+        return
+    cursor.execute(f"PRAGMA {schema}.table_info(chunks)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if 'embedding' not in columns:
+        return
+    hash_column = 'content_hash' if 'content_hash' in columns else 'NULL'
+    endpoint = embeddingEndpoint(metadata)
+    reader = cursor.connection.cursor()
+    reader.execute(f"SELECT {hash_column}, content, embedding FROM {schema}.chunks "
+                   f"WHERE typeof(embedding) = 'blob' AND {condition}", params)
+    while True:
+        rows = reader.fetchmany(1024)
+        if not rows:
+            break
+        cursor.executemany("INSERT OR REPLACE INTO main.embedding_cache (method, model, endpoint, content_hash, embedding) VALUES (?, ?, ?, ?, ?)",
+                           [(metadata['method'], metadata['model'], endpoint, content_hash or contentHash(content), embedding)
+                            for content_hash, content, embedding in rows])
+
+def carryEmbeddings(cursor, old_db_path, metadata):
+    """
+    Stash every embedding of a corpus.db being replaced, including its own embedding_cache,
+    into the embedding_cache of the new corpus.db open on cursor.
+    """
+    ensureEmbeddingCache(cursor)
+    cursor.execute("ATTACH DATABASE ? AS previous", (old_db_path,))
+    try:
+        cursor.execute("PRAGMA previous.table_info(embedding_cache)")
+        cache_columns = [col[1] for col in cursor.fetchall()]
+        if 'endpoint' in cache_columns:
+            cursor.execute("INSERT OR REPLACE INTO main.embedding_cache (method, model, endpoint, content_hash, embedding) "
+                           "SELECT method, model, endpoint, content_hash, embedding FROM previous.embedding_cache")
+        elif cache_columns:
+            # Written before the endpoint was part of the key, see ensureEmbeddingCache()
+            cursor.execute("INSERT OR REPLACE INTO main.embedding_cache (method, model, endpoint, content_hash, embedding) "
+                           "SELECT method, model, '', content_hash, embedding FROM previous.embedding_cache WHERE method != 'openai'")
+        stashEmbeddings(cursor, metadata, schema='previous')
+        cursor.connection.commit()
+    finally:
+        cursor.execute("DETACH DATABASE previous")
+
+def lookupEmbeddings(cursor, method, model, endpoint, hashes):
+    """
+    Find stored embeddings for chunk content hashes: vectors already computed for identical
+    chunks in this run or a previous one, then vectors in embedding_cache for the same method,
+    model and endpoint (see embeddingEndpoint()).
+
+    Returns:
+        dict: Maps each found content hash to its embedding BLOB.
+    """
+    placeholders = ','.join('?' * len(hashes))
+    cursor.execute(f"SELECT content_hash, embedding FROM chunks WHERE content_hash IN ({placeholders}) "
+                   f"AND typeof(embedding) = 'blob'", hashes)
+    found = dict(cursor.fetchall())
+    missing = [content_hash for content_hash in hashes if content_hash not in found]
+    if missing:
+        placeholders = ','.join('?' * len(missing))
+        cursor.execute(f"SELECT content_hash, embedding FROM embedding_cache WHERE method = ? AND model = ? AND endpoint = ? "
+                       f"AND content_hash IN ({placeholders})", [method, model, endpoint] + missing)
+        found.update(cursor.fetchall())
+    return found
+
+def invalidateIndexArtifacts(arag_path):
+    """
+    Remove the files written by buildIndexArtifacts() after corpus.db was updated in place and
+    drop them from index.json, so queries read the embeddings from corpus.db until the next
+    'arag index' rebuilds them.
+    """
+    removeIndexArtifacts(arag_path)
+    metadata = readIndexMetadata(arag_path)
+    if metadata is None:
+        return
+    metadata.pop('matrix', None)
+    metadata.pop('ann', None)
+    metadata.pop('quantization', None)
+    saveIndexMetadata(arag_path, metadata)
+
+def embedBatches(batches, embed=None, client=None):
+    """
+    Embed the pending texts of each (ids, hashes, vectors, pending) batch read by index(), and
+    yield (batch, embeddings, error) in batch order, stopping after the first error.
+
+    With an EmbeddingClient, batches are submitted ahead of the one being stored, so requests
+    are in flight while earlier results are written, until the client is saturated().
+
+    Args:
+        batches (iterable): Batches whose pending dict maps keys to the texts to embed.
+        embed (callable, optional): Embedding function from loadEmbedder(), used without a client.
+        client (EmbeddingClient, optional): Client to submit the texts to instead.
+    """
+    if client is None:
+        for batch in batches:
+            pending = batch[3]
+            try:
+                with metrics.Stage('index.embed', rows=len(pending)):
+                    embeddings = embed(list(pending.values())) if pending else []
+            except Exception as e:
+                yield batch, None, e
+                return
+            yield batch, embeddings, None
+        return
+
+    from .embedclient import estimateTokens
+    submitted = deque()
+    tokens = inputs = 0
+    batches = iter(batches)
+    while True:
+        batch = next(batches, None)
+        if batch is not None:
+            texts = list(batch[3].values())
+            size = sum(estimateTokens(text) for text in texts)
+            submitted.append((batch, size, client.submit(texts)))
+            tokens += size
+            inputs += len(texts)
+        # Store finished batches as soon as possible, and wait for the oldest while enough are queued
+        while submitted and (batch is None or submitted[0][2].done() or client.saturated(tokens, inputs)):
+            batch_done, size, future = submitted.popleft()
+            tokens -= size
+            inputs -= len(batch_done[3])
+            try:
+                with metrics.Stage('index.embed', rows=len(batch_done[3])):
+                    embeddings = future.result()
+            except Exception as e:
+                yield batch_done, None, e
+                return
+            yield batch_done, embeddings, None
+        if batch is None:
+            return
 
 def index(arag_path, options):
     """
     Index the corpus by generating embeddings for each row in corpus.db and save metadata.
-    
+
+    Rows are streamed from corpus.db in batches of options['batch_size'], embedded with a single
+    model call per batch and committed after each batch. With the 'openai' method, batches are
+    submitted to an EmbeddingClient, which packs them into as few requests as the API allows and
+    sends several at once, and committed in order as their embeddings arrive. If a previous run
+    was interrupted, indexing resumes after the last committed batch, provided the method and
+    model are unchanged.
+
     Args:
         arag_path (str): Path to the .arag directory.
-        options (dict): Configuration options for embedding generation.
+        options (dict): Configuration options for embedding generation. Supports, in addition to
+            the loadEmbedder() options:
+            - 'batch_size' (int): Number of chunks embedded and committed together (default: 64).
+            - 'force' (bool): If True, remove existing embeddings and reindex from scratch.
+            - 'ann' (str, optional): Also build an 'ivf' or 'hnsw' ANN index, see ann.buildANN().
+            - 'quantize' (str, optional): Also write 'int8' or 'binary' quantized embeddings.
+            - 'quantize_only' (bool): Keep the float embeddings of the packaged arag in the
+              matrix file only, to rescore the candidates of the quantized codes.
+            - 'rescore_dtype' (str): 'float32' (default) or 'float16' matrix with 'quantize_only'.
+              corpus.db keeps the float32 embeddings, which rescore the candidates of the codes.
+            - 'no_reuse' (bool): Embed every chunk, instead of reusing stored vectors for chunks
+              whose text was already embedded with the same method and model.
+            - 'concurrency', 'rpm', 'tpm', 'max_retries', 'max_request_inputs': OpenAI request settings, see
+              embedclient.EmbeddingClient.
+
+    Chunks with identical text are embedded once: before a batch is sent to the embedding
+    provider, vectors are looked up by content hash in chunks and in embedding_cache, for the
+    same method, model and (OpenAI) endpoint.
     """
     corpus_db_path = os.path.join(arag_path, 'corpus.db')
     if not os.path.exists(corpus_db_path):
         print("Corpus database does not exist. Run 'arag corpify' first.")
         return
 
+    method = options.get('method', 'local')
+    model_name = resolveModelName(options)
+    endpoint = embeddingEndpoint(options)
+    batch_size = options.get('batch_size')
+    if batch_size is None:
+        batch_size = globals.DEFAULT_INDEX_BATCH_SIZE
+    if batch_size <= 0:
+        print("Error: the batch size must be positive")
+        return
+    upgradeCorpus(arag_path)
+
     conn = sqlite3.connect(corpus_db_path)
     cursor = conn.cursor()
 
     # Check if 'embedding' column exists; add it if not
     cursor.execute("PRAGMA table_info(chunks)")
     columns = [col[1] for col in cursor.fetchall()]
+    reuse = not options.get('no_reuse', False)
+    ensureEmbeddingCache(cursor)
+    createIndexes(cursor)
     if 'embedding' not in columns:
-        cursor.execute("ALTER TABLE chunks ADD COLUMN embedding TEXT")
+        cursor.execute("ALTER TABLE chunks ADD COLUMN embedding BLOB")
+        conn.commit()
+    elif options.get('force', False):
+        print("Removing existing embeddings due to --force flag.")
+        if reuse:
+            stashEmbeddings(cursor, readIndexMetadata(arag_path))
+        cursor.execute("UPDATE chunks SET embedding = NULL")
+        conn.commit()
     else:
         cursor.execute("SELECT COUNT(*) FROM chunks WHERE embedding IS NOT NULL AND embedding != ''")
         embedding_count = cursor.fetchone()[0]
-        if embedding_count > 0 and not options.get('force', False):
-            print("Embeddings already exist in corpus.db. Use --force to reindex.")
+        cursor.execute("SELECT COUNT(*) FROM chunks WHERE embedding IS NULL OR embedding = ''")
+        pending_count = cursor.fetchone()[0]
+        if embedding_count > 0 and pending_count == 0:
+            previous = readIndexMetadata(arag_path)
+            stale = (previous is not None and 'matrix' not in previous
+                     and previous.get('embedding_dtype') == globals.EMBEDDING_DTYPE)
+            if (options.get('ann') or options.get('quantize') or stale) and previous is not None:
+                # Only (re)build the matrix, ANN index and quantized codes over the existing
+                # embeddings, e.g. after an incremental corpify removed files
+                previous.pop('indexing', None)
+                previous['total_embeddings'] = embedding_count
+                buildIndexArtifacts(arag_path, cursor, previous, options)
+                saveIndexMetadata(arag_path, previous)
+                print(f"Rebuilt index files for existing embeddings in arag {arag_path}")
+            else:
+                print("Embeddings already exist in corpus.db. Use --force to reindex.")
             conn.close()
             return
-        elif options.get('force', False):
-            print("Removing existing embeddings due to --force flag.")
-            cursor.execute("UPDATE chunks SET embedding = NULL")
+        elif embedding_count > 0:
+            # A previous run was interrupted, or chunks were added since the last one; only
+            # complete the index with the same embedding settings
+            previous = readIndexMetadata(arag_path)
+            if (previous is None or previous.get('method') != method or previous.get('model') != model_name
+                    or embeddingEndpoint(previous) != endpoint):
+                print("corpus.db holds embeddings built with a different method, model or endpoint. Use --force to reindex.")
+                conn.close()
+                return
+            if previous.get('embedding_dtype') != globals.EMBEDDING_DTYPE:
+                print("corpus.db holds embeddings stored as JSON. Run with --migrate first, or use --force to reindex.")
+                conn.close()
+                return
+            if previous.get('indexing'):
+                print(f"Resuming indexing: {embedding_count} embeddings already committed, {pending_count} remaining.")
+            else:
+                print(f"Embedding {pending_count} new chunks, {embedding_count} already embedded.")
 
-    # Retrieve rows needing embeddings
-    cursor.execute("SELECT id, content FROM chunks WHERE embedding IS NULL OR embedding = ''")
-    rows = cursor.fetchall()
+    try:
+        if method == 'openai':
+            # Concurrent, rate limited requests packed across batches; asyncio is slow to import
+            from .embedclient import EmbeddingClient
+            client = EmbeddingClient(model_name, options)
+            embed = None
+        else:
+            client = None
+            embed = loadEmbedder(options)
+    except Exception as e:
+        print(f"Error loading embedding {method} model {model_name}: {e}")
+        conn.close()
+        return
 
-    # Process each row, canceling on first error
-    for row in rows:
-        id, content = row
-        try:
-            embedding = generateEmbedding(content, options)
-            embedding_json = json.dumps(embedding)
-            cursor.execute("UPDATE chunks SET embedding = ? WHERE id = ?", (embedding_json, id))
-            print(f"Generated embedding {id} / {len(rows)}")
-        except Exception as e:
-            print(f"Error generating embedding for id {id}: {e}")
-            conn.rollback()
-            conn.close()
-            print("Indexing operation cancelled due to error.")
-            return
+    # Record the settings up front so an interrupted run can be resumed, marked as in progress
+    # until every chunk is embedded
+    removeIndexArtifacts(arag_path)
+    metadata = collectIndexMetadata(cursor, options)
+    metadata['indexing'] = True
+    saveIndexMetadata(arag_path, metadata)
+
+    cursor.execute("SELECT COUNT(*) FROM chunks")
+    total_rows = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM chunks WHERE embedding IS NOT NULL AND embedding != ''")
+    done = cursor.fetchone()[0]
+
+    def batches():
+        # Stream rows needing embeddings in id order, one batch at a time
+        last_id = -1
+        while True:
+            with metrics.Stage('index.read') as stage:
+                cursor.execute("SELECT id, content, content_hash FROM chunks WHERE (embedding IS NULL OR embedding = '') AND id > ? "
+                               "ORDER BY id LIMIT ?", (last_id, batch_size))
+                rows = cursor.fetchall()
+                stage.add(rows=len(rows))
+            if not rows:
+                return
+            ids = [row[0] for row in rows]
+            hashes = [content_hash or contentHash(content) for _, content, content_hash in rows]
+            if reuse:
+                # Embed each distinct text without a stored vector once
+                with metrics.Stage('index.lookup', rows=len(rows)) as stage:
+                    vectors = lookupEmbeddings(cursor, method, model_name, endpoint, list(set(hashes)))
+                    pending = {}
+                    for (_, content, _), content_hash in zip(rows, hashes):
+                        if content_hash not in vectors:
+                            pending.setdefault(content_hash, content)
+                    stage.add(cache_hits=len(rows) - len(pending))
+            else:
+                vectors = {}
+                pending = {id: content for id, content, _ in rows}
+            last_id = ids[-1]
+            yield ids, hashes, vectors, pending
+
+    embedded = reused = 0
+    stopped = False
+    try:
+        with BulkLoad(conn, "Stored embeddings") as load:
+            for (ids, hashes, vectors, pending), embeddings, error in embedBatches(batches(), embed, client):
+                if error is not None:
+                    print(f"Error generating embeddings for ids {ids[0]}-{ids[-1]}: {error}")
+                    stopped = True
+                    break
+                vectors.update((key, encodeEmbedding(embedding)) for key, embedding in zip(pending, embeddings))
+                with metrics.Stage('index.write', rows=len(ids)):
+                    cursor.executemany("UPDATE chunks SET embedding = ?, content_hash = ? WHERE id = ?",
+                                       [(vectors[content_hash if reuse else id], content_hash, id) for id, content_hash in zip(ids, hashes)])
+                    conn.commit()
+                done += len(ids)
+                load.add(len(ids))
+                embedded += len(pending)
+                reused += len(ids) - len(pending)
+                print(f"Generated embeddings {done} / {total_rows}")
+    finally:
+        if client is not None:
+            client.close()
+    if stopped:
+        conn.close()
+        print(f"Indexing operation stopped with {done} / {total_rows} embeddings committed. Re-run to resume.")
+        return
+    if reused:
+        print(f"Embedded {embedded} chunks, reused embeddings of identical text for {reused} chunks")
 
-    # Commit changes if all embeddings succeed
+    # Every chunk is embedded: the cached vectors left are stored in chunks again, or belong to
+    # text no longer in the corpus or to other embedding settings, and would only grow corpus.db
+    cursor.execute("DELETE FROM embedding_cache")
+    if cursor.rowcount > 0:
+        print(f"Dropped {cursor.rowcount} cached embeddings no longer used by the corpus")
     conn.commit()
 
-    # Save metadata
-    cursor.execute("SELECT COUNT(*) FROM chunks WHERE embedding IS NOT NULL AND embedding != ''")
-    total_embeddings = cursor.fetchone()[0]
-    cursor.execute("SELECT embedding FROM chunks WHERE embedding IS NOT NULL AND embedding != '' LIMIT 1")
-    sample_embedding = cursor.fetchone()
-    vector_size = len(json.loads(sample_embedding[0])) if sample_embedding else 0
-    method = options.get('method', 'local')
-    model_name = options.get('model')
-    if not model_name:
-        model_name = globals.DEFAULT_LOCAL_EMBEDDING_MODEL if method == 'local' else globals.DEFAULT_OPENAI_EMBEDDING_MODEL
-    metadata = {
-        'method': method,
-        'model': model_name,
-        'vector_size': vector_size,
-        'total_embeddings': total_embeddings,
-        'version': globals.VERSION,
-    }
-    if method == 'openai':
-        metadata['endpoint'] = options.get('endpoint', 'https://api.openai.com/v1')  # Save endpoint in metadata
-    index_json_path = os.path.join(arag_path, globals.INDEX_JSON)
-    with open(index_json_path, 'w') as f:
-        json.dump(metadata, f, indent=4)
+    # Write the embedding matrix and save metadata
+    metadata = collectIndexMetadata(cursor, options)
+    with metrics.Stage('index.artifacts', rows=metadata['total_embeddings']):
+        buildIndexArtifacts(arag_path, cursor, metadata, options)
+    saveIndexMetadata(arag_path, metadata)
+
+    conn.close()
+    print(f"Indexed {metadata['total_embeddings']} embeddings in arag {arag_path}")
+
+def migrate(arag_path, options=None):
+    """
+    Convert JSON text embeddings in corpus.db to packed float32 BLOBs without re-embedding.
+
+    Args:
+        arag_path (str): Path to the .arag directory.
+        options (dict, optional): Supports 'batch_size' (int), the number of rows converted per commit.
+    """
+    if options is None:
+        options = {}
+    corpus_db_path = os.path.join(arag_path, 'corpus.db')
+    if not os.path.exists(corpus_db_path):
+        print("Corpus database does not exist. Run 'arag corpify' first.")
+        return
+    metadata = readIndexMetadata(arag_path)
+    if metadata is None:
+        print(f"Index file {globals.INDEX_JSON} not found in arag {arag_path}, nothing to migrate.")
+        return
+    batch_size = options.get('batch_size')
+    if batch_size is None:
+        batch_size = globals.DEFAULT_INDEX_BATCH_SIZE
+    if batch_size <= 0:
+        print("Error: the batch size must be positive")
+        return
+    upgradeCorpus(arag_path)
+
+    conn = sqlite3.connect(corpus_db_path)
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(chunks)")
+    columns = [col[1] for col in cursor.fetchall()]
+    if 'embedding' not in columns:
+        print("No embeddings found in corpus.db, nothing to migrate.")
+        conn.close()
+        return
+
+    converted = 0
+    last_id = -1
+    with BulkLoad(conn, "Converted embeddings") as load:
+        while True:
+            cursor.execute("SELECT id, embedding FROM chunks WHERE typeof(embedding) = 'text' AND embedding != '' AND id > ? "
+                           "ORDER BY id LIMIT ?", (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            cursor.executemany("UPDATE chunks SET embedding = ? WHERE id = ?",
+                               [(encodeEmbedding(json.loads(embedding)), id) for id, embedding in rows])
+            conn.commit()
+            converted += len(rows)
+            load.add(len(rows))
+            last_id = rows[-1][0]
 
+    metadata['embedding_dtype'] = globals.EMBEDDING_DTYPE
+    buildIndexArtifacts(arag_path, cursor, metadata)
+    saveIndexMetadata(arag_path, metadata)
     conn.close()
-    print(f"Indexed {total_embeddings} embeddings in arag {arag_path}")
+    print(f"Migrated {converted} embeddings to {globals.EMBEDDING_DTYPE} BLOBs in arag {arag_path}")
 
 def isIndexUpdated(arag_path):
     """
@@ -153,4 +656,4 @@ def isIndexUpdated(arag_path):
         return False
     corpus_mtime = os.path.getmtime(corpus_db_path)
     index_mtime = os.path.getmtime(index_json_path)
-    return corpus_mtime <= index_mtime
\ No newline at end of file
+    return corpus_mtime <= index_mtime
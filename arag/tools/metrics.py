@@ -0,0 +1,171 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows
+
+# Off unless a command runs with --metrics-json or --profile; instrumented code checks this
+# flag before taking any timings, so disabled metrics cost one attribute lookup.
+enabled = False
+
+COUNTERS = ('rows', 'bytes', 'api_calls', 'cache_hits')
+
+_lock = threading.Lock()
+_stages = {}
+_END = object()
+
+def enable():
+    """Start collecting metrics, discarding those collected so far."""
+    global enabled
+    with _lock:
+        _stages.clear()
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def record(name, wall=0.0, cpu=0.0, calls=1, **counts):
+    """
+    Add one call of a stage to its totals.
+
+    Args:
+        name (str): Stage name, '<command>.<step>' such as 'corpify.extract'.
+        wall (float), cpu (float): Seconds spent in the call.
+        counts: Any of COUNTERS.
+    """
+    if not enabled:
+        return
+    with _lock:
+        totals = _stages.get(name)
+        if totals is None:
+            totals = _stages[name] = dict({'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0}, **{counter: 0 for counter in COUNTERS})
+        totals['calls'] += calls
+        totals['wall_s'] += wall
+        totals['cpu_s'] += cpu
+        for counter, value in counts.items():
+            totals[counter] += value
+
+def count(name, **counts):
+    """Add to the counters of a stage without counting a call, e.g. cache hits inside it."""
+    record(name, calls=0, **counts)
+
+class Stage:
+    """
+    Context manager timing a block as one call of a stage. Counts known only inside the block
+    are added with add(). CPU time is the process's, so it includes other threads running at
+    the same time.
+
+        with metrics.Stage('index.embed', rows=len(texts)) as stage:
+            ...
+            stage.add(api_calls=1)
+    """
+    __slots__ = ('name', 'counts', 'wall', 'cpu')
+
+    def __init__(self, name, **counts):
+        self.name = name
+        self.counts = counts
+        self.wall = None
+
+    def add(self, **counts):
+        for counter, value in counts.items():
+            self.counts[counter] = self.counts.get(counter, 0) + value
+
+    def __enter__(self):
+        if enabled:
+            self.cpu = time.process_time()
+            self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.wall is not None:
+            record(self.name, time.perf_counter() - self.wall, time.process_time() - self.cpu, **self.counts)
+        return False
+
+def timedIter(name, iterable, counter=None):
+    """
+    Yield from iterable, timing each item's production as one call of a stage. Used around
+    generators whose work happens between items, such as corpus.extractAll().
+
+    Args:
+        counter (callable, optional): Maps an item to a dict of counts for the stage.
+    """
+    iterator = iter(iterable)
+    while True:
+        if not enabled:
+            item = next(iterator, _END)
+        else:
+            cpu = time.process_time()
+            wall = time.perf_counter()
+            item = next(iterator, _END)
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            if item is _END:
+                # Waiting for the end of the iteration is not a call
+                record(name, wall, cpu, calls=0)
+            else:
+                record(name, wall, cpu, **(counter(item) if counter is not None else {}))
+        if item is _END:
+            return
+        yield item
+
+def peakRSS():
+    """Peak resident set size of this process in bytes, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Kilobytes on Linux
+
+def report():
+    """
+    Return the collected metrics: per-stage totals, in the order stages were first seen, with
+    wall and CPU times rounded to microseconds.
+    """
+    with _lock:
+        return {name: dict(totals, wall_s=round(totals['wall_s'], 6), cpu_s=round(totals['cpu_s'], 6))
+                for name, totals in _stages.items()}
+
+def run(label, func, *args, metrics_path=None, profile_path=None, **kwargs):
+    """
+    Call func(*args, **kwargs), collecting metrics into metrics_path as JSON and a cProfile dump
+    into profile_path (for pstats or snakeviz) when given.
+
+    Returns:
+        The return value of func.
+    """
+    if not metrics_path and not profile_path:
+        return func(*args, **kwargs)
+    enable()
+    profiler = cProfile.Profile() if profile_path else None
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    try:
+        if profiler is not None:
+            return profiler.runcall(func, *args, **kwargs)
+        return func(*args, **kwargs)
+    finally:
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        disable()
+        if profiler is not None:
+            profiler.dump_stats(profile_path)
+            print(f"Wrote profile to {profile_path}", file=sys.stderr)
+        if metrics_path:
+            output = {
+                'command': label,
+                'wall_s': round(wall, 6),
+                'cpu_s': round(cpu, 6),
+                'peak_rss_bytes': peakRSS(),
+                'stages': report(),
+            }
+            if metrics_path == '-':
+                print(json.dumps(output, indent=4), file=sys.stderr)
+            else:
+                with open(metrics_path + '.tmp', 'w') as f:
+                    json.dump(output, f, indent=4)
+                os.replace(metrics_path + '.tmp', metrics_path)
@@ -0,0 +1,143 @@
+import os
+
+import numpy as np
+
+import globals
+from .embeddings import mapArrayFromArag
+from .ann import topkIndices
+
+# Rows converted or scanned at a time, to bound memory on large memory-mapped matrices
+BLOCK_SIZE = 65536
+
+if hasattr(np, 'bitwise_count'):
+    _popcount = np.bitwise_count
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values):
+        return _POPCOUNT_TABLE[values]
+
+def quantizeInt8(matrix):
+    """
+    Scalar-quantize an embedding matrix to int8 codes with a per-dimension scale and offset,
+    so that embedding ~= offset + scale * (code + 128).
+
+    Returns:
+        tuple: (codes, scale, offset).
+    """
+    low = np.full(matrix.shape[1], np.inf, dtype=np.float32)
+    high = np.full(matrix.shape[1], -np.inf, dtype=np.float32)
+    for start in range(0, len(matrix), BLOCK_SIZE):
+        block = matrix[start:start + BLOCK_SIZE]
+        low = np.minimum(low, block.min(axis=0))
+        high = np.maximum(high, block.max(axis=0))
+    scale = (high - low) / 255
+    scale[scale == 0] = 1
+    codes = np.empty(matrix.shape, dtype=np.int8)
+    for start in range(0, len(matrix), BLOCK_SIZE):
+        block = matrix[start:start + BLOCK_SIZE]
+        codes[start:start + BLOCK_SIZE] = np.clip(np.rint((block - low) / scale) - 128, -128, 127)
+    return codes, scale, low
+
+def quantizeBinary(matrix):
+    """
+    Quantize an embedding matrix to one sign bit per dimension, packed 8 dimensions per byte.
+    """
+    codes = np.empty((len(matrix), (matrix.shape[1] + 7) // 8), dtype=np.uint8)
+    for start in range(0, len(matrix), BLOCK_SIZE):
+        codes[start:start + BLOCK_SIZE] = np.packbits(matrix[start:start + BLOCK_SIZE] > 0, axis=1)
+    return codes
+
+class Int8Codes:
+    """int8 codes scored against the query with a single matrix-vector product per block."""
+    def __init__(self, codes, scale, offset):
+        self.codes = codes
+        self.scale = scale
+        self.offset = offset
+
+    def candidates(self, query_embedding, count):
+        """Return the row positions of the count best approximate matches."""
+        # offset and the +128 shift add the same amount to every row, so only codes @ (q * scale) ranks
+        weights = query_embedding * self.scale
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), BLOCK_SIZE):
+            scores[start:start + BLOCK_SIZE] = self.codes[start:start + BLOCK_SIZE].astype(np.float32) @ weights
+        return topkIndices(scores, count)
+
+class BinaryCodes:
+    """Sign-bit codes ranked by Hamming distance to the binarized query."""
+    def __init__(self, codes):
+        self.codes = codes
+
+    def candidates(self, query_embedding, count):
+        """Return the row positions of the count best approximate matches."""
+        query_bits = np.packbits(query_embedding > 0)
+        distances = np.empty(len(self.codes), dtype=np.int32)
+        for start in range(0, len(self.codes), BLOCK_SIZE):
+            block = self.codes[start:start + BLOCK_SIZE]
+            distances[start:start + BLOCK_SIZE] = _popcount(np.bitwise_xor(block, query_bits)).sum(axis=1, dtype=np.int32)
+        return topkIndices(-distances, count)
+
+def writeQuantized(arag_path, matrix, kind):
+    """
+    Quantize the embedding matrix and write the codes into the .arag directory.
+
+    Args:
+        arag_path (str): Path to the .arag directory.
+        matrix (np.ndarray): The (rows, vector_size) embedding matrix.
+        kind (str): 'int8' or 'binary'.
+
+    Returns:
+        dict: The 'quantization' entry for index.json.
+
+    Raises:
+        ValueError: If the quantization kind is unsupported.
+    """
+    if kind == 'int8':
+        codes, scale, offset = quantizeInt8(matrix)
+        codes.tofile(os.path.join(arag_path, globals.EMBEDDINGS_INT8))
+        return {
+            'type': 'int8',
+            'file': globals.EMBEDDINGS_INT8,
+            'scale': scale.tolist(),
+            'offset': offset.tolist(),
+        }
+    elif kind == 'binary':
+        codes = quantizeBinary(matrix)
+        codes.tofile(os.path.join(arag_path, globals.EMBEDDINGS_BINARY))
+        return {
+            'type': 'binary',
+            'file': globals.EMBEDDINGS_BINARY,
+            'bytes_per_row': codes.shape[1],
+        }
+    raise ValueError(f"Unsupported quantization: {kind}. Use 'int8' or 'binary'.")
+
+def loadQuantized(arag_path, metadata):
+    """
+    Load the quantized codes described by index.json, or return None if there are none.
+    """
+    quantization = metadata.get('quantization')
+    if not quantization:
+        return None
+    rows = metadata['matrix']['rows']
+    if quantization['type'] == 'int8':
+        codes = mapArrayFromArag(arag_path, quantization['file'], np.int8, (rows, metadata['vector_size']))
+        if codes is None:
+            return None
+        return Int8Codes(codes, np.asarray(quantization['scale'], dtype=np.float32),
+                         np.asarray(quantization['offset'], dtype=np.float32))
+    elif quantization['type'] == 'binary':
+        codes = mapArrayFromArag(arag_path, quantization['file'], np.uint8, (rows, quantization['bytes_per_row']))
+        if codes is None:
+            return None
+        return BinaryCodes(codes)
+    return None
+
+def removeQuantized(arag_path):
+    """
+    Remove any quantized code files from the .arag directory.
+    """
+    for filename in (globals.EMBEDDINGS_INT8, globals.EMBEDDINGS_BINARY):
+        file_path = os.path.join(arag_path, filename)
+        if os.path.exists(file_path):
+            os.remove(file_path)
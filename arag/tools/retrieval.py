@@ -1,84 +1,424 @@
 import apsw
 import os
+import sys
 import json
+import threading
 import numpy as np
-from .index import generateEmbedding
+
+import globals
+from .index import loadEmbedder
 from .helpers import get_file_from_arag, is_packaged
+from .embeddings import decodeEmbeddings, loadEmbeddingMatrix
+from .ann import loadANN, exactSearch, exactSearchBatch, topkIndices
+from .quantize import loadQuantized
+from .cache import QueryEmbeddingCache
 from .vfs import zip_vfs  # Import the registered ZipVFS instance
+from .db import schemaVersion
+from .fts import hasFTS, searchFTS, fuseRankings
+from . import metrics
+
+# Ways query() ranks chunks: by embedding similarity, by BM25 over the full-text index, or both fused
+QUERY_MODES = ('dense', 'bm25', 'hybrid')
 
-def query(arag_path, query_string, topk=1, api_key=None, get_file=False, endpoint=None):
+def loadIndexMetadata(arag_path):
     """
-    Query the corpus database with a string, returning the top-k results.
-    Accesses corpus.db directly from the archive if packaged.
+    Load index.json from an .arag directory or packaged file, or return None if it is missing.
     """
-    # Load metadata
     metadata_str = get_file_from_arag(arag_path, 'index.json')
     if metadata_str is None:
-        print(f"Index file index.json not found in arag {arag_path}")
-        return
-    metadata = json.loads(metadata_str)
+        return None
+    return json.loads(metadata_str)
+
+def openCorpus(arag_path, options=None):
+    """
+    Open a read-only apsw connection to corpus.db through the ZipVFS.
+    Accesses corpus.db directly from the archive if packaged.
+
+    Args:
+        arag_path (str): Path to the .arag directory or packaged file.
+        options (dict, optional): Supports:
+            - 'page_cache_size' (int): Bytes of the packaged archive's shared page cache.
+            - 'readahead' (int): Bytes read ahead on sequential page reads from the archive.
+    """
+    if options is None:
+        options = {}
+    arag_path_abs = os.path.abspath(arag_path)
+    if is_packaged(arag_path_abs):
+        # URI for packaged .arag, accessing corpus.db inside the archive
+        uri = f"file:corpus.db?archive={arag_path_abs}&vfs=zipvfs"
+        if options.get('page_cache_size'):
+            uri += f"&page_cache={options['page_cache_size']}"
+        if options.get('readahead') is not None:
+            uri += f"&readahead={options['readahead']}"
+    else:
+        # URI for directory .arag, accessing corpus.db as a regular file
+        db_path = os.path.join(arag_path_abs, 'corpus.db')
+        uri = f"file:{db_path}?vfs=zipvfs"
+    return apsw.Connection(
+        uri,
+        flags=apsw.SQLITE_OPEN_READONLY | apsw.SQLITE_OPEN_URI
+    )
+
+def scanEmbeddings(conn, metadata):
+    """
+    Decode every embedding stored in corpus.db.
+
+    Returns:
+        tuple: (ids, matrix), or None if the corpus has no embeddings.
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, embedding FROM chunks WHERE embedding IS NOT NULL AND embedding != ''")
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    # Legacy JSON embeddings (no 'embedding_dtype' in index.json) are decoded row by row
+    with metrics.Stage('query.decode', rows=len(rows)):
+        matrix = decodeEmbeddings([row[1] for row in rows], metadata['vector_size'])
+    return ids, matrix
+
+def fetchEmbeddings(conn, ids, vector_size):
+    """
+    Fetch and decode the stored embeddings of the given chunk ids, in the order given.
+    """
+    ids = [int(id) for id in ids]
+    placeholders = ','.join('?' * len(ids))
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT id, embedding FROM chunks WHERE id IN ({placeholders})", ids)
+    by_id = dict(cursor.fetchall())
+    return decodeEmbeddings([by_id[id] for id in ids], vector_size)
+
+def loadEmbeddings(arag_path, metadata, conn, options=None):
+    """
+    Load the embeddings of an arag for searching.
+
+    Memory-maps the contiguous matrix file and quantized codes written by 'arag index' when
+    present, otherwise decodes the embeddings from corpus.db.
+
+    Returns:
+        tuple: (ids, matrix, codes), or None if the corpus has no embeddings. matrix is None when
+        only quantized codes are available, codes is None when the index is not quantized.
+    """
+    if options is None:
+        options = {}
+    mapped = loadEmbeddingMatrix(arag_path, metadata)
+    codes = loadQuantized(arag_path, metadata) if mapped is not None else None
+    if mapped is None or (mapped[1] is None and (codes is None or options.get('exact', False))):
+        scanned = scanEmbeddings(conn, metadata)
+        return None if scanned is None else (scanned[0], scanned[1], None)
+    return mapped[0], mapped[1], codes
+
+def searchEmbeddings(ids, matrix, ann_index, query_embedding, topk, options=None, codes=None, fetch_vectors=None):
+    """
+    Find the topk chunks most similar to the query embedding.
+
+    Uses the ANN index when one is loaded, otherwise scans the quantized codes for
+    topk * options['rescore'] candidates and rescores them exactly, otherwise scans the full
+    matrix. options['exact'] forces a full scan.
+
+    Args:
+        fetch_vectors (callable, optional): Returns the float32 embeddings for a list of chunk
+            ids, used to rescore quantized candidates when matrix is None.
+
+    Returns:
+        tuple: (chunk ids, scores), best first.
+    """
+    if options is None:
+        options = {}
+    query_embedding = np.asarray(query_embedding, dtype=np.float32)
+    exact = options.get('exact', False)
+    if ann_index is not None and matrix is not None and not exact:
+        positions, scores = ann_index.search(matrix, query_embedding, topk,
+                                             nprobe=options.get('nprobe'), ef=options.get('ef'))
+    elif codes is not None and (not exact or matrix is None):
+        count = topk * (options.get('rescore') or globals.DEFAULT_RESCORE_FACTOR)
+        candidates = np.sort(codes.candidates(query_embedding, count))
+        if matrix is not None:
+            vectors = np.asarray(matrix[candidates], dtype=np.float32)
+        else:
+            vectors = fetch_vectors([ids[i] for i in candidates])
+        candidate_scores = vectors @ query_embedding
+        best = topkIndices(candidate_scores, topk)
+        positions, scores = candidates[best], candidate_scores[best]
+    else:
+        positions, scores = exactSearch(matrix, query_embedding, topk)
+    return [int(ids[i]) for i in positions], scores
+
+def fetchChunks(conn, ids):
+    """
+    Fetch (file_path, content) for the given chunk ids.
+
+    Returns:
+        dict: Maps chunk id to a (file_path, content) tuple; ids missing from the corpus are left out.
+    """
+    ids = [int(id) for id in ids]
+    if not ids:
+        return {}
+    placeholders = ','.join('?' * len(ids))
+    cursor = conn.cursor()
+    if schemaVersion(conn) >= 2:
+        cursor.execute(f"SELECT chunks.id, files.path, chunks.content FROM chunks JOIN files ON files.id = chunks.file_id "
+                       f"WHERE chunks.id IN ({placeholders})", ids)
+    else:
+        # Packaged arags are read-only and may predate the normalized schema
+        cursor.execute(f"SELECT id, file_path, content FROM chunks WHERE id IN ({placeholders})", ids)
+    return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+def embeddingOptions(metadata, api_key=None, endpoint=None):
+    """
+    Build the loadEmbedder() options that reproduce the arag's index-time embeddings.
+
+    Raises:
+        ValueError: If the arag was indexed with OpenAI and no API key is available.
+    """
     method = metadata['method']
     model = metadata['model']
     metadata_endpoint = metadata.get('endpoint') if method == 'openai' else None  # Get endpoint from metadata
     effective_endpoint = endpoint or metadata_endpoint  # Prefer command-line endpoint, else metadata
-    options = {'method': method, 'model': model}
+    embed_options = {'method': method, 'model': model}
     if method == 'openai':
-        options['endpoint'] = effective_endpoint
+        embed_options['endpoint'] = effective_endpoint
         effective_api_key = api_key or os.getenv('OPENAI_API_KEY')
         if not effective_api_key:
-            print("OpenAI API key is required for 'openai' method. Provide --api-key or set OPENAI_API_KEY environment variable.")
+            raise ValueError("OpenAI API key is required for 'openai' method. Provide --api-key or set OPENAI_API_KEY environment variable.")
+        embed_options['api_key'] = effective_api_key
+    return embed_options
+
+class Retriever:
+    """
+    Everything needed to answer queries against one arag, loaded once: index metadata, the
+    read-only corpus connection, the embedding matrix, quantized codes, the ANN index and,
+    on first use, the embedding model or client.
+
+    With options['mode'] set to 'bm25' the arag does not need to be indexed: queries are
+    answered from the full-text index built by 'corpify --fts' alone, and neither embeddings,
+    quantized codes nor the ANN index are loaded, so only 'bm25' queries can be answered.
+    """
+    def __init__(self, arag_path, api_key=None, endpoint=None, options=None):
+        """
+        A Retriever may be shared between threads: embedding and corpus.db access are serialized
+        internally, scoring runs concurrently.
+
+        Args:
+            arag_path (str): Path to the .arag directory or packaged file.
+            api_key (str, optional): OpenAI API key, for arags indexed with OpenAI.
+            endpoint (str, optional): OpenAI API endpoint, overriding the one in index.json.
+            options (dict, optional): Search options, see query().
+
+        Raises:
+            FileNotFoundError: If the arag has no index.json and the query mode needs embeddings.
+            ValueError: If an OpenAI API key is needed but missing, the corpus has no embeddings
+                or the query mode needs a full-text index the corpus does not have.
+        """
+        self.arag_path = arag_path
+        self.options = options or {}
+        self._embed_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        mode = self.options.get('mode') or 'dense'
+        if mode not in QUERY_MODES:
+            raise ValueError(f"Unsupported query mode: {mode}. Use 'dense', 'bm25' or 'hybrid'.")
+        self.metadata = loadIndexMetadata(arag_path)
+        if self.metadata is None and mode != 'bm25':
+            raise FileNotFoundError(f"Index file index.json not found in arag {arag_path}")
+        self.embed_options = embeddingOptions(self.metadata, api_key, endpoint) if mode != 'bm25' else None
+        self.embedder = None
+        self.cache = None
+        if mode != 'bm25' and not self.options.get('no_cache', False):
+            try:
+                self.cache = QueryEmbeddingCache(max_bytes=self.options.get('cache_size') or globals.DEFAULT_QUERY_CACHE_SIZE)
+            except Exception as e:
+                print(f"Warning: query embedding cache disabled: {e}", file=sys.stderr)
+        self.conn = openCorpus(arag_path, self.options)
+        self.has_fts = hasFTS(self.conn)
+        if mode != 'dense' and not self.has_fts:
+            self.conn.close()
+            raise ValueError(f"The corpus has no full-text index for '{mode}' queries. "
+                             f"Run 'arag content corpify --incremental --fts' first.")
+        if mode == 'bm25':
+            # Lexical search only, without any embedding work
+            self.metadata = self.metadata or {}
+            self.ids, self.matrix, self.codes = np.empty(0, dtype=np.int64), None, None
+            self.ann_index = None
             return
-        options['api_key'] = effective_api_key
+        with metrics.Stage('query.load'):
+            loaded = loadEmbeddings(arag_path, self.metadata, self.conn, self.options)
+        if loaded is None:
+            self.close()
+            raise ValueError("No embeddings found in the corpus.")
+        self.ids, self.matrix, self.codes = loaded
+        self.ann_index = loadANN(arag_path, self.metadata) if self.matrix is not None and 'matrix' in self.metadata else None
+
+    def embed(self, texts):
+        """
+        Embed query texts with the arag's embedding method, loading the model or client once.
+        Texts found in the query embedding cache are not sent to the embedding provider.
+        """
+        texts = list(texts)
+        if self.embed_options is None:
+            raise ValueError("The arag was opened for 'bm25' queries, only those are supported.")
+        with self._embed_lock, metrics.Stage('query.embed', rows=len(texts)) as stage:
+            found = self._cacheGet(texts)
+            missing = list(dict.fromkeys(text for text in texts if text not in found))
+            stage.add(cache_hits=len(found))
+            if missing:
+                if self.embedder is None:
+                    with metrics.Stage('query.load_embedder'):
+                        self.embedder = loadEmbedder(self.embed_options)
+                embeddings = self.embedder(missing)
+                found.update(zip(missing, np.asarray(embeddings, dtype=np.float32)))
+                self._cachePut(missing, embeddings)
+        return np.array([found[text] for text in texts], dtype=np.float32)
+
+    def _cacheGet(self, texts):
+        if self.cache is None:
+            return {}
+        try:
+            return self.cache.get(self.embed_options, texts)
+        except Exception as e:
+            print(f"Warning: query embedding cache lookup failed: {e}", file=sys.stderr)
+            return {}
+
+    def _cachePut(self, texts, embeddings):
+        if self.cache is None:
+            return
+        try:
+            self.cache.put(self.embed_options, texts, embeddings)
+        except Exception as e:
+            print(f"Warning: query embedding cache update failed: {e}", file=sys.stderr)
+
+    def search(self, query_embeddings, topk, options=None):
+        """
+        Find the topk chunks for each query embedding.
+
+        Returns:
+            list: One (chunk ids, scores) tuple per query, best first.
+        """
+        options = self.options if options is None else options
+        exact_scan = options.get('exact', False) or (self.ann_index is None and self.codes is None)
+        with metrics.Stage('query.score', rows=len(query_embeddings)):
+            if exact_scan and self.matrix is not None:
+                return [([int(self.ids[i]) for i in positions], scores)
+                        for positions, scores in exactSearchBatch(self.matrix, query_embeddings, topk)]
+            return [searchEmbeddings(self.ids, self.matrix, self.ann_index, query_embedding, topk, options,
+                                     codes=self.codes, fetch_vectors=self.fetchVectors)
+                    for query_embedding in query_embeddings]
+
+    def lexical(self, text, topk):
+        """
+        Find the topk chunks for a query text by BM25, see searchFTS().
+        """
+        if not self.has_fts:
+            raise ValueError("The corpus has no full-text index. Run 'arag content corpify --incremental --fts' first.")
+        with self._db_lock, metrics.Stage('query.bm25', rows=1):
+            return searchFTS(self.conn, text, topk)
+
+    def match(self, texts, topk, options=None, query_embeddings=None):
+        """
+        Find the topk chunks for each query text with the query mode in options: 'dense'
+        (embedding similarity), 'bm25' (full-text) or 'hybrid' (both, fused by reciprocal rank
+        fusion over the globals.DEFAULT_HYBRID_DEPTH best of each).
+
+        Args:
+            query_embeddings (np.ndarray, optional): Embeddings of texts, if already computed.
+
+        Returns:
+            list: One (chunk ids, scores) tuple per query, best first. Scores are cosine
+            similarities, negated BM25 ranks or fused reciprocal ranks depending on the mode.
+        """
+        options = self.options if options is None else options
+        mode = options.get('mode') or 'dense'
+        if mode not in QUERY_MODES:
+            raise ValueError(f"Unsupported query mode: {mode}. Use 'dense', 'bm25' or 'hybrid'.")
+        if mode == 'bm25':
+            return [self.lexical(text, topk) for text in texts]
+        if query_embeddings is None:
+            query_embeddings = self.embed(texts)
+        if mode == 'dense':
+            return self.search(query_embeddings, topk, options)
+        depth = max(topk, globals.DEFAULT_HYBRID_DEPTH)
+        dense = self.search(query_embeddings, depth, options)
+        return [fuseRankings([ids, self.lexical(text, depth)[0]], topk)
+                for (ids, _), text in zip(dense, texts)]
+
+    def fetch(self, ids):
+        """Fetch (file_path, content) for chunk ids, see fetchChunks()."""
+        with self._db_lock, metrics.Stage('query.fetch', rows=len(ids)):
+            return fetchChunks(self.conn, ids)
+
+    def fetchVectors(self, ids):
+        """Fetch the stored float32 embeddings of chunk ids, see fetchEmbeddings()."""
+        with self._db_lock:
+            return fetchEmbeddings(self.conn, ids, self.metadata['vector_size'])
 
-    # Generate query embedding
+    def answer(self, texts, topk, get_file=False, options=None):
+        """
+        Embed, search and fetch results for a list of query texts.
+
+        Returns:
+            list: One list of result dicts ('id', 'file_path', 'score' and, unless get_file,
+            'content') per query text, best first.
+        """
+        matches = self.match(texts, topk, options)
+        results_dict = self.fetch({id for ids, _ in matches for id in ids})
+        answers = []
+        for ids, scores in matches:
+            results = []
+            for id, score in zip(ids, scores):
+                if id not in results_dict:
+                    continue
+                file_path, content = results_dict[id]
+                result = {'id': id, 'file_path': file_path, 'score': float(score)}
+                if not get_file:
+                    result['content'] = content
+                results.append(result)
+            answers.append(results)
+        return answers
+
+    def close(self):
+        self.conn.close()
+        if self.cache is not None:
+            self.cache.close()
+
+def query(arag_path, query_string, topk=1, api_key=None, get_file=False, endpoint=None, options=None):
+    """
+    Query the corpus database with a string, returning the top-k results.
+    Accesses corpus.db directly from the archive if packaged.
+
+    Args:
+        options (dict, optional): Search options. Supports:
+            - 'exact' (bool): Scan every embedding even if the arag has an ANN index.
+            - 'nprobe' (int): IVF lists scanned per query (default: from index.json).
+            - 'ef' (int): HNSW candidate list size (default: from index.json).
+            - 'rescore' (int): Candidates rescored per result when searching quantized embeddings.
+            - 'mode' (str): 'dense' (default), 'bm25' or 'hybrid', see Retriever.match().
+            - 'no_cache' (bool): Do not read or write the query embedding cache.
+            - 'cache_size' (int): Maximum size in bytes of the query embedding cache.
+            - 'page_cache_size' (int), 'readahead' (int): Page cache settings for packaged arags, see openCorpus().
+    """
     try:
-        query_embedding = generateEmbedding(query_string, options)
+        retriever = Retriever(arag_path, api_key=api_key, endpoint=endpoint, options=options)
+    except (FileNotFoundError, ValueError) as e:
+        print(e)
+        return
     except Exception as e:
-        print(f"Error generating query embedding: {e}")
+        print(f"Error querying the corpus: {e}")
         return
 
-    # Determine the connection URI
-    arag_path_abs = os.path.abspath(arag_path)
-    if is_packaged(arag_path_abs):
-        # URI for packaged .arag, accessing corpus.db inside the archive
-        uri = f"file:corpus.db?archive={arag_path_abs}&vfs=zipvfs"
-    else:
-        # URI for directory .arag, accessing corpus.db as a regular file
-        db_path = os.path.join(arag_path_abs, 'corpus.db')
-        uri = f"file:{db_path}?vfs=zipvfs"
-
-    # Connect to the database and query
-    try:
-        conn = apsw.Connection(
-            uri,
-            flags=apsw.SQLITE_OPEN_READONLY | apsw.SQLITE_OPEN_URI
-        )
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, embedding FROM chunks WHERE embedding IS NOT NULL AND embedding != ''")
-        rows = cursor.fetchall()
-        if not rows:
-            print("No embeddings found in the corpus.")
-            conn.close()
+    # Generate query embedding, unless searching the full-text index only
+    query_embeddings = None
+    if retriever.options.get('mode') != 'bm25':
+        try:
+            query_embeddings = retriever.embed([query_string])
+        except Exception as e:
+            print(f"Error generating query embedding: {e}")
+            retriever.close()
             return
 
-        # Process embeddings and compute similarities
-        ids = []
-        embeddings = []
-        for row in rows:
-            ids.append(row[0])
-            embedding = json.loads(row[1])
-            embeddings.append(embedding)
-        embeddings = np.array(embeddings)
-        query_embedding = np.array(query_embedding)
-        similarities = np.dot(embeddings, query_embedding)
-        topk_indices = np.argsort(similarities)[-topk:][::-1]
-        topk_ids = [ids[i] for i in topk_indices]
-
-        # Fetch top-k results
-        placeholders = ','.join('?' * len(topk_ids))
-        cursor.execute(f"SELECT id, file_path, content FROM chunks WHERE id IN ({placeholders})", topk_ids)
-        results = cursor.fetchall()
-        results_dict = {row[0]: (row[1], row[2]) for row in results}
+    try:
+        # Find the best matching chunks and fetch top-k results
+        topk_ids, _ = retriever.match([query_string], topk, query_embeddings=query_embeddings)[0]
+        results_dict = retriever.fetch(topk_ids)
+        topk_ids = [id for id in topk_ids if id in results_dict]
 
         # Display results
         if get_file:
@@ -91,7 +431,97 @@ def query(arag_path, query_string, topk=1, api_key=None, get_file=False, endpoin
                 print(f"File: {file_path}")
                 print(f"Content: {content}")
                 print("---")
+    except Exception as e:
+        print(f"Error querying the corpus: {e}")
+    finally:
+        retriever.close()
+
+def readBatchQueries(stream):
+    """
+    Yield queries from a batch file: either one query per line or JSONL objects with a 'query'
+    key (and optionally 'topk' and an 'id' that is echoed back). Blank lines are skipped.
 
-        conn.close()
+    Returns:
+        generator: (line number, query dict, error) tuples; error is a message for a malformed
+        line, reported in its place in the output, and None otherwise.
+    """
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith('{'):
+            yield number, {'query': line}, None
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            yield number, {}, f"Invalid JSON: {e}"
+            continue
+        topk = item.get('topk')
+        if not isinstance(item.get('query'), str):
+            yield number, item, "'query' must be a string"
+        elif topk is not None and (isinstance(topk, bool) or not isinstance(topk, int) or topk <= 0):
+            yield number, item, "'topk' must be a positive integer"
+        else:
+            yield number, item, None
+
+def queryBatch(arag_path, batch_path, topk=1, api_key=None, get_file=False, endpoint=None, options=None, output=None):
+    """
+    Answer many queries in one invocation, writing one JSON result line per query.
+
+    The arag is opened and its embeddings are loaded once; queries are embedded in batches of
+    globals.DEFAULT_QUERY_BATCH_SIZE and scored together. A malformed line gets a
+    {"line": number, "error": message} line (with its "id", if any) instead of results, so the
+    output still has one line per query.
+
+    Args:
+        batch_path (str): File of queries, see readBatchQueries(), or '-' for stdin.
+        output (file, optional): Where to write JSONL results (default: stdout).
+        Other arguments are as for query().
+    """
+    output = output or sys.stdout
+    # Open the queries first, so a bad path is reported before the arag is loaded
+    try:
+        stream = sys.stdin if batch_path == '-' else open(batch_path, 'r', encoding='utf-8')
+    except OSError as e:
+        print(f"Error reading batch file {batch_path}: {e.strerror}", file=sys.stderr)
+        return
+    retriever = None
+    try:
+        retriever = Retriever(arag_path, api_key=api_key, endpoint=endpoint, options=options)
+    except (FileNotFoundError, ValueError) as e:
+        print(e, file=sys.stderr)
+    except Exception as e:
+        print(f"Error querying the corpus: {e}", file=sys.stderr)
+    if retriever is None:
+        if stream is not sys.stdin:
+            stream.close()
+        return
+
+    try:
+        queries = readBatchQueries(stream)
+        while True:
+            batch = [item for _, item in zip(range(globals.DEFAULT_QUERY_BATCH_SIZE), queries)]
+            if not batch:
+                break
+            valid = [item for _, item, error in batch if error is None]
+            answers = []
+            if valid:
+                batch_topk = max(item.get('topk') or topk for item in valid)
+                answers = retriever.answer([item['query'] for item in valid], batch_topk, get_file=get_file)
+            answers = iter(answers)
+            for number, item, error in batch:
+                if error is None:
+                    line = {'query': item['query'], 'results': next(answers)[:item.get('topk') or topk]}
+                else:
+                    line = {'line': number, 'error': error}
+                if 'id' in item:
+                    line['id'] = item['id']
+                output.write(json.dumps(line) + '\n')
+            output.flush()
     except Exception as e:
-        print(f"Error querying the corpus: {e}")
\ No newline at end of file
+        print(f"Error querying the corpus: {e}", file=sys.stderr)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        retriever.close()
@@ -0,0 +1,262 @@
+import json
+import os
+import signal
+import socketserver
+import stat
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .retrieval import Retriever, QUERY_MODES
+from .vfs import page_cache_stats
+from . import metrics
+
+# Per-request search options accepted in POST /query bodies
+SEARCH_OPTIONS = ('exact', 'nprobe', 'ef', 'rescore', 'mode')
+# Those of them, and topk, that must be positive integers
+INTEGER_OPTIONS = ('topk', 'nprobe', 'ef', 'rescore')
+
+def aragName(arag_path):
+    """
+    Return the name an arag is served under: its file or directory name without the
+    '.arag' / '-arag' suffix.
+    """
+    name = os.path.basename(os.path.normpath(arag_path))
+    for suffix in ('.arag', '-arag'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+class QueryService:
+    """The arags being served, each kept open with a resident Retriever, and request counters."""
+    def __init__(self, retrievers):
+        self.retrievers = retrievers
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.counters = {name: {'requests': 0, 'queries': 0, 'errors': 0, 'seconds': 0.0} for name in retrievers}
+
+    def query(self, request):
+        """
+        Answer a POST /query body: {"arag": name, "query": text} or {"queries": [text, ...]}, plus
+        optional "topk", "get_file" and search options. "arag" may be omitted when serving one arag.
+
+        Returns:
+            tuple: (HTTP status, response dict).
+        """
+        name = request.get('arag')
+        if name is None and len(self.retrievers) == 1:
+            name = next(iter(self.retrievers))
+        if name not in self.retrievers:
+            return 404, {'error': f"Unknown arag: {name}", 'arags': list(self.retrievers)}
+        if 'queries' in request:
+            texts = request['queries']
+        elif 'query' in request:
+            texts = [request['query']]
+        else:
+            return 400, {'error': "Request needs a 'query' or 'queries' field"}
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return 400, {'error': "'query' must be a string and 'queries' a list of strings"}
+        for key in INTEGER_OPTIONS:
+            value = request.get(key)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value <= 0):
+                return 400, {'error': f"'{key}' must be a positive integer"}
+
+        retriever = self.retrievers[name]
+        options = dict(retriever.options)
+        options.update({key: request[key] for key in SEARCH_OPTIONS if key in request})
+        mode = options.get('mode') or 'dense'
+        if mode not in QUERY_MODES:
+            return 400, {'error': f"Unsupported query mode: {mode}", 'modes': list(QUERY_MODES)}
+        if mode != 'bm25' and retriever.embed_options is None:
+            return 400, {'error': f"Arag '{name}' is served for 'bm25' queries only"}
+        if mode != 'dense' and not retriever.has_fts:
+            return 400, {'error': f"Arag '{name}' has no full-text index for '{mode}' queries"}
+        started = time.perf_counter()
+        try:
+            with metrics.Stage('serve.request', rows=len(texts)):
+                answers = retriever.answer(texts, request.get('topk') or 1,
+                                           get_file=bool(request.get('get_file', False)), options=options)
+        except Exception as e:
+            self._count(name, len(texts), time.perf_counter() - started, error=True)
+            return 500, {'error': f"Error querying the corpus: {e}"}
+        self._count(name, len(texts), time.perf_counter() - started)
+        if 'queries' in request:
+            return 200, {'arag': name, 'results': answers}
+        return 200, {'arag': name, 'results': answers[0]}
+
+    def _count(self, name, queries, seconds, error=False):
+        with self.lock:
+            counters = self.counters[name]
+            counters['requests'] += 1
+            counters['queries'] += queries
+            counters['seconds'] += seconds
+            if error:
+                counters['errors'] += 1
+
+    def stats(self):
+        """Return the GET /stats response."""
+        arags = {}
+        with self.lock:
+            for name, retriever in self.retrievers.items():
+                counters = dict(self.counters[name])
+                seconds = counters.pop('seconds')
+                arags[name] = {
+                    'path': retriever.arag_path,
+                    'method': retriever.metadata.get('method'),
+                    'model': retriever.metadata.get('model'),
+                    'embeddings': len(retriever.ids),
+                    'fts': retriever.has_fts,
+                    'ann': (retriever.metadata.get('ann') or {}).get('type'),
+                    'quantization': (retriever.metadata.get('quantization') or {}).get('type'),
+                    **counters,
+                    'mean_latency_ms': 1000 * seconds / counters['requests'] if counters['requests'] else 0.0,
+                    'page_cache': page_cache_stats(retriever.arag_path),
+                }
+        stats = {'uptime_seconds': time.time() - self.started, 'arags': arags}
+        if metrics.enabled:
+            # Started with --metrics-json, the per-stage totals so far
+            stats['metrics'] = metrics.report()
+        return stats
+
+    def close(self):
+        for retriever in self.retrievers.values():
+            retriever.close()
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """JSON over HTTP: GET /health, GET /stats, GET /arags and POST /query."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/health':
+            self._reply(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            self._reply(200, service.stats())
+        elif self.path == '/arags':
+            self._reply(200, {'arags': list(service.retrievers)})
+        else:
+            self._reply(404, {'error': f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/query':
+            self._reply(404, {'error': f"Unknown path: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            self._reply(400, {'error': f"Invalid JSON body: {e}"})
+            return
+        if not isinstance(request, dict):
+            self._reply(400, {'error': "Request body must be a JSON object"})
+            return
+        status, response = self.server.service.query(request)
+        self._reply(status, response)
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        """HTTP server on a Unix domain socket, one thread per connection."""
+        daemon_threads = True
+else:
+    ThreadingUnixHTTPServer = None
+
+def isSocket(path):
+    """Whether path is a Unix socket, not following symlinks."""
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+def serve(arag_paths, options=None):
+    """
+    Open one or more arags once and answer queries over localhost HTTP or a Unix socket until
+    interrupted (Ctrl+C) or terminated (SIGTERM).
+
+    Args:
+        arag_paths (list): Paths to .arag directories or packaged files.
+        options (dict, optional): Configuration options. Supports:
+            - 'host' (str): Address to listen on (default: 127.0.0.1).
+            - 'port' (int): TCP port to listen on (default: 8765).
+            - 'socket' (str): Listen on this Unix socket path instead of TCP.
+            - 'api_key' (str), 'endpoint' (str): OpenAI settings, as for query().
+            - 'verbose' (bool): Log every request to stderr.
+            - Search options as for query(), used as per-arag defaults.
+    """
+    if options is None:
+        options = {}
+    socket_path = options.get('socket')
+    # Only a stale socket from an earlier run is replaced, never another file
+    if socket_path and os.path.lexists(socket_path) and not isSocket(socket_path):
+        print(f"Error: {socket_path} already exists and is not a socket")
+        return
+    retrievers = {}
+    for arag_path in arag_paths:
+        name = aragName(arag_path)
+        try:
+            if name in retrievers:
+                raise ValueError(f"another arag is already served as '{name}'")
+            retrievers[name] = Retriever(arag_path, api_key=options.get('api_key'),
+                                         endpoint=options.get('endpoint'), options=options)
+        except Exception as e:
+            print(f"Error opening arag {arag_path}: {e}")
+            for retriever in retrievers.values():
+                retriever.close()
+            return
+        print(f"Loaded arag {arag_path} as '{name}' ({len(retrievers[name].ids)} embeddings)")
+
+    service = QueryService(retrievers)
+    if socket_path:
+        if ThreadingUnixHTTPServer is None:
+            print("Error: Unix sockets are not supported on this platform, use --port instead")
+            service.close()
+            return
+        if isSocket(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, QueryRequestHandler)
+        address = socket_path
+    else:
+        host = options.get('host') or '127.0.0.1'
+        port = options.get('port') or 8765
+        server = ThreadingHTTPServer((host, port), QueryRequestHandler)
+        server.daemon_threads = True
+        address = f"http://{host}:{server.server_address[1]}"
+    server.service = service
+    server.verbose = options.get('verbose', False)
+    print(f"Serving {len(retrievers)} arag(s) on {address}, press Ctrl+C to stop")
+    sys.stdout.flush()
+    previous_handler = None
+    if threading.current_thread() is threading.main_thread():
+        # SIGTERM stops the server like Ctrl+C; shutdown() waits for serve_forever() to return,
+        # so it cannot be called from the handler, which interrupts it
+        def stop(signum, frame):
+            print("\nStopping server")
+            threading.Thread(target=server.shutdown, daemon=True).start()
+        previous_handler = signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping server")
+    finally:
+        if previous_handler is not None:
+            signal.signal(signal.SIGTERM, previous_handler)
+        server.server_close()
+        service.close()
+        if socket_path and isSocket(socket_path):
+            os.remove(socket_path)
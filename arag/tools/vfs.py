@@ -1,5 +1,107 @@
 import apsw
-import zipfile
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+import globals
+from .helpers import get_member_offset
+from . import metrics
+
+# archive path -> ((size, mtime), offset, size) of its corpus.db member, so each archive's
+# zip directory is only parsed once per process
+_member_offsets = {}
+_archive_lock = threading.Lock()
+
+def corpus_member_offset(archive):
+    """
+    Return (offset, size) of the stored corpus.db member inside a packaged .arag, reusing the
+    cached offset until the archive changes on disk.
+    """
+    stat = os.stat(archive)
+    key = (stat.st_size, stat.st_mtime_ns)
+    with _archive_lock:
+        cached = _member_offsets.get(archive)
+    if cached is not None and cached[0] == key:
+        return cached[1], cached[2]
+    location = get_member_offset(archive, 'corpus.db')
+    if location is None:
+        raise IOError("corpus.db is missing or compressed in archive")
+    with _archive_lock:
+        _member_offsets[archive] = (key, location[0], location[1])
+    return location
+
+class PageCache:
+    """
+    Bounded LRU cache of pages read from one archive, shared by every connection to it.
+    Pages are keyed by (offset, amount) within the member, as SQLite requests them.
+    """
+    def __init__(self, max_bytes=globals.DEFAULT_PAGE_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.pages = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.readahead_pages = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            page = self.pages.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self.pages.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def put(self, key, page):
+        with self.lock:
+            if key in self.pages:
+                return
+            self.pages[key] = page
+            self.size += len(page)
+            while self.size > self.max_bytes and self.pages:
+                _, evicted = self.pages.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self):
+        """Return hit/miss counters and the current cache size."""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'readahead_pages': self.readahead_pages,
+                'pages': len(self.pages),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+            }
+
+# archive path -> ((size, mtime), PageCache)
+_page_caches = {}
+
+def page_cache(archive, max_bytes=None):
+    """
+    Return the page cache shared by connections to an archive, starting a new one when the
+    archive changes on disk. max_bytes, if given, resizes the cache.
+    """
+    stat = os.stat(archive)
+    key = (stat.st_size, stat.st_mtime_ns)
+    with _archive_lock:
+        cached = _page_caches.get(archive)
+        if cached is None or cached[0] != key:
+            cached = (key, PageCache())
+            _page_caches[archive] = cached
+        cache = cached[1]
+    if max_bytes is not None:
+        cache.max_bytes = max_bytes
+    return cache
+
+def page_cache_stats(archive):
+    """Return the page cache counters for an archive, or None if it has not been opened."""
+    with _archive_lock:
+        cached = _page_caches.get(os.path.abspath(archive))
+    return cached[1].stats() if cached is not None else None
 
 class ZipVFS(apsw.VFS):
     """Custom VFS to access files inside a zip archive."""
@@ -15,40 +117,69 @@ class ZipVFS(apsw.VFS):
         if isinstance(name, apsw.URIFilename):
             archive = name.uri_parameter("archive")
             if archive:
-                # Open the zip archive
-                zipf = zipfile.ZipFile(archive, 'r')
-                try:
-                    info = zipf.getinfo('corpus.db')
-                except KeyError:
-                    raise IOError("corpus.db not found in archive")
-                # Ensure the file is uncompressed
-                if info.compress_type != zipfile.ZIP_STORED:
-                    raise IOError("corpus.db is compressed")
-                # Get a file object for random access
-                fileobj = zipf.open('corpus.db')
+                # package stores corpus.db uncompressed, so pages are read straight from the archive
+                offset, size = corpus_member_offset(archive)
+                cache_size = name.uri_parameter("page_cache")
+                readahead = name.uri_parameter("readahead")
+                cache = page_cache(archive, int(cache_size) if cache_size else None)
                 # Set output flags to read-only
                 flags[1] = apsw.SQLITE_OPEN_READONLY
-                return ZipVFSFile(fileobj, info.file_size)
+                return ZipVFSFile(archive, offset, size, cache,
+                                  int(readahead) if readahead else globals.DEFAULT_READAHEAD_SIZE)
         # Fallback to default VFS behavior for regular files
         return super().xOpen(name, flags)
 
 class ZipVFSFile(apsw.VFSFile):
-    """Custom VFSFile to provide read-only access to a file in the archive."""
-    def __init__(self, fileobj, filesize):
-        self.fileobj = fileobj  # ZipExtFile object
+    """
+    Custom VFSFile to provide read-only access to a stored member of the archive, through the
+    archive's shared page cache. When SQLite reads pages in order (a full table scan), the
+    following readahead bytes are read in one go and cached as pages too.
+    """
+    def __init__(self, archive, offset, filesize, cache, readahead=globals.DEFAULT_READAHEAD_SIZE):
+        with open(archive, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offset = offset  # Start of the member's data in the archive
         self.filesize = filesize
+        self.cache = cache
+        self.readahead = readahead
+        self.next_offset = None  # Where the previous read ended, to detect sequential reads
 
     def xClose(self):
-        """Close the file object."""
-        self.fileobj.close()
+        """Unmap the archive."""
+        self.map.close()
 
     def xRead(self, amount, offset):
         """Read 'amount' bytes starting at 'offset'."""
-        self.fileobj.seek(offset)
-        data = self.fileobj.read(amount)
-        if len(data) < amount:
+        if not metrics.enabled:
+            return self.readPage(amount, offset)
+        with metrics.Stage('vfs.read', rows=1, bytes=amount):
+            return self.readPage(amount, offset)
+
+    def readPage(self, amount, offset):
+        if offset + amount > self.filesize:
             raise apsw.IOError("Short read from file")
-        return data
+        sequential = offset == self.next_offset
+        self.next_offset = offset + amount
+        page = self.cache.get((offset, amount))
+        if page is not None:
+            if metrics.enabled:
+                metrics.count('vfs.read', cache_hits=1)
+            return page
+        start = self.offset + offset
+        # Never read ahead more than a quarter of the cache, or the window evicts itself
+        readahead = min(self.readahead, self.cache.max_bytes // 4)
+        if not sequential or readahead <= amount:
+            page = self.map[start:start + amount]
+            self.cache.put((offset, amount), page)
+            return page
+        # Sequential miss: read ahead and cache the following pages as well
+        count = min(readahead, self.filesize - offset) // amount
+        window = self.map[start:start + count * amount]
+        for i in range(count):
+            self.cache.put((offset + i * amount, amount), window[i * amount:(i + 1) * amount])
+        with self.cache.lock:
+            self.cache.readahead_pages += count - 1
+        return window[:amount]
 
     def xFileSize(self):
         """Return the size of the file."""
@@ -81,4 +212,4 @@ class ZipVFSFile(apsw.VFSFile):
         return 0
 
 # Register the custom VFS globally
-zip_vfs = ZipVFS("zipvfs")
\ No newline at end of file
+zip_vfs = ZipVFS("zipvfs")
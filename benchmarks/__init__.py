@@ -0,0 +1,7 @@
+"""
+Benchmarks for the arag CLI, run from the repository root:
+
+    python -m benchmarks.run [--files 500] [--layout mixed] [--out results.json]
+    python benchmarks/startup.py
+    python -m benchmarks.openai_mock check
+"""
@@ -0,0 +1,151 @@
+"""
+Deterministic synthetic corpora: the same seed and options always produce the same files.
+"""
+import os
+import random
+
+LAYOUTS = ('text', 'pdf', 'nested', 'mixed')
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'da', 'fi', 'go', 'ha', 'ju', 'pe', 'qua', 'ri', 'so', 'tu', 'wy']
+
+def make_vocabulary(rng, size=5000):
+    """Pseudo-words of two to four syllables, in a seeded random order that sets their frequency rank."""
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+class TextGenerator:
+    """Paragraphs of sentences drawn from a Zipf-distributed vocabulary."""
+    def __init__(self, seed, vocabulary_size=5000):
+        self.rng = random.Random(seed)
+        self.vocabulary = make_vocabulary(self.rng, vocabulary_size)
+        self.weights = [1.0 / rank for rank in range(1, len(self.vocabulary) + 1)]
+
+    def sentence(self):
+        words = self.rng.choices(self.vocabulary, self.weights, k=self.rng.randint(6, 20))
+        return ' '.join(words).capitalize() + '.'
+
+    def paragraph(self):
+        return ' '.join(self.sentence() for _ in range(self.rng.randint(3, 8)))
+
+    def text(self, size):
+        """Roughly size bytes of text, in paragraphs separated by blank lines."""
+        paragraphs = []
+        length = 0
+        while length < size:
+            paragraphs.append(self.paragraph())
+            length += len(paragraphs[-1]) + 2
+        return '\n\n'.join(paragraphs) + '\n'
+
+    def query(self):
+        """A short query made of mid-frequency words, so it matches some chunks but not all."""
+        return ' '.join(self.rng.choices(self.vocabulary[50:1000], k=self.rng.randint(2, 5)))
+
+def pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def make_pdf(lines, lines_per_page=60):
+    """
+    Build a minimal valid PDF showing the given lines of text in Helvetica, which pypdf can
+    extract. The binary comment after the header makes the file non-UTF-8, as real PDFs are,
+    so corpify converts it instead of reading it as text.
+    """
+    pages = [lines[start:start + lines_per_page] for start in range(0, max(len(lines), 1), lines_per_page)]
+    font_id = 3
+    objects = {
+        1: b'<< /Type /Catalog /Pages 2 0 R >>',
+        font_id: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    }
+    kids = []
+    for number, page in enumerate(pages):
+        page_id = 4 + 2 * number
+        contents_id = page_id + 1
+        kids.append(f'{page_id} 0 R')
+        operators = ['BT', '/F1 10 Tf', '12 TL', '40 760 Td']
+        operators += [f'({pdf_escape(line)}) Tj T*' for line in page]
+        operators.append('ET')
+        stream = '\n'.join(operators).encode('latin-1')
+        objects[page_id] = (f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {contents_id} 0 R '
+                            f'/Resources << /Font << /F1 {font_id} 0 R >> >> >>').encode()
+        objects[contents_id] = b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream'
+    objects[2] = f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(kids)} >>'.encode()
+
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(out)
+        out += b'%d 0 obj\n' % object_id + objects[object_id] + b'\nendobj\n'
+    xref = len(out)
+    count = max(objects) + 1
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % count
+    for object_id in range(1, count):
+        out += b'%010d 00000 n \n' % offsets[object_id]
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (count, xref)
+    return bytes(out)
+
+def wrap(text, width=90):
+    lines = []
+    for paragraph in text.split('\n\n'):
+        line = ''
+        for word in paragraph.split():
+            if line and len(line) + 1 + len(word) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f'{line} {word}' if line else word
+        lines.append(line)
+        lines.append('')
+    return lines
+
+def nested_dir(rng, depth=3, fanout=4):
+    parts = [f'section_{rng.randrange(fanout)}' for _ in range(rng.randint(1, depth))]
+    return os.path.join(*parts)
+
+def generate_corpus(path, files=200, file_size=16 * 1024, layout='mixed', seed=0):
+    """
+    Write a synthetic corpus under path.
+
+    Args:
+        files (int): Number of files.
+        file_size (int): Average text size of a file in bytes; sizes vary from half to twice that.
+        layout (str): 'text' for flat .txt/.md files, 'pdf' for PDF files, 'nested' for text files
+            in a directory tree, 'mixed' for all three.
+        seed (int): Seed of the generator.
+
+    Returns:
+        dict: Number of files and bytes written per kind, and the total.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unsupported layout: {layout}. Use one of {', '.join(LAYOUTS)}.")
+    generator = TextGenerator(seed)
+    rng = random.Random(seed + 1)
+    stats = {'files': 0, 'bytes': 0, 'text_files': 0, 'pdf_files': 0}
+    for number in range(files):
+        text = generator.text(int(file_size * rng.uniform(0.5, 2.0)))
+        kind = layout
+        if layout == 'mixed':
+            kind = rng.choice(['text', 'text', 'pdf', 'nested'])
+        directory = nested_dir(rng) if kind == 'nested' else ''
+        if kind == 'pdf':
+            name = f'doc_{number:06d}.pdf'
+            data = make_pdf(wrap(text))
+            stats['pdf_files'] += 1
+        else:
+            name = f'doc_{number:06d}.{rng.choice(["txt", "md"])}'
+            data = text.encode('utf-8')
+            stats['text_files'] += 1
+        os.makedirs(os.path.join(path, directory), exist_ok=True)
+        with open(os.path.join(path, directory, name), 'wb') as f:
+            f.write(data)
+        stats['files'] += 1
+        stats['bytes'] += len(data)
+    return stats
+
+def generate_queries(count, seed=0):
+    """Query strings over the vocabulary generate_corpus() uses with the same seed."""
+    generator = TextGenerator(seed)
+    generator.rng.seed(seed + 2)
+    return [generator.query() for _ in range(count)]
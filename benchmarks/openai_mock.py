@@ -0,0 +1,301 @@
+"""
+Mock OpenAI embeddings endpoint, and a check of 'arag index --method openai' against it.
+
+The mock answers POST .../embeddings with deterministic vectors derived from each input's text,
+after a fixed latency, and answers every Nth request with 429 (with Retry-After) or 503 instead.
+It records what it received, so the check can verify that the client packs chunks into
+multi-input requests, keeps several in flight, retries after the delay asked for and stays
+under its requests and tokens per minute limits. Run from the repository root; the openai
+package must be installed:
+
+    python -m benchmarks.openai_mock check [--concurrency 4] [--files 40]
+    python -m benchmarks.openai_mock serve [--port 8089] [--latency-ms 100]
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ARAG_DIR = os.path.join(REPO_DIR, 'arag')
+ARAG_SCRIPT = os.path.join(ARAG_DIR, 'arag.py')
+
+# Limits of the real API, enforced by the mock
+MAX_REQUEST_INPUTS = 2048
+
+def mock_embedding(text, dimensions):
+    """Unit vector seeded by the SHA-256 of text, the same in the mock and in the check."""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype('<f4')
+    return vector / np.linalg.norm(vector)
+
+def estimate_tokens(text):
+    # Same estimate as the client's, so the usage reported matches what it rate limits
+    return len(text.encode('utf-8')) // 3 + 1
+
+class MockState:
+    """Settings of the mock and a log of the requests it received."""
+    def __init__(self, dimensions=16, latency=0.1, rate_limit_every=0, error_every=0, retry_after=0.5):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.error_every = error_every
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.received = 0
+            self.requests = []  # (arrival time, number of inputs, estimated tokens, status)
+            self.in_flight = 0
+            self.max_in_flight = 0
+            self.rejected = {}  # inputs digest -> time a 429 was sent for them
+            self.retry_gaps = []  # seconds between a 429 and the retry of the same inputs
+
+class MockHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        state = self.state
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        texts = request.get('input')
+        if isinstance(texts, str):
+            texts = [texts]
+        tokens = sum(estimate_tokens(text) for text in texts)
+        digest = hashlib.sha256(json.dumps(texts).encode('utf-8')).hexdigest()
+        now = time.perf_counter()
+        with state.lock:
+            state.received += 1
+            number = state.received
+            if digest in state.rejected:
+                state.retry_gaps.append(now - state.rejected.pop(digest))
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+        try:
+            time.sleep(state.latency)
+            if not self.path.endswith('/embeddings'):
+                status, body, headers = 404, {'error': {'message': f"Unknown path {self.path}"}}, None
+            elif len(texts) > MAX_REQUEST_INPUTS:
+                status, body, headers = 400, {'error': {'message': f"Too many inputs: {len(texts)}"}}, None
+            elif state.rate_limit_every and number % state.rate_limit_every == 0:
+                status, body = 429, {'error': {'message': "Rate limit reached", 'type': 'requests'}}
+                headers = {'Retry-After': str(state.retry_after)}
+                with state.lock:
+                    state.rejected[digest] = time.perf_counter()
+            elif state.error_every and number % state.error_every == 0:
+                status, body, headers = 503, {'error': {'message': "Service unavailable"}}, None
+            else:
+                embeddings = [mock_embedding(text, state.dimensions) for text in texts]
+                if request.get('encoding_format') == 'base64':
+                    embeddings = [base64.b64encode(vector.tobytes()).decode('ascii') for vector in embeddings]
+                else:
+                    embeddings = [vector.tolist() for vector in embeddings]
+                status, headers = 200, None
+                body = {
+                    'object': 'list',
+                    'model': request.get('model'),
+                    'data': [{'object': 'embedding', 'index': i, 'embedding': e} for i, e in enumerate(embeddings)],
+                    'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+                }
+            with state.lock:
+                state.requests.append((now, len(texts), tokens, status))
+            self.send_json(status, body, headers)
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+
+def start_mock(state, port=0):
+    """Serve the mock in a background thread. Returns (server, endpoint URL)."""
+    handler = type('BoundMockHandler', (MockHandler,), {'state': state})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/v1'
+
+def run_arag(args, cwd):
+    result = subprocess.run([sys.executable, ARAG_SCRIPT] + args, cwd=cwd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"arag {' '.join(args)} failed:\n{result.stdout}{result.stderr}")
+    return result
+
+def check_index(args, state, endpoint, tmp):
+    """
+    Index a synthetic corpus through the mock and check the embeddings stored and the requests sent.
+
+    Returns:
+        dict: Measurements and the result of each check.
+    """
+    from .corpus import generate_corpus
+    source_path = os.path.join(tmp, 'source')
+    arag_path = os.path.join(tmp, 'mock-arag')
+    metrics_path = os.path.join(tmp, 'metrics.json')
+    generate_corpus(source_path, files=args.files, file_size=8 * 1024, layout='text', seed=0)
+    run_arag(['create', 'dir', 'mock', tmp], tmp)
+    run_arag(['content', 'add', source_path, '--arag', arag_path], tmp)
+    run_arag(['content', 'corpify', '--arag', arag_path, '--chunk-size', '1024', '-y'], tmp)
+
+    state.reset()
+    started = time.perf_counter()
+    run_arag(['index', '--arag', arag_path, '--method', 'openai', '--api-key', 'mock', '--endpoint', endpoint,
+              '--concurrency', str(args.concurrency), '--batch-size', str(args.batch_size), '--no-reuse',
+              '--max-request-inputs', str(args.request_inputs),
+              '--metrics-json', metrics_path], tmp)
+    wall = time.perf_counter() - started
+
+    conn = sqlite3.connect(os.path.join(arag_path, 'corpus.db'))
+    try:
+        rows = conn.execute("SELECT content, embedding FROM chunks").fetchall()
+    finally:
+        conn.close()
+    correct = all(embedding is not None and np.array_equal(np.frombuffer(embedding, dtype='<f4'), mock_embedding(content, state.dimensions))
+                  for content, embedding in rows)
+    with open(metrics_path, 'r') as f:
+        api_calls = json.load(f)['stages'].get('embed.openai', {}).get('api_calls', 0)
+
+    ok_requests = [request for request in state.requests if request[3] == 200]
+    statuses = [request[3] for request in state.requests]
+    batches = -(-len(rows) // args.batch_size)
+    return {
+        'chunks': len(rows),
+        'batches': batches,
+        'requests': len(state.requests),
+        'wall_s': round(wall, 3),
+        'max_inputs_per_request': max((request[1] for request in ok_requests), default=0),
+        'max_in_flight': state.max_in_flight,
+        'rate_limited': statuses.count(429),
+        'server_errors': statuses.count(503),
+        'min_retry_gap_s': round(min(state.retry_gaps), 3) if state.retry_gaps else None,
+        'checks': {
+            'embeddings match the mock': correct and len(rows) > 0,
+            'chunks packed into fewer requests than batches': len(ok_requests) < batches,
+            'requests in flight at once': 1 < state.max_in_flight <= args.concurrency,
+            '429 and 503 responses retried': statuses.count(429) > 0 and statuses.count(503) > 0,
+            'retries wait for Retry-After': bool(state.retry_gaps) and min(state.retry_gaps) >= state.retry_after * 0.9,
+            'every attempt counted in metrics': api_calls == len(state.requests),
+        },
+    }
+
+def check_rate_limits(state, endpoint):
+    """
+    Send requests of known size one after another through an EmbeddingClient limited to a few
+    requests or tokens a second, and check the rate the mock received them at.
+
+    Returns:
+        dict: Measurements and the result of each check.
+    """
+    sys.path.insert(0, ARAG_DIR)
+    from tools.embedclient import EmbeddingClient
+
+    results = {}
+    checks = {}
+    # 4 requests/s with single-input requests, then 4000 tokens/s with ~2000-token inputs
+    for label, options, texts in (('rpm', {'rpm': 240}, [f'text {number}' for number in range(12)]),
+                                  ('tpm', {'tpm': 240000}, [f'{number} ' + 'x' * 6000 for number in range(8)])):
+        state.reset()
+        client = EmbeddingClient('mock-model', dict(options, api_key='mock', endpoint=endpoint, concurrency=4))
+        try:
+            for text in texts:
+                client.submit([text]).result()
+        finally:
+            client.close()
+        times = [request[0] for request in state.requests]
+        per_second = next(iter(options.values())) / 60
+        units = len(times) if label == 'rpm' else sum(request[2] for request in state.requests)
+        elapsed = times[-1] - times[0]
+        # Everything up to the last request was paid for by then, less the second's worth the bucket starts with
+        ok = elapsed >= (units - max(1, per_second)) / per_second * 0.9
+        results[label] = {'requests': len(times), 'elapsed_s': round(elapsed, 3), 'limit_per_s': per_second}
+        checks[f'{label} limit respected'] = ok
+    results['checks'] = checks
+    return results
+
+def check(args):
+    try:
+        import openai  # noqa: F401, used by arag index and the client under test
+    except ImportError:
+        print("The check needs the openai library. Install it with 'pip install openai'", file=sys.stderr)
+        sys.exit(1)
+    state = MockState(latency=args.latency_ms / 1000, rate_limit_every=5, error_every=7, retry_after=0.5)
+    server, endpoint = start_mock(state)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = {'index': check_index(args, state, endpoint, tmp)}
+        state.latency = 0
+        state.rate_limit_every = state.error_every = 0
+        results['rate_limits'] = check_rate_limits(state, endpoint)
+    finally:
+        server.shutdown()
+
+    failed = [name for section in results.values() for name, ok in section['checks'].items() if not ok]
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        for section in results.values():
+            for name, ok in section['checks'].items():
+                print(f"{'ok' if ok else 'FAIL':4}  {name}")
+        index = results['index']
+        print(f"      {index['chunks']} chunks in {index['batches']} batches, {index['requests']} requests "
+              f"(up to {index['max_inputs_per_request']} inputs, {index['max_in_flight']} in flight) in {index['wall_s']} s")
+    sys.exit(1 if failed else 0)
+
+def serve(args):
+    state = MockState(dimensions=args.dimensions, latency=args.latency_ms / 1000, rate_limit_every=args.rate_limit_every,
+                      error_every=args.error_every, retry_after=args.retry_after)
+    server, endpoint = start_mock(state, args.port)
+    print(f"Mock embeddings endpoint at {endpoint}, pass it to 'arag index --method openai --endpoint'")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI embeddings endpoint for testing 'arag index --method openai'")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    check_parser = subparsers.add_parser('check', help="Index a synthetic corpus through the mock and check the requests")
+    check_parser.add_argument('--concurrency', type=int, default=4, help="--concurrency passed to arag index")
+    check_parser.add_argument('--batch-size', type=int, default=16, help="--batch-size passed to arag index")
+    check_parser.add_argument('--request-inputs', type=int, default=48, help="--max-request-inputs passed to arag index, small so the corpus takes many requests")
+    check_parser.add_argument('--files', type=int, default=40, help="Files in the synthetic corpus")
+    check_parser.add_argument('--latency-ms', type=float, default=200.0, help="Latency of each mock request")
+    check_parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    serve_parser = subparsers.add_parser('serve', help="Run the mock until interrupted")
+    serve_parser.add_argument('--port', type=int, default=8089, help="Port on 127.0.0.1")
+    serve_parser.add_argument('--dimensions', type=int, default=16, help="Size of the embeddings")
+    serve_parser.add_argument('--latency-ms', type=float, default=100.0, help="Latency of each request")
+    serve_parser.add_argument('--rate-limit-every', type=int, default=0, help="Answer every Nth request with 429")
+    serve_parser.add_argument('--error-every', type=int, default=0, help="Answer every Nth request with 503")
+    serve_parser.add_argument('--retry-after', type=float, default=1.0, help="Retry-After of 429 responses, in seconds")
+    args = parser.parse_args()
+    if args.command == 'check':
+        check(args)
+    else:
+        serve(args)
+
+if __name__ == '__main__':
+    main()
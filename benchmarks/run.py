@@ -0,0 +1,171 @@
+"""
+End-to-end benchmark of an arag's life cycle on a synthetic corpus: content add, corpify, index,
+package, query on the directory and on the packaged file, and unpackage. Each stage runs in its
+own process (see benchmarks.stage) and is reported with its wall and CPU time, peak RSS and
+throughput, together with the on-disk sizes of the results, as JSON so runs can be compared.
+
+    python -m benchmarks.run --files 500 --layout mixed --out results.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from .corpus import LAYOUTS, generate_corpus
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+def run_stage(stage, config, work_dir):
+    """Run a stage in a subprocess and return its measurements."""
+    config = dict(config, stage=stage)
+    config_path = os.path.join(work_dir, f'{stage}.config.json')
+    result_path = os.path.join(work_dir, f'{stage}.result.json')
+    with open(config_path, 'w') as f:
+        json.dump(config, f)
+    subprocess.run([sys.executable, '-m', 'benchmarks.stage', config_path, result_path], cwd=REPO_DIR, check=True)
+    with open(result_path, 'r') as f:
+        return json.load(f)
+
+def per_second(count, seconds):
+    return round(count / seconds, 1) if seconds > 0 else None
+
+def corpus_counts(arag_path):
+    conn = sqlite3.connect(os.path.join(arag_path, 'corpus.db'))
+    try:
+        files = conn.execute("SELECT COUNT(*) FROM files WHERE chunk_count > 0").fetchone()[0]
+        chunks, text_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(CAST(content AS BLOB))), 0) FROM chunks").fetchone()
+    finally:
+        conn.close()
+    return files, chunks, text_bytes
+
+def benchmark(args, work_dir):
+    source_path = os.path.join(work_dir, 'source')
+    arag_path = os.path.join(work_dir, 'bench-arag')
+    packaged_dir = os.path.join(work_dir, 'packaged')
+    packaged_path = os.path.join(packaged_dir, 'bench.arag')
+    os.makedirs(packaged_dir)
+
+    started = time.perf_counter()
+    corpus = generate_corpus(source_path, files=args.files, file_size=args.file_size, layout=args.layout, seed=args.seed)
+    corpus['generate_s'] = round(time.perf_counter() - started, 3)
+
+    config = {
+        'arag_path': arag_path,
+        'source_path': source_path,
+        'packaged_path': packaged_path,
+        'chunk_size': args.chunk_size,
+        'jobs': args.jobs,
+        'fts': args.fts,
+        'batch_size': args.batch_size,
+        'model': args.model,
+        'queries': args.queries,
+        'topk': args.topk,
+        'mode': args.mode,
+        'seed': args.seed,
+        'verbose': args.verbose,
+    }
+    stages = {}
+    stages['add'] = run_stage('add', config, work_dir)
+    stages['add']['throughput'] = {'files_per_s': per_second(corpus['files'], stages['add']['wall_s']),
+                                   'mb_per_s': per_second(corpus['bytes'] / 2**20, stages['add']['wall_s'])}
+
+    stages['corpify'] = run_stage('corpify', config, work_dir)
+    files, chunks, text_bytes = corpus_counts(arag_path)
+    stages['corpify'].update({'files': files, 'chunks': chunks, 'text_bytes': text_bytes})
+    stages['corpify']['throughput'] = {'files_per_s': per_second(files, stages['corpify']['wall_s']),
+                                       'chunks_per_s': per_second(chunks, stages['corpify']['wall_s']),
+                                       'mb_per_s': per_second(corpus['bytes'] / 2**20, stages['corpify']['wall_s'])}
+
+    if args.mode != 'bm25':
+        stages['index'] = run_stage('index', config, work_dir)
+        stages['index']['throughput'] = {'chunks_per_s': per_second(chunks, stages['index']['wall_s'])}
+
+    arag_size = dir_size(arag_path)
+    stages['package'] = run_stage('package', config, work_dir)
+    stages['package']['throughput'] = {'mb_per_s': per_second(arag_size / 2**20, stages['package']['wall_s'])}
+
+    for label, target in (('query_dir', arag_path), ('query_packaged', packaged_path)):
+        stages[label] = run_stage('query', dict(config, target=target), work_dir)
+        stages[label]['throughput'] = {'queries_per_s': per_second(stages[label]['queries'], stages[label]['query_s'])}
+
+    stages['unpackage'] = run_stage('unpackage', config, work_dir)
+    stages['unpackage']['throughput'] = {'mb_per_s': per_second(arag_size / 2**20, stages['unpackage']['wall_s'])}
+
+    sizes = {
+        'source': dir_size(source_path),
+        'content': dir_size(os.path.join(arag_path, 'content')),
+        'corpus_db': os.path.getsize(os.path.join(arag_path, 'corpus.db')),
+        'arag_dir': arag_size,
+        'packaged': os.path.getsize(packaged_path),
+        'unpackaged_dir': dir_size(os.path.join(packaged_dir, 'bench-arag')),
+    }
+    for name in ('embeddings.f32', 'index.json'):
+        if os.path.exists(os.path.join(arag_path, name)):
+            sizes[name] = os.path.getsize(os.path.join(arag_path, name))
+    return {'corpus': corpus, 'stages': stages, 'sizes': sizes}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark corpify, index, package, query and unpackage on a synthetic corpus")
+    parser.add_argument('--files', type=int, default=200, help="Number of files in the corpus")
+    parser.add_argument('--file-size', type=int, default=16 * 1024, help="Average size of a file's text in bytes")
+    parser.add_argument('--layout', choices=LAYOUTS, default='mixed', help="Corpus layout: flat text, PDF, nested directories or a mix")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the corpus and query generators")
+    parser.add_argument('--chunk-size', type=int, default=4096, help="Chunk size in bytes for corpify")
+    parser.add_argument('--jobs', type=int, default=1, help="Processes for corpify and threads for package (-1 for one per CPU core)")
+    parser.add_argument('--fts', action='store_true', help="Build the full-text index when corpifying")
+    parser.add_argument('--batch-size', type=int, default=64, help="Embedding batch size for index")
+    parser.add_argument('--model', default='hash-1024', help="Model of the 'hash' embedding method used by index, 'hash-<dimensions>'")
+    parser.add_argument('--queries', type=int, default=100, help="Number of queries per query stage")
+    parser.add_argument('--topk', type=int, default=5, help="Results per query")
+    parser.add_argument('--mode', choices=['dense', 'bm25', 'hybrid'], default='dense', help="Query mode, 'bm25' and 'hybrid' imply --fts")
+    parser.add_argument('--work-dir', help="Directory for the corpus and arags (default: a temporary directory, removed afterwards)")
+    parser.add_argument('--out', help="Write the results to this JSON file as well as stdout")
+    parser.add_argument('--verbose', action='store_true', help="Show the output of the arag tools on stderr")
+    args = parser.parse_args()
+    if args.mode != 'dense':
+        args.fts = True
+
+    if args.work_dir:
+        if os.path.exists(args.work_dir):
+            print(f"Error: {args.work_dir} already exists", file=sys.stderr)
+            sys.exit(1)
+        os.makedirs(args.work_dir)
+        work_dir = args.work_dir
+    else:
+        work_dir = tempfile.mkdtemp(prefix='arag-bench-')
+    try:
+        results = benchmark(args, work_dir)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('out', 'verbose', 'work_dir')},
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+    }
+    report.update(results)
+    output = json.dumps(report, indent=4)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+if __name__ == '__main__':
+    main()
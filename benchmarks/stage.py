@@ -0,0 +1,128 @@
+"""
+Run one benchmark stage in a fresh process, so its peak RSS and CPU time are its own.
+
+    python -m benchmarks.stage <config.json> <result.json>
+
+Used by benchmarks.run; the config names the stage and its paths and options.
+"""
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows
+
+ARAG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'arag')
+sys.path.insert(0, ARAG_DIR)
+
+from .corpus import generate_queries
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def cpu_seconds():
+    """CPU time of this process and of the worker processes it waited for (corpify --jobs)."""
+    cpu = time.process_time()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu += children.ru_utime + children.ru_stime
+    return cpu
+
+def run_add(config):
+    from tools.arag_ops import create
+    from tools.content import add
+    parent, name = os.path.split(config['arag_path'])
+    create(parent, name[:-len('-arag')])
+    add(config['arag_path'], config['source_path'])
+    return {}
+
+def run_corpify(config):
+    from tools.corpus import corpify
+    corpify(config['arag_path'], {'chunk_size': config['chunk_size'], 'jobs': config['jobs'],
+                                  'fts': config['fts'], 'force': True, 'yes': True})
+    return {}
+
+def run_index(config):
+    from tools.index import index
+    index(config['arag_path'], {'method': 'hash', 'model': config['model'],
+                                'batch_size': config['batch_size'], 'force': True})
+    return {}
+
+def run_package(config):
+    from tools.arag_ops import package
+    package(config['arag_path'], dest_path=config['packaged_path'], options={'jobs': config['jobs']})
+    return {}
+
+def run_unpackage(config):
+    from tools.arag_ops import unpackage
+    unpackage(config['packaged_path'])
+    return {}
+
+def run_query(config):
+    """Open a Retriever on the target arag, then answer the queries one at a time."""
+    from tools.retrieval import Retriever
+    queries = generate_queries(config['queries'], config['seed'])
+    options = {'mode': config['mode'], 'no_cache': True}
+    started = time.perf_counter()
+    retriever = Retriever(config['target'], options=options)
+    open_s = time.perf_counter() - started
+    latencies = []
+    try:
+        for text in queries:
+            started = time.perf_counter()
+            ids, _ = retriever.match([text], config['topk'])[0]
+            retriever.fetch(ids)
+            latencies.append(time.perf_counter() - started)
+    finally:
+        retriever.close()
+    latencies.sort()
+    return {
+        'queries': len(latencies),
+        'open_s': round(open_s, 4),
+        'query_s': round(sum(latencies), 4),
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies) * 1000, 3),
+            'p50': round(latencies[len(latencies) // 2] * 1000, 3),
+            'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 3),
+        },
+    }
+
+STAGES = {
+    'add': run_add,
+    'corpify': run_corpify,
+    'index': run_index,
+    'package': run_package,
+    'query': run_query,
+    'unpackage': run_unpackage,
+}
+
+def main():
+    config_path, result_path = sys.argv[1:3]
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+    from tools import metrics
+    metrics.enable()
+    cpu_started = cpu_seconds()
+    started = time.perf_counter()
+    # The tools report progress on stdout, keep it out of the benchmark output unless asked
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stderr if config.get('verbose') else devnull):
+        result = STAGES[config['stage']](config)
+    result.update({
+        'wall_s': round(time.perf_counter() - started, 4),
+        'cpu_s': round(cpu_seconds() - cpu_started, 4),
+        'peak_rss_mb': peak_rss_mb(),
+        'steps': metrics.report(),  # Breakdown of the stage, see tools/metrics.py
+    })
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+
+if __name__ == '__main__':
+    main()
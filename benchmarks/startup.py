@@ -0,0 +1,84 @@
+"""
+Startup-time regression check for the arag CLI.
+
+Runs light subcommands under `python -X importtime` and fails if they import a heavy dependency
+(numpy, apsw, the embedding clients, the document readers) or if importing takes longer than
+the threshold. Run it from the repository root:
+
+    python benchmarks/startup.py [--threshold-ms 150] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ARAG_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'arag', 'arag.py')
+
+# Modules that only the subcommands needing them may load
+HEAVY_MODULES = ['numpy', 'apsw', 'openai', 'sentence_transformers', 'torch', 'hnswlib', 'pypdf', 'spire']
+
+def import_profile(args, cwd):
+    """
+    Run the CLI with -X importtime.
+
+    Returns:
+        tuple: (set of top-level packages imported, total import time in milliseconds).
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', ARAG_SCRIPT] + args, cwd=cwd,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    # The CLI reports most errors on stdout and exits with 0
+    if result.returncode != 0 or 'does not exist' in result.stdout or 'Error' in result.stdout:
+        raise RuntimeError(f"arag {' '.join(args)} failed:\n{result.stdout}{result.stderr}")
+    modules = set()
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        modules.add(name.strip().split('.')[0])
+        if not name.startswith('  '):  # Nested imports are already counted in their parent's cumulative time
+            total_us += int(cumulative)
+    return modules, total_us / 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that light arag subcommands start fast")
+    parser.add_argument('--threshold-ms', type=float, default=150.0, help="Maximum import time of a subcommand, in milliseconds")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per subcommand, the fastest one is compared with the threshold")
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        arag_path = os.path.join(tmp, 'bench-arag')
+        # Commands that change the arag run once, in order, the others args.repeat times
+        commands = [
+            ('help', ['--help'], True),
+            ('create dir', ['create', 'dir', 'bench', tmp], False),
+            ('content ls dir', ['content', 'ls', '--arag', arag_path], True),
+            ('package', ['package', arag_path, '--jobs', '1', '--remove-original'], False),
+            ('content ls file', ['content', 'ls', '--arag', arag_path[:-5] + '.arag'], True),
+            ('unpackage', ['unpackage', arag_path[:-5] + '.arag'], False),
+        ]
+        results = {}
+        failed = False
+        for label, command, repeat in commands:
+            runs = [import_profile(command, tmp) for _ in range(max(1, args.repeat) if repeat else 1)]
+            modules = set().union(*(run[0] for run in runs))
+            heavy = sorted(module for module in HEAVY_MODULES if module in modules)
+            import_ms = min(run[1] for run in runs)
+            ok = not heavy and import_ms <= args.threshold_ms
+            failed = failed or not ok
+            results[label] = {'import_ms': round(import_ms, 1), 'heavy_modules': heavy, 'ok': ok}
+
+    if args.json:
+        print(json.dumps({'threshold_ms': args.threshold_ms, 'commands': results}, indent=4))
+    else:
+        for label, result in results.items():
+            status = 'ok' if result['ok'] else 'FAIL'
+            heavy = f", imports {', '.join(result['heavy_modules'])}" if result['heavy_modules'] else ''
+            print(f"{status:4}  arag {label:16} {result['import_ms']:7.1f} ms{heavy}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -22,7 +22,8 @@ setup(
         'Spire.Doc' # Required for DOCX parsing
     ],
     extras_require={
-        'local_embeddings': ['sentence-transformers']  # Optional dependency
+        'local_embeddings': ['sentence-transformers'],  # Optional dependency
+        'ann': ['hnswlib']  # Optional dependency for 'arag index --ann hnsw'
     },
     entry_points={
         'console_scripts': [